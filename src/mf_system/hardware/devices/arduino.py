@@ -1,7 +1,9 @@
 import serial
 import time
+import asyncio
 
 from mf_system.hardware.devices.interface import IHardwareAdapter
+from mf_system.hardware.devices.utils import read_response_async
 
 
 class ArduinoAdapter(IHardwareAdapter):
@@ -10,6 +12,7 @@ class ArduinoAdapter(IHardwareAdapter):
         self.baudrate = config["baudrate"]
         self.timeout = config["timeout"]
         self._connection = None
+        self._async_lock = None
 
     def initialize(self) -> bool:
         try:
@@ -49,6 +52,23 @@ class ArduinoAdapter(IHardwareAdapter):
         else:
             raise TimeoutError("No response from Arduino within the specified timeout.")
 
+    async def execute_async(self, command: dict) -> str:
+        return await self.send_command_async(command["action"])
+
+    async def send_command_async(self, cmd: str, timeout=30) -> str:
+        # One command at a time, otherwise the replies would get mixed up
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+
+        async with self._async_lock:
+            self._connection.write(bytes(cmd, "utf-8"))
+            feedback = await read_response_async(self._connection, timeout)
+
+        if feedback is None:
+            raise TimeoutError("No response from Arduino within the specified timeout.")
+        self.feedback = feedback
+        return feedback
+
     def shutdown(self) -> None:
         if self._connection.is_open:
             self._connection.close()
@@ -0,0 +1,212 @@
+import time
+
+from mf_system.hardware.devices.pump import SyringePumpAdapter
+from mf_system.hardware.devices.pump_lib.qmixsdk import qmixpump
+
+# Seconds to wait for the first filling of both syringes
+CONTIFLOW_INIT_TIMEOUT = 600
+
+# A dosage times out after volume / flow * factor + margin seconds
+DOSAGE_TIMEOUT_FACTOR = 1.5
+DOSAGE_TIMEOUT_MARGIN = 60
+
+
+class ContiFlowAdapter(SyringePumpAdapter):
+    """
+    Two syringe pumps paired into one continuous flow channel.
+
+    While one syringe dispenses the other one refills, the SDK switches the
+    valves and cross-fades the flows, so dosages of any volume run without
+    interruption. Configured in `hardware_config.yaml` like a single pump
+    plus the names of the two syringes:
+
+        solvent:
+          name: Nemesys_M_1_Pump
+          contiflow: [Nemesys_M_1_Pump, Nemesys_M_2_Pump]
+          pressure_limit: 10
+          inner_diameter_mm: 14.70520755382068
+          max_piston_stroke_mm: 60
+          flow: 0.05
+          crossflow_duration_s: 2.0  # optional
+          overlap_duration_s: 0.0  # optional
+          refill_flow: 0.5  # optional, half the max. refill flow by default
+          valve_positions: [1, 2, 0]  # optional, aspirate/dispense/closed
+
+    Both syringes need the same syringe size. "aspirate" and "refill"
+    commands are accepted and do nothing, the syringes are refilled by the
+    pump itself.
+    """
+
+    switches_valves = False
+
+    def __init__(self, config: dict):
+        super().__init__(config)
+        if len(config["contiflow"]) != 2:
+            raise ValueError(
+                f"ContiFlow pump {self.pump_name} needs two syringe pumps, "
+                f"got {config['contiflow']}"
+            )
+        self.syringe_names = list(config["contiflow"])
+        self.syringe_param = (
+            config["inner_diameter_mm"],
+            config["max_piston_stroke_mm"],
+        )
+        self.crossflow_duration = config.get("crossflow_duration_s", 2.0)
+        self.overlap_duration = config.get("overlap_duration_s", 0.0)
+        self.refill_flow = config.get("refill_flow")
+        self.valve_positions = config.get("valve_positions", [1, 2, 0])
+        self.init_timeout = config.get("init_timeout", CONTIFLOW_INIT_TIMEOUT)
+
+    def initialize(self) -> bool:
+        """
+        Initialize the syringe pumps and the continuous flow channel
+        """
+
+        try:
+            # Step 1. Connect to pumps controller
+            self.connect()
+
+            # Step 2. Enable the syringe pumps
+            self.syringes = []
+            for name in self.syringe_names:
+                syringe = qmixpump.Pump()
+                syringe.lookup_by_name(name)
+                if syringe.is_in_fault_state():
+                    syringe.clear_fault()
+                if not syringe.is_enabled():
+                    syringe.enable(True)
+                syringe.set_syringe_param(*self.syringe_param)
+                if not syringe.has_valve():
+                    raise ModuleNotFoundError(f"no valve installed at {name}")
+                self.syringes.append(syringe)
+
+            # Step 3. Pair them into one pump
+            self.pump = qmixpump.ContiFlowPump()
+            self.pump.create(*self.syringes)
+            self._configure()
+
+            # Step 4. Setup the unit (milli/s by default), the refill flow
+            # is given in the flow unit
+            self.set_units(
+                unit_prefix=qmixpump.UnitPrefix.milli,
+                time_unit=qmixpump.TimeUnit.per_second,
+            )
+            self._set_refill_flow()
+
+            # Step 5. Fill the syringes for the first dosage
+            self.pump.initialize()
+            deadline = time.monotonic() + self.init_timeout
+            while self.pump.is_initializing():
+                if time.monotonic() > deadline:
+                    self.pump.stop_pumping()
+                    raise TimeoutError(
+                        f"ContiFlow pump {self.pump_name} initialization timed out"
+                    )
+                time.sleep(0.1)
+            if not self.pump.is_initialized():
+                raise RuntimeError(
+                    f"ContiFlow pump {self.pump_name} failed to initialize"
+                )
+
+            # Step 6. Pressure sensors of both syringes
+            self.pressure_channels = [
+                self._open_pressure_channel(name) for name in self.syringe_names
+            ]
+            return True
+        except ConnectionError:
+            return False
+
+    def _configure(self):
+        """Switching mode, valves and timing of the continuous flow."""
+
+        properties = qmixpump.ContiFlowProperty
+        self.pump.set_device_property(
+            properties.SWITCHING_MODE, qmixpump.ContiFlowSwitchingMode.CROSS_FLOW
+        )
+        self.pump.set_device_property(
+            properties.CROSSFLOW_DURATION_S, self.crossflow_duration
+        )
+        self.pump.set_device_property(
+            properties.OVERLAP_DURATION_S, self.overlap_duration
+        )
+
+        aspirate, dispense, closed = self.valve_positions
+        for channel, syringe in enumerate(self.syringes):
+            self.pump.configure_contiflow_valve(
+                channel, 0, syringe.get_valve(), aspirate, dispense, closed
+            )
+
+    def _set_refill_flow(self):
+        properties = qmixpump.ContiFlowProperty
+        max_refill_flow = self.pump.get_device_property(properties.MAX_REFILL_FLOW)
+        if self.refill_flow is None:
+            self.refill_flow = max_refill_flow / 2
+        elif self.refill_flow > max_refill_flow:
+            raise ValueError(
+                f"Refill flow {self.refill_flow} of {self.pump_name} is over "
+                f"the max. of {max_refill_flow}"
+            )
+        self.pump.set_device_property(properties.REFILL_FLOW, self.refill_flow)
+        print(f"Refill flow: {self.refill_flow} {self.pump.get_flow_unit()}")
+
+    def execute(self, command: dict) -> str:
+        self.current_action = command["action"]
+        if command["action"] in ("aspirate", "refill"):
+            return True
+        elif command["action"] == "dispense":
+            return self.dispense(command["volume"], command["flow"])
+        elif command["action"] == "start_flow":
+            return self.start_flow(command["flow"])
+        elif command["action"] == "stop_pump":
+            return self.stop_pump()
+        raise ValueError(
+            f"ContiFlow pump {self.pump_name} does not support {command['action']}"
+        )
+
+    async def execute_async(self, command: dict) -> str:
+        if command["action"] != "dispense":
+            return self.execute(command)
+        self.current_action = command["action"]
+        self.pump.dispense(command["volume"], command["flow"])
+        return await self.wait_dosage_finished_async(
+            self.dosage_timeout(command["volume"], command["flow"])
+        )
+
+    def dispense(self, volume, flow, timeout=None):
+        """
+        Dispense a certain volume with a certain flow rate, the volume may
+        be larger than one syringe.
+
+        Without a timeout the dosage may take as long as `dosage_timeout`.
+        """
+
+        self.pump.dispense(volume, flow)
+        if timeout is None:
+            timeout = self.dosage_timeout(volume, flow)
+        return self.wait_dosage_finished(timeout)
+
+    @staticmethod
+    def dosage_timeout(volume, flow) -> float:
+        """Seconds a dosage of any volume may take, from its nominal duration."""
+
+        return volume / abs(flow) * DOSAGE_TIMEOUT_FACTOR + DOSAGE_TIMEOUT_MARGIN
+
+    def start_flow(self, flow):
+        """
+        Start a continuous flow and return, it runs until `stop_pump`.
+        """
+
+        self.pump.generate_flow(flow)
+        return True
+
+    def _read_pressure(self) -> float:
+        # The dispensing syringe has the highest pressure
+        return max(channel.read_input() for channel in self.pressure_channels)
+
+    def switch_valve_to(self, position: int):
+        raise RuntimeError(
+            f"The valves of ContiFlow pump {self.pump_name} switch by themselves"
+        )
+
+    async def switch_valve_to_async(self, position: int):
+        self.switch_valve_to(position)
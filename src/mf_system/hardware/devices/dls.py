@@ -1,4 +1,5 @@
 import time
+import asyncio
 
 import serial
 from tqdm import tqdm
@@ -9,8 +10,36 @@ from mf_system.hardware.devices.utils import (
     RequestFailed,
     UnexpectedResponse,
     ErrorOccurred,
+    read_response_async,
 )
 
+DATA_COMMANDS = {
+    "Sample Loading": bytes([0x37, 1]),
+    "Mean Volume Diameter": bytes([0x37, 2]),
+    "Mean Area Diameter": bytes([0x37, 3]),
+    "Mean Number Diameter": bytes([0x37, 4]),
+    "Percentiles": bytes([0x37, 5]),
+}
+
+HEADERS = [
+    "Time",
+    "Run",
+    "Loading Index",
+    "Mean volume diameter",
+    "Mean area diameter",
+    "Mean number diameter",
+    "d(10%)",
+    "d(20%)",
+    "d(30%)",
+    "d(40%)",
+    "d(50%)",
+    "d(60%)",
+    "d(70%)",
+    "d(80%)",
+    "d(90%)",
+    "d(95%)",
+]
+
 
 class DLSAdapter(IHardwareAdapter):
     """
@@ -29,6 +58,7 @@ class DLSAdapter(IHardwareAdapter):
         self.baudrate = config["baudrate"]
         self.timeout = config["timeout"]
         self._connection = None
+        self._async_lock = None
 
     def initialize(self, skip_com_check=False) -> bool:
         """
@@ -67,6 +97,21 @@ class DLSAdapter(IHardwareAdapter):
         else:
             raise ValueError(f"Unsupported command: {command["action"]}")
 
+    async def execute_async(self, command: dict) -> str:
+        # The DLS answers one request at a time
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+
+        async with self._async_lock:
+            if command["action"] == "select_measurement_setup":
+                return await self.select_measurement_setup_async(command["id"])
+            elif command["action"] == "request_data":
+                return await self.request_data_async(
+                    command["num_of_runs"], command["save_path"]
+                )
+            else:
+                raise ValueError(f"Unsupported command: {command["action"]}")
+
     def shutdown(self) -> None:
         if self._connection.is_open:
             self._connection.close()
@@ -105,6 +150,21 @@ class DLSAdapter(IHardwareAdapter):
         else:
             raise TimeoutError("No response from DLS within the specified timeout.")
 
+    async def send_command_async(self, cmd: bytes, timeout=5) -> str:
+        """
+        Asyncio variant of `send_command`.
+
+        The reply is polled without blocking the event loop, so a long `run`
+        does not occupy a thread while the DLS is measuring.
+        """
+
+        self._connection.write(cmd)
+        feedback = await read_response_async(self._connection, timeout)
+        if feedback is None:
+            raise TimeoutError("No response from DLS within the specified timeout.")
+        self.feedback = feedback
+        return feedback
+
     def com_check(self):
         """
         Verifies that the RS232 communications link is active.
@@ -147,6 +207,16 @@ class DLSAdapter(IHardwareAdapter):
 
         cmd = bytes([0x36, setup_index])
         feedback = self.send_command(cmd=cmd)
+        self._check_setup_feedback(feedback)
+
+    async def select_measurement_setup_async(self, setup_index: int):
+        """Asyncio variant of `select_measurement_setup`."""
+
+        feedback = await self.send_command_async(cmd=bytes([0x36, setup_index]))
+        self._check_setup_feedback(feedback)
+
+    @staticmethod
+    def _check_setup_feedback(feedback: str):
         if feedback == "K":
             print("Measurement Setup Selection Successful")
         elif feedback == "N":
@@ -199,6 +269,16 @@ class DLSAdapter(IHardwareAdapter):
 
         cmd = bytes([0x34])
         feedback = self.send_command(cmd=cmd, timeout=500)
+        self._check_run_feedback(feedback)
+
+    async def run_async(self):
+        """Asyncio variant of `run`."""
+
+        feedback = await self.send_command_async(cmd=bytes([0x34]), timeout=500)
+        self._check_run_feedback(feedback)
+
+    @staticmethod
+    def _check_run_feedback(feedback: str):
         if feedback == "K":
             pass
         elif feedback == "N":
@@ -229,38 +309,8 @@ class DLSAdapter(IHardwareAdapter):
             UnexpectedResponse: If the device returns an unexpected response.
         """
 
-        DATA_COMMANDS = {
-            "Sample Loading": bytes([0x37, 1]),
-            "Mean Volume Diameter": bytes([0x37, 2]),
-            "Mean Area Diameter": bytes([0x37, 3]),
-            "Mean Number Diameter": bytes([0x37, 4]),
-            "Percentiles": bytes([0x37, 5]),
-        }
-
-        headers = [
-            "Time",
-            "Run",
-            "Loading Index",
-            "Mean volume diameter",
-            "Mean area diameter",
-            "Mean number diameter",
-            "d(10%)",
-            "d(20%)",
-            "d(30%)",
-            "d(40%)",
-            "d(50%)",
-            "d(60%)",
-            "d(70%)",
-            "d(80%)",
-            "d(90%)",
-            "d(95%)",
-        ]
-
-        # Flag
-        isFinished = False
-
         # DataFrame to store all measurements
-        results_df = pd.DataFrame(columns=headers)
+        results_df = pd.DataFrame(columns=HEADERS)
 
         for run_id in tqdm(range(num_of_runs), desc="Measurements Running: "):
             # Run measurement once
@@ -269,25 +319,53 @@ class DLSAdapter(IHardwareAdapter):
 
             for cmd in DATA_COMMANDS.values():
                 feedback = self.send_command(cmd=cmd)
-                feedback_list = str(feedback).split()
-
-                if feedback_list[0] == "K":
-                    # Extract the Percentile Value from Percentile
-                    if len(feedback_list) != 2:
-                        data_line.extend(feedback_list[2::2])
-                    # Extract Data Value
-                    else:
-                        data_line.extend(feedback_list[1:])
-                elif feedback_list[0] == "N":
-                    raise RequestFailed("Invalid Data Request")
-                else:
-                    raise UnexpectedResponse(f"Unexpected response: {feedback_list[0]}")
+                data_line.extend(self._parse_data_feedback(feedback))
 
             # Add the new row with current measurement to the DataFrame
             results_df.loc[len(results_df)] = data_line
 
+        return self._save_results(results_df, save_path)
+
+    async def request_data_async(self, num_of_runs: int, save_path: str) -> bool:
+        """Asyncio variant of `request_data`."""
+
+        results_df = pd.DataFrame(columns=HEADERS)
+
+        for run_id in range(num_of_runs):
+            await self.run_async()
+            data_line = [time.asctime(), run_id + 1]
+
+            for cmd in DATA_COMMANDS.values():
+                feedback = await self.send_command_async(cmd=cmd)
+                data_line.extend(self._parse_data_feedback(feedback))
+
+            results_df.loc[len(results_df)] = data_line
+
+        return self._save_results(results_df, save_path)
+
+    @staticmethod
+    def _parse_data_feedback(feedback: str) -> list:
+        """Extract the data values of one data request."""
+
+        feedback_list = str(feedback).split()
+
+        if feedback_list[0] == "K":
+            # Extract the Percentile Value from Percentile
+            if len(feedback_list) != 2:
+                return feedback_list[2::2]
+            # Extract Data Value
+            return feedback_list[1:]
+        elif feedback_list[0] == "N":
+            raise RequestFailed("Invalid Data Request")
+        else:
+            raise UnexpectedResponse(f"Unexpected response: {feedback_list[0]}")
+
+    @staticmethod
+    def _save_results(results_df: pd.DataFrame, save_path: str) -> bool:
+        """Append the average row and the signal quality and save the csv file."""
+
         # Calculate mean values for numeric columns
-        numeric_columns = headers[2:]  # Exclude "Time", "Run" and "Signal Quality"
+        numeric_columns = HEADERS[2:]  # Exclude "Time", "Run" and "Signal Quality"
         mean_values = results_df[numeric_columns].astype(float).mean()
 
         avg_row = [
@@ -313,9 +391,8 @@ class DLSAdapter(IHardwareAdapter):
         # Save the results to a CSV file
         results_df.to_csv(save_path, index=False)
 
-        isFinished = True
         print(f"Measurement finished, data is saved under {save_path}")
-        return isFinished
+        return True
 
 
 if __name__ == "__main__":
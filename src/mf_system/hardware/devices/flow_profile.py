@@ -0,0 +1,237 @@
+import math
+import time
+import threading
+from collections import namedtuple
+from typing import Dict, List
+
+import numpy as np
+
+# One piece of a flow profile, the flow ramps linearly from `start` to `end`
+# within `duration` seconds. Flows in the flow unit of the pump, negative
+# flows aspirate.
+Segment = namedtuple("Segment", ["duration", "start", "end"])
+
+# Delivered profile of one pump, see `ProfileStreamer.report`. Volumes in
+# the volume unit of the pump, the flow errors compare the measured flow
+# with the setpoint in effect. `aborted` is True if the pressure limit or
+# `stop` ended the profile early.
+ProfileReport = namedtuple(
+    "ProfileReport",
+    [
+        "planned_volume",
+        "delivered_volume",
+        "volume_error",
+        "rms_flow_error",
+        "max_flow_error",
+        "updates",
+        "max_jitter",
+        "aborted",
+    ],
+)
+
+
+class FlowProfile:
+    """
+    Piecewise linear flow schedule of one pump.
+
+    Args:
+        segments (list): `Segment`s or (duration, start, end) tuples, played
+            one after another. A flow step is a segment with start == end.
+
+    Raises:
+        ValueError: A duration is not positive, or the flow changes its
+            direction (the valve stays in one position for the profile).
+    """
+
+    def __init__(self, segments: List[Segment]):
+        self.segments = [Segment(*segment) for segment in segments]
+        if not self.segments:
+            raise ValueError("A flow profile needs at least one segment")
+        if any(segment.duration <= 0 for segment in self.segments):
+            raise ValueError("Segment durations must be positive")
+        flows = np.array([(s.start, s.end) for s in self.segments])
+        if (flows > 0).any() and (flows < 0).any():
+            raise ValueError("A flow profile can not dispense and aspirate")
+
+        self.starts = np.concatenate(([0.0], np.cumsum([s.duration for s in self])))
+        self._flows = flows
+
+    @classmethod
+    def of(cls, profile) -> "FlowProfile":
+        """The profile itself, or a profile of a list of segments."""
+        return profile if isinstance(profile, cls) else cls(profile)
+
+    @classmethod
+    def steps(cls, flows: list, step_duration: float) -> "FlowProfile":
+        """Constant flows of `step_duration` seconds each."""
+        return cls([(step_duration, flow, flow) for flow in flows])
+
+    @classmethod
+    def ramp(cls, start: float, end: float, duration: float) -> "FlowProfile":
+        return cls([(duration, start, end)])
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    @property
+    def duration(self) -> float:
+        return float(self.starts[-1])
+
+    @property
+    def dispenses(self) -> bool:
+        return bool((self._flows >= 0).all())
+
+    def flow_at(self, t):
+        """Flow at the times t (seconds from the start), 0 after the end."""
+        t = np.asarray(t, dtype=float)
+        index = np.clip(np.searchsorted(self.starts, t, "right") - 1, 0, None)
+        inside = (t >= 0) & (index < len(self.segments))
+        index = np.minimum(index, len(self.segments) - 1)
+        duration = self.starts[index + 1] - self.starts[index]
+        share = (t - self.starts[index]) / duration
+        start, end = self._flows[index, 0], self._flows[index, 1]
+        return np.where(inside, start + (end - start) * share, 0.0)
+
+    def volume(self, t0: float = 0.0, t1: float = None) -> float:
+        """Volume of the profile between t0 and t1, exact for linear pieces."""
+        t1 = self.duration if t1 is None else t1
+        t0, t1 = max(t0, 0.0), min(t1, self.duration)
+        if t1 <= t0:
+            return 0.0
+        # Breakpoints inside the interval, the flow is linear in between
+        times = np.concatenate(
+            ([t0], self.starts[(self.starts > t0) & (self.starts < t1)], [t1])
+        )
+        middle = (times[:-1] + times[1:]) / 2
+        return float(np.sum(self.flow_at(middle) * np.diff(times)))
+
+    @property
+    def total_volume(self) -> float:
+        return self.volume()
+
+
+class ProfileStreamer:
+    """
+    Play flow profiles on several pumps from one timer thread.
+
+    Every `interval` seconds the thread checks the pressure of each pump,
+    records a telemetry row and sends the mean flow of the coming interval
+    with `generate_flow`, so ramps deliver their planned volume and all
+    pumps follow one clock. The ticks are scheduled on absolute times, late
+    ticks do not add up. A pump over its pressure limit is stopped, like in
+    `wait_dosage_finished`, the other pumps keep their profiles.
+
+    Args:
+        profiles (dict): {SyringePumpAdapter: FlowProfile}.
+        interval (float): Seconds between two setpoint updates.
+        clock (callable): Time source, `time.perf_counter` by default.
+    """
+
+    def __init__(self, profiles: Dict, interval: float = 0.1, clock=time.perf_counter):
+        self.profiles = profiles
+        self.interval = interval
+        self.clock = clock
+        # {adapter: [(time, setpoint in effect, measured flow)]}
+        self.samples = {adapter: [] for adapter in profiles}
+        self.updates = {adapter: 0 for adapter in profiles}
+        self.aborted = set()
+        self.max_jitter = 0.0
+        self.error = None
+        self._setpoints = {adapter: 0.0 for adapter in profiles}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def duration(self) -> float:
+        return max(profile.duration for profile in self.profiles.values())
+
+    def start(self) -> "ProfileStreamer":
+        for adapter in self.profiles:
+            adapter.telemetry.begin("profile")
+        self._thread = threading.Thread(
+            target=self._run, name="ProfileStreamer", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """End all profiles early."""
+        self._stop.set()
+        self.join()
+
+    def join(self, timeout: float = None) -> bool:
+        """Wait for the end of the profiles, raise the error of the thread."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                return False
+        if self.error is not None:
+            raise self.error
+        return True
+
+    def _run(self):
+        started = self.clock()
+        tick = 0
+        try:
+            while True:
+                scheduled = started + tick * self.interval
+                delay = scheduled - self.clock()
+                if delay > 0 and self._stop.wait(delay):
+                    self.aborted.update(self.profiles)
+                    break
+                now = self.clock()
+                self.max_jitter = max(self.max_jitter, now - scheduled)
+                if not self._tick(now - started):
+                    break
+                tick += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            for adapter in self.profiles:
+                adapter.pump.stop_pumping()
+                adapter.telemetry.end()
+
+    def _tick(self, t: float) -> bool:
+        """Update all running pumps, False once none is left."""
+        running = False
+        for adapter, profile in self.profiles.items():
+            if adapter in self.aborted:
+                continue
+            if not adapter._pressure_ok():
+                self.aborted.add(adapter)
+                continue
+            status = adapter._record_telemetry()
+            self.samples[adapter].append((t, self._setpoints[adapter], status.flow_is))
+            if t >= profile.duration:
+                if self._setpoints[adapter] != 0.0:
+                    adapter.pump.stop_pumping()
+                    self._setpoints[adapter] = 0.0
+                continue
+
+            running = True
+            flow = profile.volume(t, t + self.interval) / self.interval
+            if not math.isclose(flow, self._setpoints[adapter], abs_tol=1e-12):
+                adapter.pump.generate_flow(flow)
+                self._setpoints[adapter] = flow
+                self.updates[adapter] += 1
+        return running
+
+    def report(self, adapter) -> ProfileReport:
+        """Planned against delivered profile of a pump."""
+        profile = self.profiles[adapter]
+        samples = np.array(self.samples[adapter]).reshape(-1, 3)
+        t, setpoint, flow = samples.T
+        planned = profile.volume(0.0, t[-1] if len(t) else 0.0)
+        # Measured flow integrated over the ticks
+        delivered = float(np.sum((flow[1:] + flow[:-1]) / 2 * np.diff(t)))
+        error = flow[1:] - setpoint[1:]
+        return ProfileReport(
+            planned_volume=planned,
+            delivered_volume=delivered,
+            volume_error=delivered - planned,
+            rms_flow_error=float(np.sqrt(np.mean(error**2))) if len(error) else 0.0,
+            max_flow_error=float(np.abs(error).max(initial=0.0)),
+            updates=self.updates[adapter],
+            max_jitter=self.max_jitter,
+            aborted=adapter in self.aborted,
+        )
@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 from typing import Any, Dict
 
@@ -13,6 +14,15 @@ class IHardwareAdapter(ABC):
         """Implement the command"""
         pass
 
+    async def execute_async(self, command: Dict[str, Any]) -> Any:
+        """
+        Implement the command without blocking the event loop.
+
+        Adapters with a native asyncio implementation override this, the
+        default runs the blocking `execute` in a worker thread of the loop.
+        """
+        return await asyncio.to_thread(self.execute, command)
+
     @abstractmethod
     def shutdown(self) -> None:
         """Shutdown the connection"""
@@ -1,30 +1,254 @@
 import os
 import time
+import asyncio
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import Future, wait
+
+import numpy as np
 
 from mf_system.hardware.devices.interface import IHardwareAdapter
+from mf_system.hardware.devices.flow_profile import FlowProfile, ProfileStreamer
+from mf_system.hardware.devices.telemetry import PumpTelemetry
 from mf_system.hardware.devices.pump_lib.qmixsdk import qmixbus, qmixpump, qmixanalogio
 
+# Valve position polling, doubled from start to max until it settles
+VALVE_POLL_START = 0.01
+VALVE_POLL_MAX = 0.1
+
+# Seconds between two setpoint updates of a flow profile
+PROFILE_INTERVAL = 0.1
+
+# Result of `SyringePumpAdapter.dose_group`: {pump: result}, {pump: start
+# time (perf_counter)} and the spread of the start times in seconds
+GroupDosing = namedtuple("GroupDosing", ["results", "starts", "start_skew"])
+
+
+class _Dosage:
+    """A running dosage watched by the `DosingMonitor`."""
+
+    def __init__(self, adapter, timeout_seconds: float):
+        self.adapter = adapter
+        self.future = Future()
+        now = time.monotonic()
+        self.deadline = now + timeout_seconds
+        self.last_report = now
+
+
+class DosingMonitor:
+    """
+    One thread watching the dosages of all pumps on the bus.
+
+    Instead of one polling loop per pump thread, every running dosage is
+    registered here and checked in a single sweep: pressure and
+    `is_pumping` of each active pump, the progress message every
+    `report_interval`. When a dosage ends its future is resolved with
+    True, False if it was stopped over the pressure limit, or a
+    `TimeoutError`. Without active dosages the thread sleeps, so the bus
+    traffic depends on the sweep rate and the running dosages only.
+
+    Like the `BusSession` the monitor is shared by reference counting: every
+    connected pump acquires it and the last `release` stops the thread, so
+    one pump shutting down does not fail the dosages of the others.
+
+    Args:
+        interval (float): Seconds between two sweeps.
+        report_interval (float): Seconds between two progress messages of a
+            pump.
+    """
+
+    def __init__(self, interval: float = 0.1, report_interval: float = 0.5):
+        self.interval = interval
+        self.report_interval = report_interval
+        self.sweeps = 0
+        self.refs = 0
+        self._dosages = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def acquire(self) -> None:
+        with self._cond:
+            self.refs += 1
+
+    def release(self) -> None:
+        """Release one reference, the last one stops the thread."""
+        with self._cond:
+            if self.refs == 0:
+                return
+            self.refs -= 1
+            if self.refs:
+                return
+        self.stop()
+
+    def watch(self, adapter, timeout_seconds: float) -> Future:
+        """Watch the dosage just started on a pump until it has finished."""
+        dosage = _Dosage(adapter, timeout_seconds)
+        with self._cond:
+            self._stopped = False
+            self._dosages.append(dosage)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="DosingMonitor", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+        return dosage.future
+
+    def active(self) -> int:
+        return len(self._dosages)
+
+    def stop(self) -> None:
+        """Stop the thread, dosages still watched fail with a `RuntimeError`."""
+        with self._cond:
+            self._stopped = True
+            dosages, self._dosages = self._dosages, []
+            self._cond.notify()
+        for dosage in dosages:
+            dosage.future.set_exception(RuntimeError("Dosing monitor stopped"))
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._dosages and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+            time.sleep(self.interval)
+            self.sweep()
+
+    def sweep(self) -> None:
+        """Check every active pump once, resolve the finished dosages."""
+        self.sweeps += 1
+        with self._cond:
+            dosages = list(self._dosages)
+
+        finished = []
+        now = time.monotonic()
+        for dosage in dosages:
+            if dosage.future.done():
+                continue
+            try:
+                result = self._check(dosage, now)
+            except Exception as e:
+                finished.append(dosage)
+                dosage.future.set_exception(e)
+                continue
+            if result is not None:
+                finished.append(dosage)
+                dosage.future.set_result(result)
+
+        if finished:
+            with self._cond:
+                self._dosages = [d for d in self._dosages if d not in finished]
+
+    def _check(self, dosage: _Dosage, now: float):
+        """Return the result of a finished dosage, None while it is running."""
+        adapter = dosage.adapter
+        if now > dosage.deadline:
+            raise TimeoutError("Timeout!")
+        # Monitor the force if it is below the threshold
+        pressure_ok = adapter._pressure_ok()
+        report = now - dosage.last_report >= self.report_interval
+        # Saved telemetry takes a row per sweep, else one per report
+        status = None
+        if report or not pressure_ok or adapter.telemetry.directory is not None:
+            status = adapter._record_telemetry()
+        if not pressure_ok:
+            return False
+        if report:
+            adapter._print_progress()
+            dosage.last_report = now
+        # The snapshot of the telemetry row includes the dosing state
+        pumping = adapter.pump.is_pumping() if status is None else status.is_pumping
+        if not pumping:
+            return True
+        return None
+
+
+class BusSession:
+    """
+    The CAN bus of the pumps, shared by reference counting.
+
+    Every pump acquires the session when it is initialized and releases it
+    on shutdown. The bus is opened and started by the first `acquire` and
+    stopped and closed by the last `release`, so pumps can be initialized
+    and shut down in any order and from several threads.
+    """
+
+    def __init__(self, deviceconfig: str):
+        self.deviceconfig = deviceconfig
+        self.bus = None
+        self.refs = 0
+        self._lock = threading.Lock()
+
+    @property
+    def opened(self) -> bool:
+        return self.bus is not None
+
+    def acquire(self) -> "qmixbus.Bus":
+        with self._lock:
+            if self.bus is None:
+                print("Opening bus with deviceconfig ", self.deviceconfig)
+                bus = qmixbus.Bus()
+                bus.open(self.deviceconfig, "")
+                print("Starting bus communication...")
+                bus.start()
+                self.bus = bus
+            self.refs += 1
+            return self.bus
+
+    def release(self) -> None:
+        with self._lock:
+            if self.refs == 0:
+                return
+            self.refs -= 1
+            if self.refs == 0:
+                print("Closing bus...")
+                self.bus.stop()
+                self.bus.close()
+                self.bus = None
+                print("Bus closed")
+
 
 class SyringePumpAdapter(IHardwareAdapter):
-    _bus_opened = False
+    # False for pumps that switch their valves by themselves
+    switches_valves = True
+    # Shared by all pumps of the bus
+    bus_session = BusSession(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "pump_lib/PumpConfig")
+    )
+    monitor = DosingMonitor()
 
     def __init__(self, config: dict):
         super().__init__()
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        self.deviceconfig = os.path.join(script_dir, "pump_lib/PumpConfig")
+        self.deviceconfig = self.bus_session.deviceconfig
+        self._bus_acquired = False
         self.pump_name = config["name"]
         self.__pressure_limit = config["pressure_limit"]
         self.__inner_diameter_mm = config["inner_diameter_mm"]
         self.__max_piston_stroke_mm = config["max_piston_stroke_mm"]
+        # Readings of the dosages, saved per command with a telemetry_dir
+        self.telemetry = PumpTelemetry(self.pump_name, config.get("telemetry_dir"))
+        self.current_action = "dosage"
+        self.valve_timeout = config.get("valve_timeout", 2.0)
+        self.valve_settle_times = deque(maxlen=1000)
+        if "monitor_interval" in config:
+            raise ValueError(
+                "monitor_interval is shared by all pumps of the bus, "
+                "pass it to the HardwareManager instead"
+            )
 
-    @staticmethod
-    def connect(deviceconfig):
-        print("Opening bus with deviceconfig ", deviceconfig)
-        bus = qmixbus.Bus()
-        bus.open(deviceconfig, "")
-        __class__._bus_opened = True
-        print("Starting bus communication...")
-        bus.start()
+    def connect(self):
+        """Acquire the bus session and the dosing monitor, once per pump."""
+
+        if not self._bus_acquired:
+            self.bus_session.acquire()
+            self.monitor.acquire()
+            self._bus_acquired = True
 
     def initialize(self) -> bool:
         """
@@ -33,9 +257,7 @@ class SyringePumpAdapter(IHardwareAdapter):
 
         try:
             # Step 1. Connect to pumps controller
-            # Make sure bus only opened once
-            if not self._bus_opened:
-                SyringePumpAdapter.connect(self.deviceconfig)
+            self.connect()
 
             # Step 2. Create pump
             self.pump = qmixpump.Pump()
@@ -62,27 +284,35 @@ class SyringePumpAdapter(IHardwareAdapter):
             self.switch_valve_to(0)
 
             # Step 6. Initialize pressure sensor
-            self.pressure_channel = qmixanalogio.AnalogInChannel()
-            self.pressure_channel.lookup_channel_by_name(f"{self.pump_name[:-5]}_AnIN1")
-            self.current_pressure_sensor_status = self.pressure_channel.read_status()
-            self.pressure_channel.enable_software_scaling(True)
-            self.pressure_channel.set_scaling_param(0.05, -25)
-            print(f"Current sensor status: {self.current_pressure_sensor_status}")
-            print(
-                f"Current scaling factors: {self.pressure_channel.get_scaling_param()}"
-            )
+            self.pressure_channel = self._open_pressure_channel(self.pump_name)
 
             # Step 5. Setup the unit (milli/s by default)
             self.set_units(
                 unit_prefix=qmixpump.UnitPrefix.milli,
                 time_unit=qmixpump.TimeUnit.per_second,
             )
+            return True
         except ConnectionError:
             return False
 
+    def _open_pressure_channel(self, pump_name: str):
+        """Open the analog input of the pressure sensor of a syringe pump."""
+
+        channel = qmixanalogio.AnalogInChannel()
+        channel.lookup_channel_by_name(f"{pump_name[:-5]}_AnIN1")
+        self.current_pressure_sensor_status = channel.read_status()
+        channel.enable_software_scaling(True)
+        channel.set_scaling_param(0.05, -25)
+        print(f"Current sensor status: {self.current_pressure_sensor_status}")
+        print(f"Current scaling factors: {channel.get_scaling_param()}")
+        return channel
+
     def execute(self, command: dict) -> str:
+        self.current_action = command["action"]
         if command["action"] == "aspirate":
-            return self.aspirate(command["volume"], command["flow"])
+            return self.aspirate(
+                command["volume"], command["flow"], valve=command.get("valve", True)
+            )
         elif command["action"] == "dispense":
             return self.dispense(command["volume"], command["flow"])
         elif command["action"] == "refill":
@@ -91,6 +321,35 @@ class SyringePumpAdapter(IHardwareAdapter):
             return self.empty(command["flow"])
         elif command["action"] == "stop_pump":
             return self.stop_pump()
+        elif command["action"] == "profile":
+            return self.run_profile(
+                FlowProfile.of(command["segments"]),
+                command.get("interval", PROFILE_INTERVAL),
+            )
+
+    async def execute_async(self, command: dict) -> str:
+        self.current_action = command["action"]
+        if command["action"] == "aspirate":
+            return await self._dose_async(
+                1 if command.get("valve", True) else None,
+                self.pump.aspirate,
+                command["volume"],
+                command["flow"],
+            )
+        elif command["action"] == "dispense":
+            return await self._dose_async(
+                2, self.pump.dispense, command["volume"], command["flow"]
+            )
+        elif command["action"] == "refill":
+            return await self._dose_async(
+                1, self.pump.generate_flow, 0 - command["flow"], timeout=1200
+            )
+        elif command["action"] == "empty":
+            return await self._dose_async(
+                2, self.pump.generate_flow, command["flow"], timeout=1200
+            )
+        elif command["action"] == "stop_pump":
+            return self.stop_pump()
 
     def shutdown(self) -> None:
         SyringePumpAdapter.stop_all_pumps()
@@ -102,30 +361,55 @@ class SyringePumpAdapter(IHardwareAdapter):
         until the timeout occurs.
         """
 
-        timer = qmixbus.PollingTimer(timeout_seconds * 1000)
-        message_timer = qmixbus.PollingTimer(500)
-        result = True
-        while result:
-            if timer.is_expired():
-                raise TimeoutError("Timeout!")
-            # Monitor the force if it is below the threshold
-            current_pressure = self.pressure_channel.read_input()
-            if current_pressure >= self.__pressure_limit:
-                print(
-                    f"Warning: Current pressure {current_pressure} is over the limit. Pump stops!"
-                )
-                self.pump.stop_pumping()
-                break
+        self.telemetry.begin(self.current_action)
+        try:
+            return self.monitor.watch(self, timeout_seconds).result()
+        finally:
+            self.telemetry.end()
 
-            time.sleep(0.1)
-            if message_timer.is_expired():
-                print(
-                    f"{self.pump_name} - Dosed vol.: {self.pump.get_dosed_volume():.6f}, Flow rate: {self.pump.get_flow_is():.6f}, Fill level: {self.pump.get_fill_level():.6f}, Current pressure: {current_pressure:.2f}"
-                )
-                message_timer.restart()
+    async def wait_dosage_finished_async(self, timeout_seconds):
+        """
+        Asyncio variant of `wait_dosage_finished`, the pump is polled without
+        blocking the event loop.
+        """
 
-            result = self.pump.is_pumping()
-        return not result
+        self.telemetry.begin(self.current_action)
+        try:
+            return await asyncio.wrap_future(self.monitor.watch(self, timeout_seconds))
+        finally:
+            self.telemetry.end()
+
+    def _pressure_ok(self) -> bool:
+        """Read the pressure sensor and stop the pump if it is over the limit."""
+
+        self.current_pressure = self._read_pressure()
+        if self.current_pressure >= self.__pressure_limit:
+            print(
+                f"Warning: Current pressure {self.current_pressure} is over the limit. Pump stops!"
+            )
+            self.pump.stop_pumping()
+            return False
+        return True
+
+    def _read_pressure(self) -> float:
+        return self.pressure_channel.read_input()
+
+    def _record_telemetry(self) -> "qmixpump.PumpStatus":
+        status = self.pump.read_status_snapshot()
+        self.telemetry.record(
+            time.time(),
+            self.current_pressure,
+            status.flow_is,
+            status.fill_level,
+            status.dosed_volume,
+        )
+        return status
+
+    def _print_progress(self):
+        _, pressure, flow, fill_level, dosed_volume = self.telemetry.last
+        print(
+            f"{self.pump_name} - Dosed vol.: {dosed_volume:.6f}, Flow rate: {flow:.6f}, Fill level: {fill_level:.6f}, Current pressure: {pressure:.2f}"
+        )
 
     def set_units(self, unit_prefix, time_unit):
         """
@@ -140,16 +424,22 @@ class SyringePumpAdapter(IHardwareAdapter):
         max_flow = self.pump.get_flow_rate_max()
         print(f"Max. flow: {max_flow} {self.pump.get_flow_unit()}")
 
-    def aspirate(self, volume, flow, timeout=600):
+    def aspirate(self, volume, flow, timeout=600, valve=True):
         """
         Aspirate a certain volume with a certain flow rate.
+
+        With `valve=False` the valve is left as it is, the caller switched
+        the valves of several pumps together, see
+        `HardwareManager.switch_valves`.
         """
 
-        self.switch_valve_to(1)
+        if valve:
+            self.switch_valve_to(1)
         self.pump.aspirate(volume, flow)
 
         isFinished = self.wait_dosage_finished(timeout)
-        self.switch_valve_to(0)
+        if valve:
+            self.switch_valve_to(0)
         return isFinished
 
     def dispense(self, volume, flow, timeout=600):
@@ -196,6 +486,26 @@ class SyringePumpAdapter(IHardwareAdapter):
         isFinished = self.wait_dosage_finished(timeout)
         return isFinished
 
+    async def _dose_async(self, valve_position, start, *args, timeout=600):
+        """
+        Switch the valve, start a dosage and wait for it without blocking the
+        event loop. The valve is closed again afterwards. A `valve_position`
+        of None leaves the valve to the caller.
+        """
+
+        if valve_position is not None:
+            await self.switch_valve_to_async(valve_position)
+        start(*args)
+        isFinished = await self.wait_dosage_finished_async(timeout)
+        if valve_position is not None:
+            await self.switch_valve_to_async(0)
+        return isFinished
+
+    async def switch_valve_to_async(self, position: int):
+        """Asyncio variant of `switch_valve_to`."""
+
+        await SyringePumpAdapter.switch_valves_async({self: position})
+
     def switch_valve_to(self, position: int):
         """
         Switch the valve to a certain position.
@@ -203,13 +513,179 @@ class SyringePumpAdapter(IHardwareAdapter):
         0: Close, 1: Aspirate, 2: Dispense
         """
 
-        self.valve.switch_valve_to_position(position)
-        time.sleep(0.5)  # give valve some time to move to target
+        SyringePumpAdapter.switch_valves({self: position})
+
+    @staticmethod
+    def switch_valves(positions: dict) -> None:
+        """
+        Switch the valves of several pumps together.
+
+        All switch commands are sent first, then the positions are polled
+        with a growing interval until every valve reports its target. The
+        pumps must not be dosing.
+
+        Args:
+            positions (dict): {SyringePumpAdapter: position}.
+
+        Raises:
+            RuntimeError: A valve did not reach its position within its
+                `valve_timeout`.
+        """
+
+        pending, started = SyringePumpAdapter._start_switch(positions)
+        delay = VALVE_POLL_START
+        while not SyringePumpAdapter._valves_settled(pending, started):
+            time.sleep(delay)
+            delay = min(delay * 2, VALVE_POLL_MAX)
+
+    @staticmethod
+    async def switch_valves_async(positions: dict) -> None:
+        """Asyncio variant of `switch_valves`."""
+
+        pending, started = SyringePumpAdapter._start_switch(positions)
+        delay = VALVE_POLL_START
+        while not SyringePumpAdapter._valves_settled(pending, started):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, VALVE_POLL_MAX)
+
+    @staticmethod
+    def _start_switch(positions: dict):
+        started = time.perf_counter()
+        for adapter, position in positions.items():
+            adapter.valve.switch_valve_to_position(position)
+        return dict(positions), started
+
+    @staticmethod
+    def _valves_settled(pending: dict, started: float) -> bool:
+        """Drop the valves at their position, True once none is left."""
+
+        elapsed = time.perf_counter() - started
+        for adapter, position in list(pending.items()):
+            # Ensure the valve is in the right position
+            if adapter.valve.actual_valve_position() == position:
+                adapter.valve_settle_times.append(elapsed)
+                del pending[adapter]
+            elif elapsed > adapter.valve_timeout:
+                raise RuntimeError(
+                    f"Valve of {adapter.pump_name} failed to be switched"
+                )
+        return not pending
+
+    @staticmethod
+    def dose_group(commands: dict, timeout_seconds=600, finished=None) -> GroupDosing:
+        """
+        Dispense from several pumps with synchronized starts.
+
+        The valves of all pumps are switched to dispense and settled first,
+        then the pumps are started right after one another, so the start
+        skew is the time of the start calls only and the mixing ratio holds
+        from the first drop. The dosages are watched by the `DosingMonitor`,
+        the valves are closed together at the end.
+
+        Args:
+            commands (dict): {SyringePumpAdapter: dispense command}.
+            finished (callable, optional): Called with (adapter, result) as
+                soon as the dosage of a pump finished, also when another
+                pump of the group fails.
+        """
+
+        valves = [adapter for adapter in commands if adapter.switches_valves]
+        SyringePumpAdapter.switch_valves({adapter: 2 for adapter in valves})
+        for adapter, command in commands.items():
+            adapter.current_action = command["action"]
+            adapter.telemetry.begin(adapter.current_action)
 
-        # Ensure the valve is in the right position
-        valve_pos_is = self.valve.actual_valve_position()
-        if not (valve_pos_is == position):
-            raise RuntimeError("Valve failed to be switched")
+        starts, futures = {}, {}
+        try:
+            for adapter, command in commands.items():
+                adapter.pump.dispense(command["volume"], command["flow"])
+                starts[adapter] = time.perf_counter()
+            for adapter in commands:
+                futures[adapter] = adapter.monitor.watch(adapter, timeout_seconds)
+                if finished is not None:
+                    futures[adapter].add_done_callback(
+                        lambda future, adapter=adapter: future.exception() is None
+                        and finished(adapter, future.result())
+                    )
+            wait(futures.values())
+            results = {adapter: future.result() for adapter, future in futures.items()}
+        finally:
+            if len(futures) < len(starts):
+                # A start failed, do not leave the others dosing
+                for adapter in starts:
+                    adapter.pump.stop_pumping()
+            for adapter in commands:
+                adapter.telemetry.end()
+            SyringePumpAdapter.switch_valves({adapter: 0 for adapter in valves})
+
+        start_skew = max(starts.values()) - min(starts.values())
+        return GroupDosing(results, starts, start_skew)
+
+    def run_profile(self, profile: FlowProfile, interval=PROFILE_INTERVAL):
+        """
+        Play a time-varying flow, see `run_profiles`.
+
+        Returns:
+            ProfileReport: Planned against delivered volume and flow.
+        """
+
+        return SyringePumpAdapter.run_profiles({self: profile}, interval)[self]
+
+    @staticmethod
+    def run_profiles(profiles: dict, interval=PROFILE_INTERVAL) -> dict:
+        """
+        Play flow profiles on several pumps on one clock.
+
+        The valves are switched to dispense or aspirate once, then the
+        setpoints are streamed with `generate_flow` by a `ProfileStreamer`,
+        e.g. opposite ramps of two pumps sweep the composition within one
+        bottle at a constant total flow, without stopping the pumps between
+        the steps. The pressure limit is checked on every update.
+
+        Args:
+            profiles (dict): {SyringePumpAdapter: FlowProfile}.
+            interval (float): Seconds between two setpoint updates.
+
+        Returns:
+            dict: {SyringePumpAdapter: ProfileReport}.
+        """
+
+        valves = {
+            adapter: 2 if profile.dispenses else 1
+            for adapter, profile in profiles.items()
+            if adapter.switches_valves
+        }
+        SyringePumpAdapter.switch_valves(valves)
+        for adapter in profiles:
+            adapter.current_action = "profile"
+        streamer = ProfileStreamer(profiles, interval)
+        try:
+            streamer.start().join()
+        finally:
+            SyringePumpAdapter.switch_valves({adapter: 0 for adapter in valves})
+
+        reports = {adapter: streamer.report(adapter) for adapter in profiles}
+        for adapter, report in reports.items():
+            print(
+                f"{adapter.pump_name} - Profile volume: {report.delivered_volume:.6f} "
+                f"of {report.planned_volume:.6f}, RMS flow error: "
+                f"{report.rms_flow_error:.6f}" + (", aborted" if report.aborted else "")
+            )
+        return reports
+
+    def valve_settle_stats(self) -> dict:
+        """Distribution of the recent valve settle times in seconds."""
+
+        times = np.array(self.valve_settle_times)
+        if not len(times):
+            return {"count": 0}
+        return {
+            "count": len(times),
+            "mean": float(times.mean()),
+            "p50": float(np.percentile(times, 50)),
+            "p95": float(np.percentile(times, 95)),
+            "max": float(times.max()),
+        }
 
     def stop_pump(self):
         """
@@ -230,15 +706,11 @@ class SyringePumpAdapter(IHardwareAdapter):
         Close bus communication.
         """
 
-        # Make sure bus only closed once
-        if self._bus_opened:
-            print("Closing bus...")
-            self.bus.stop()
-            self.bus.close()
-            self.__class__._bus_opened = True
-            print("Bus closed")
-        else:
-            print("Bus closed")
+        # The bus is closed and the monitor stopped by the last pump
+        if self._bus_acquired:
+            self._bus_acquired = False
+            self.monitor.release()
+            self.bus_session.release()
 
 
 if __name__ == "__main__":
@@ -5,6 +5,12 @@ from . import _qmixloadlib
 
 analogio_api = _qmixloadlib.load_lib("labbCAN_AnalogIO_API")
 
+# Prototype of read_input(), declared once at load time, it is polled while
+# a dosage runs
+analogio_api.LCAIO_ReadInput.argtypes = [ctypes.c_longlong,
+    ctypes.POINTER(ctypes.c_double)]
+analogio_api.LCAIO_ReadInput.restype = ctypes.c_long
+
 
 class AnalogChannel(qmixbus.HandleOwner):
     """
@@ -84,8 +90,9 @@ class AnalogInChannel(AnalogChannel):
         """
         Read analog input of this channel.
         """
+        # Allocated per call, the channel is read from several threads
         value = ctypes.c_double()
-        result = analogio_api.LCAIO_ReadInput(self.handle, ctypes.byref(value))
+        result = analogio_api.LCAIO_ReadInput(self.handle, value)
         qmixbus.throw_on_error(result)
         return value.value
 
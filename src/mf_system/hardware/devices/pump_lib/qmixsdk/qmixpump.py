@@ -8,6 +8,21 @@ from . import _qmixloadlib
 
 pump_api = _qmixloadlib.load_lib("labbCAN_Pump_API")
 
+# Prototypes of the functions polled while a dosage runs. Declared once at
+# load time so ctypes does not infer the argument conversions on each call.
+for _name in ("LCP_GetFlowIs", "LCP_GetDosedVolume", "LCP_GetFillLevel"):
+    _func = getattr(pump_api, _name)
+    _func.argtypes = [ctypes.c_longlong, ctypes.POINTER(ctypes.c_double)]
+    _func.restype = ctypes.c_long
+for _name in ("LCP_IsPumping", "LCP_IsEnabled", "LCP_IsInFaultState"):
+    _func = getattr(pump_api, _name)
+    _func.argtypes = [ctypes.c_longlong]
+    _func.restype = ctypes.c_long
+
+# Values of one pump read by read_status_snapshot()
+PumpStatus = namedtuple("PumpStatus",
+    ["is_pumping", "flow_is", "dosed_volume", "fill_level"])
+
 
 class VolumeUnit(IntEnum):
     """
@@ -254,8 +269,10 @@ class Pump(qmixbus.Device):
         """
         Read the actual flow rate.
         """
+        # Output buffers are allocated per call, the status of a pump is read
+        # from its lane and from the dosing monitor thread
         flow = ctypes.c_double()
-        result = pump_api.LCP_GetFlowIs(self.handle, ctypes.byref(flow))
+        result = pump_api.LCP_GetFlowIs(self.handle, flow)
         qmixbus.throw_on_error(result)
         return flow.value
 
@@ -277,7 +294,7 @@ class Pump(qmixbus.Device):
         Get the already dosed volume since last start of dosage.
         """
         volume = ctypes.c_double()
-        result = pump_api.LCP_GetDosedVolume(self.handle, ctypes.byref(volume))
+        result = pump_api.LCP_GetDosedVolume(self.handle, volume)
         qmixbus.throw_on_error(result)
         return volume.value
 
@@ -291,7 +308,7 @@ class Pump(qmixbus.Device):
         For a syringe pump this function returns the current syringe fill level
         """
         level = ctypes.c_double()
-        result = pump_api.LCP_GetFillLevel(self.handle, ctypes.byref(level))
+        result = pump_api.LCP_GetFillLevel(self.handle, level)
         qmixbus.throw_on_error(result)
         return level.value
 
@@ -305,6 +322,17 @@ class Pump(qmixbus.Device):
         return True if result > 0 else False
 
 
+    def read_status_snapshot(self):
+        """
+        Read the dosing state, actual flow, dosed volume and fill level in
+        one call.
+
+        This is what a dosage wait loop polls, see PumpStatus.
+        """
+        return PumpStatus(self.is_pumping(), self.get_flow_is(),
+            self.get_dosed_volume(), self.get_fill_level())
+
+
     def is_calibration_finished(self):
         """
         Checks if calibration is finished.
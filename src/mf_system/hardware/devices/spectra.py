@@ -0,0 +1,177 @@
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+# Bands are given as (start, end) wavelengths in nm
+Band = Tuple[float, float]
+
+
+def _stack(spectra) -> np.ndarray:
+    """(samples x pixels) float array of one or more spectra."""
+    return np.atleast_2d(np.asarray(spectra, dtype=float))
+
+
+def transmittance(samples, dark, reference) -> np.ndarray:
+    """
+    Transmittance in % of stacked sample spectra.
+
+    Args:
+        samples: (samples x pixels) intensities, or one spectrum.
+        dark: Dark spectrum, (pixels,) or one per sample.
+        reference: Reference spectrum, (pixels,) or one per sample.
+
+    Returns:
+        np.ndarray: (samples x pixels), NaN at pixels without reference
+        signal (reference == dark).
+    """
+    samples, dark, reference = _stack(samples), _stack(dark), _stack(reference)
+    signal = np.broadcast_to(reference - dark, samples.shape)
+    return np.divide(
+        (samples - dark) * 100,
+        signal,
+        out=np.full(samples.shape, np.nan),
+        where=signal != 0,
+    )
+
+
+def absorbance(samples, dark, reference) -> np.ndarray:
+    """
+    Absorbance -log10((S - D) / (R - D)) of stacked sample spectra.
+
+    Returns:
+        np.ndarray: (samples x pixels), NaN where the ratio is not positive,
+        i.e. no reference signal or no light through the sample.
+    """
+    ratio = transmittance(samples, dark, reference) / 100
+    valid = ratio > 0  # False for NaN as well
+    out = np.full(ratio.shape, np.nan)
+    np.log10(ratio, out=out, where=valid)
+    return np.negative(out, out=out, where=valid)
+
+
+def _window(wavelengths: np.ndarray, band: Band) -> np.ndarray:
+    mask = (wavelengths >= band[0]) & (wavelengths <= band[1])
+    if not mask.any():
+        raise ValueError(f"No pixel within {band[0]}-{band[1]} nm")
+    return mask
+
+
+def baseline_correct(spectra, wavelengths, windows: Sequence[Band]) -> np.ndarray:
+    """
+    Subtract a baseline from every spectrum.
+
+    With one window the mean within it is subtracted, with two windows the
+    line through their means. NaN pixels are ignored.
+
+    Args:
+        spectra: (samples x pixels) spectra, e.g. absorbances.
+        wavelengths: (pixels,) wavelengths in nm.
+        windows (list): One or two (start, end) bands without absorption.
+    """
+    spectra, wavelengths = _stack(spectra), np.asarray(wavelengths, dtype=float)
+    if len(windows) not in (1, 2):
+        raise ValueError("The baseline needs one or two windows")
+    masks = [_window(wavelengths, window) for window in windows]
+    levels = [np.nanmean(spectra[:, mask], axis=1) for mask in masks]
+    if len(masks) == 1:
+        return spectra - levels[0][:, None]
+
+    centers = [wavelengths[mask].mean() for mask in masks]
+    slope = (levels[1] - levels[0]) / (centers[1] - centers[0])
+    baseline = levels[0][:, None] + slope[:, None] * (wavelengths - centers[0])
+    return spectra - baseline
+
+
+def band_integrals(
+    spectra, wavelengths, bands: Dict[str, Band]
+) -> Dict[str, np.ndarray]:
+    """
+    Trapezoid integral of every band for all spectra, NaN pixels count as 0.
+
+    Returns:
+        dict: {band name: (samples,) array}.
+    """
+    spectra, wavelengths = _stack(spectra), np.asarray(wavelengths, dtype=float)
+    integrals = {}
+    for name, band in bands.items():
+        mask = _window(wavelengths, band)
+        y = np.nan_to_num(spectra[:, mask])
+        integrals[name] = np.sum(
+            (y[:, 1:] + y[:, :-1]) / 2 * np.diff(wavelengths[mask]), axis=1
+        )
+    return integrals
+
+
+def band_peaks(spectra, wavelengths, band: Band) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Maximum and its wavelength within a band for all spectra.
+
+    Returns:
+        tuple: (samples,) peak values and wavelengths, NaN for a sample
+        without any valid pixel in the band.
+    """
+    spectra, wavelengths = _stack(spectra), np.asarray(wavelengths, dtype=float)
+    mask = _window(wavelengths, band)
+    y = spectra[:, mask]
+    empty = np.isnan(y).all(axis=1)
+    index = np.where(np.isnan(y), -np.inf, y).argmax(axis=1)
+    rows = np.arange(len(y))
+    peaks = np.where(empty, np.nan, y[rows, index])
+    positions = np.where(empty, np.nan, wavelengths[mask][index])
+    return peaks, positions
+
+
+def feature_table(
+    samples,
+    dark,
+    reference,
+    wavelengths,
+    bands: Dict[str, Band],
+    baseline: Sequence[Band] = None,
+    sample_ids: Sequence = None,
+) -> np.ndarray:
+    """
+    Absorbance features of a whole campaign, one row per sample.
+
+    The absorbances of all samples are computed at once, baseline corrected
+    if `baseline` windows are given, and reduced to the area, the peak and
+    the peak wavelength of every band.
+
+    Args:
+        samples: (samples x pixels) sample spectra.
+        dark: Dark spectrum, (pixels,) or one per sample.
+        reference: Reference spectrum, (pixels,) or one per sample.
+        wavelengths: (pixels,) wavelengths in nm.
+        bands (dict): {name: (start, end)} bands in nm.
+        baseline (list, optional): Windows for `baseline_correct`.
+        sample_ids (list, optional): Ids of the samples, 1.. by default.
+
+    Returns:
+        np.ndarray: Structured array with the fields "sample_id",
+        "masked" (share of NaN pixels) and "<band>_area", "<band>_peak",
+        "<band>_peak_nm" per band.
+    """
+    spectra = absorbance(samples, dark, reference)
+    if baseline:
+        spectra = baseline_correct(spectra, wavelengths, baseline)
+    n = len(spectra)
+    if sample_ids is None:
+        sample_ids = np.arange(1, n + 1)
+
+    columns = {
+        "sample_id": np.asarray(sample_ids),
+        "masked": np.isnan(spectra).mean(axis=1),
+    }
+    areas = band_integrals(spectra, wavelengths, bands)
+    for name, band in bands.items():
+        peaks, positions = band_peaks(spectra, wavelengths, band)
+        columns[f"{name}_area"] = areas[name]
+        columns[f"{name}_peak"] = peaks
+        columns[f"{name}_peak_nm"] = positions
+
+    table = np.empty(
+        n, dtype=[(name, values.dtype) for name, values in columns.items()]
+    )
+    for name, values in columns.items():
+        table[name] = values
+    return table
@@ -0,0 +1,141 @@
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict
+
+import numpy as np
+
+COLUMNS = ("timestamp", "pressure", "flow", "fill_level", "dosed_volume")
+
+# One writer thread for all pumps, the polling loop never touches a file
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Telemetry")
+
+
+class PumpTelemetry:
+    """
+    Preallocated ring buffer of the readings of one pump.
+
+    Every poll of a dosage records a row of `COLUMNS`. The buffer keeps the
+    last `capacity` rows in memory (see `latest`). With a directory given,
+    each dosing command is saved as well: every `chunk_size` rows a copy of
+    the chunk is appended to a `.part` file by the writer thread, and when
+    the command ends the rows are stored column by column in a `.npz` file
+    (see `load_telemetry`), named after the pump, the command number and the
+    action.
+
+    Args:
+        name (str): Pump name, prefix of the files.
+        directory (str, optional): Folder of the telemetry files, nothing is
+            saved if None.
+        capacity (int): Rows kept in memory.
+        chunk_size (int): Rows per write, a divisor of `capacity`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        directory: str = None,
+        capacity: int = 4096,
+        chunk_size: int = 256,
+    ):
+        if capacity % chunk_size:
+            raise ValueError("capacity must be a multiple of chunk_size")
+        self.name = name
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.buffer = np.zeros((capacity, len(COLUMNS)))
+        self.count = 0  # rows recorded since creation
+        self.commands = 0
+        self.path = None  # file of the running command
+        self._flushed = 0  # rows of the running command handed to the writer
+        self.saved = None  # Future of the last `end`
+
+    def begin(self, action: str = "dosage") -> str:
+        """Start the rows of a dosing command, return its file path."""
+        self.commands += 1
+        self._flushed = self.count
+        if self.directory is None:
+            self.path = None
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self.path = os.path.join(
+            self.directory, f"{self.name}_{stamp}_{self.commands:04d}_{action}.npz"
+        )
+        return self.path
+
+    def record(self, timestamp, pressure, flow, fill_level, dosed_volume) -> None:
+        row = self.count % len(self.buffer)
+        self.buffer[row] = (timestamp, pressure, flow, fill_level, dosed_volume)
+        self.count += 1
+        if self.path is not None and self.count % self.chunk_size == 0:
+            self._flush()
+
+    def end(self) -> Future:
+        """
+        Save the remaining rows of the running command.
+
+        Returns:
+            Future: Resolved with the file path once it is written, None
+            without a directory.
+        """
+        if self.path is None:
+            return None
+        self._flush()
+        path, self.path = self.path, None
+        self.saved = _writer.submit(_finalize, path)
+        return self.saved
+
+    def _flush(self):
+        rows = self._rows(self.count - self._flushed)
+        self._flushed = self.count
+        if len(rows):
+            _writer.submit(_append, self.path + ".part", rows)
+
+    def _rows(self, n: int) -> np.ndarray:
+        """Copy of the last n rows, oldest first."""
+        n = min(n, self.count, len(self.buffer))
+        end = self.count % len(self.buffer)
+        if n <= end:
+            return self.buffer[end - n : end].copy()
+        return np.concatenate((self.buffer[end - n :], self.buffer[:end]))
+
+    def latest(self, n: int = None) -> np.ndarray:
+        """The last n rows in memory (all if None), oldest first."""
+        return self._rows(len(self.buffer) if n is None else n)
+
+    @property
+    def last(self):
+        """The most recent row, None before the first reading."""
+        if self.count == 0:
+            return None
+        return self.buffer[(self.count - 1) % len(self.buffer)]
+
+
+def _append(path: str, rows: np.ndarray):
+    with open(path, "ab") as file:
+        rows.tofile(file)
+
+
+def _finalize(path: str) -> str:
+    part = path + ".part"
+    if os.path.exists(part):
+        rows = np.fromfile(part).reshape(-1, len(COLUMNS))
+    else:
+        rows = np.zeros((0, len(COLUMNS)))
+    # Written beside and renamed, readers never see a half written file
+    with open(path + ".tmp", "wb") as file:
+        np.savez(file, **{column: rows[:, i] for i, column in enumerate(COLUMNS)})
+    os.replace(path + ".tmp", path)
+    if os.path.exists(part):
+        os.remove(part)
+    return path
+
+
+def load_telemetry(path: str) -> Dict[str, np.ndarray]:
+    """Load the columns of a dosing command, also from an unfinished `.part`."""
+    if path.endswith(".part"):
+        rows = np.fromfile(path).reshape(-1, len(COLUMNS))
+        return {column: rows[:, i] for i, column in enumerate(COLUMNS)}
+    with np.load(path) as data:
+        return {column: data[column] for column in COLUMNS}
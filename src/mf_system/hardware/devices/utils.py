@@ -1,3 +1,4 @@
+import asyncio
 import serial
 import time
 import numpy as np
@@ -22,6 +23,24 @@ def moving_average(data, window_size):
     return smoothed_full
 
 
+async def read_response_async(
+    connection: serial.Serial, timeout: float, poll_interval: float = 0.01
+) -> Union[str, None]:
+    """
+    Wait for the next non-empty line on a serial connection without blocking
+    the event loop. Returns None if nothing arrived within the timeout.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        if connection.in_waiting:
+            feedback = connection.readline().decode("utf-8").strip()
+            if feedback:
+                return feedback
+        await asyncio.sleep(poll_interval)
+    return None
+
+
 class RequestFailed(Exception):
     pass
 
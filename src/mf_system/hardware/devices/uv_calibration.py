@@ -0,0 +1,86 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# Dark and reference spectrum of the UV-Vis spectrometer, see
+# `UVvisAdapter.calibrate`. Times from `time.monotonic`.
+Calibration = namedtuple(
+    "Calibration",
+    ["wavelengths", "dark", "reference", "int_time", "dark_time", "reference_time"],
+)
+
+# Defaults of the calibration settings in the UV_Vis hardware config
+CALIBRATION_MAX_AGE = 600.0  # s
+DRIFT_THRESHOLD = 0.02  # relative to the reference signal
+DRIFT_PIXELS = 8
+
+
+class CalibrationCache:
+    """
+    Dark and reference spectra kept between the samples.
+
+    An entry is used as long as it is younger than `max_age` seconds and was
+    taken with the current integration time. Before it is reused, a single
+    scan with the shutter open is compared with the reference at a few
+    pixels: a median deviation over `drift_threshold` of the reference
+    signal (reference - dark) means the lamp or the probe drifted and the
+    spectra are taken again.
+
+    Args:
+        max_age (float): Seconds an entry is valid.
+        drift_threshold (float): Accepted relative deviation of the check.
+        drift_pixels (int): Pixels compared by the check, spread over the
+            pixels with a reference signal.
+        clock (callable): Time source, `time.monotonic` by default.
+    """
+
+    def __init__(
+        self,
+        max_age: float = CALIBRATION_MAX_AGE,
+        drift_threshold: float = DRIFT_THRESHOLD,
+        drift_pixels: int = DRIFT_PIXELS,
+        clock=time.monotonic,
+    ):
+        self.max_age = max_age
+        self.drift_threshold = drift_threshold
+        self.drift_pixels = drift_pixels
+        self.clock = clock
+        self.entry = None
+        self._pixels = None
+        self.acquisitions = 0  # dark/reference pairs taken
+        self.drifts = 0  # entries dropped by the drift check
+
+    def current(self, int_time) -> bool:
+        """True if the entry may be reused, pending the drift check."""
+        if self.entry is None or self.entry.int_time != int_time:
+            return False
+        return self.clock() - self.entry.reference_time < self.max_age
+
+    def store(self, wavelengths, dark, reference, int_time, dark_time) -> Calibration:
+        self.entry = Calibration(
+            wavelengths, dark, reference, int_time, dark_time, self.clock()
+        )
+        signal = np.flatnonzero(reference - dark > 0)
+        count = min(self.drift_pixels, len(signal))
+        self._pixels = signal[np.linspace(0, len(signal) - 1, count).astype(int)]
+        self.acquisitions += 1
+        return self.entry
+
+    def drifted(self, scan) -> bool:
+        """Compare a scan with the reference, drop the entry if it drifted."""
+        if not len(self._pixels):
+            drift = np.inf
+        else:
+            reference = self.entry.reference[self._pixels]
+            signal = reference - self.entry.dark[self._pixels]
+            drift = np.median(np.abs(scan[self._pixels] - reference) / signal)
+        if drift > self.drift_threshold:
+            self.drifts += 1
+            self.invalidate()
+            return True
+        return False
+
+    def invalidate(self) -> None:
+        self.entry = None
+        self._pixels = None
@@ -3,12 +3,64 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from mf_system.hardware.devices.utils import DeviceNotFoundError, moving_average
+from mf_system.hardware.devices import spectra
 from mf_system.hardware.devices.interface import IHardwareAdapter
+from mf_system.hardware.devices.uv_calibration import (
+    CALIBRATION_MAX_AGE,
+    DRIFT_PIXELS,
+    DRIFT_THRESHOLD,
+    Calibration,
+    CalibrationCache,
+)
 from mf_system.hardware.devices.uv_vis_lib.uvvissdk import uvvisremotecontrol
 
 # Types of FLEX devices
 FLEX_types = ["STD", "RES+"]
 
+# Seconds for the shutter to settle before a dark/reference spectrum
+SHUTTER_SETTLE = 0.1
+
+# Scans taken before an early stop is considered, see `RunningSpectrum`
+MIN_SCANS = 3
+
+
+class RunningSpectrum:
+    """
+    Per-pixel running mean and variance of scans (Welford).
+
+    Memory does not grow with the number of scans, so `average` may be as
+    large as the UI allows.
+
+    Args:
+        n_pixels (int): Pixels per scan.
+    """
+
+    def __init__(self, n_pixels: int):
+        self.count = 0
+        self.mean = np.zeros(n_pixels)
+        self._m2 = np.zeros(n_pixels)
+        self._delta = np.empty(n_pixels)
+
+    def add(self, scan: np.ndarray) -> None:
+        self.count += 1
+        np.subtract(scan, self.mean, out=self._delta)
+        self.mean += self._delta / self.count
+        # delta * (scan - new mean)
+        self._m2 += self._delta * (scan - self.mean)
+
+    @property
+    def variance(self) -> np.ndarray:
+        """Sample variance per pixel, 0 with less than two scans."""
+        if self.count < 2:
+            return np.zeros_like(self.mean)
+        return self._m2 / (self.count - 1)
+
+    def relative_error(self, pixels=slice(None)) -> np.ndarray:
+        """Standard error of the mean relative to the mean, at `pixels`."""
+        error = np.sqrt(self.variance[pixels] / max(self.count, 1))
+        mean = np.abs(self.mean[pixels])
+        return np.divide(error, mean, out=np.full_like(error, np.inf), where=mean > 0)
+
 
 class UVvisAdapter(IHardwareAdapter):
     def __init__(self, config: dict):
@@ -17,6 +69,25 @@ class UVvisAdapter(IHardwareAdapter):
         self.int_time = config["integration_time"]
         self.average = config["average"]
         self.smoothing = config["smoothing"]
+        # Optional early stop of the averaging: once the relative standard
+        # error at `target_wavelengths` (nm, all pixels if None) is below
+        # `target_error`, at most `average` scans
+        self.target_error = config.get("target_error")
+        self.target_wavelengths = config.get("target_wavelengths")
+        self.last_spectrum = None  # RunningSpectrum of the last measurement
+        self.shutter_settle = config.get("shutter_settle", SHUTTER_SETTLE)
+        self.calibration = CalibrationCache(
+            max_age=config.get("calibration_max_age", CALIBRATION_MAX_AGE),
+            drift_threshold=config.get("drift_threshold", DRIFT_THRESHOLD),
+            drift_pixels=config.get("drift_pixels", DRIFT_PIXELS),
+        )
+
+        # Per connection: integration time set on the device and the
+        # wavelength axis read for it, see `wavelengths`
+        self._device_int_time = None
+        self._wavelengths = None
+        # Latest scan, see `_scan_buffer`
+        self._scans = None
 
     def initialize(self):
         self._connection = uvvisremotecontrol.UVvis()
@@ -38,6 +109,7 @@ class UVvisAdapter(IHardwareAdapter):
 
         # Connects and gets handle to use with other functions
         self.FTHandle_ID = self._connection.connect(device_id)
+        self._reset_calibration()
 
         # Disable trigger in/out mode
         self._connection.trigger_in_disable(self.FTHandle_ID)
@@ -51,11 +123,12 @@ class UVvisAdapter(IHardwareAdapter):
 
         match action:
             case "change_integration_time":
-                return self._connection.change_integration_time(
-                    command["int_time"], self.FTHandle_ID
-                )
+                self.int_time = command["int_time"]
+                return self._apply_integration_time()
             case "measure":
                 return self.measure()
+            case "calibrate":
+                return self.calibrate()
             case "switch_LED":
                 return self._connection.switch_LED(command["switch"], self.FTHandle_ID)
             case "switch_shutter":
@@ -68,24 +141,55 @@ class UVvisAdapter(IHardwareAdapter):
     def shutdown(self) -> None:
         if self._connection:
             self._connection.disconnect(self.FTHandle_ID)
+        self._reset_calibration()
 
-    def measure(self):
-        self._connection.change_integration_time(self.int_time, self.FTHandle_ID)
+    def _reset_calibration(self):
+        self._device_int_time = None
+        self._wavelengths = None
+        self.calibration.invalidate()
 
-        # Get wavelenth array (list type)
-        c0, c1, c2, c3 = self._connection.read_EEPROMCoeff(self.FTHandle_ID)
-        wavelengths = self._connection.get_XData(c0, c1, c2, c3, self.FTHandle_ID)
-        n_pixels = len(wavelengths)
+    def _apply_integration_time(self) -> bool:
+        """Send the integration time if the device has another one."""
+        if self.int_time == self._device_int_time:
+            return True
+        success = self._connection.change_integration_time(
+            self.int_time, self.FTHandle_ID
+        )
+        self._device_int_time = self.int_time if success else None
+        # The wavelength axis is read again for the new integration time
+        self._wavelengths = None
+        return success
 
-        # Averaging
-        res_list = []
-        for i in range(self.average):
-            res_list.append(
-                self._connection.get_YData(False, self.FTHandle_ID)[:n_pixels]
+    @property
+    def wavelengths(self) -> np.ndarray:
+        """Wavelength axis in nm, read from the device once per connection."""
+        self._apply_integration_time()
+        if self._wavelengths is None:
+            c0, c1, c2, c3 = self._connection.read_EEPROMCoeff(self.FTHandle_ID)
+            self._wavelengths = np.array(
+                self._connection.get_XData(c0, c1, c2, c3, self.FTHandle_ID)
             )
+        return self._wavelengths
+
+    @property
+    def n_pixels(self) -> int:
+        return len(self.wavelengths)
+
+    def measure(self):
+        wavelengths = self.wavelengths
+        n_pixels = len(wavelengths)
+
+        # Averaging, each spectrum is copied once from the DLL buffer
+        scan = self._scan_buffer(n_pixels)
+        spectrum = RunningSpectrum(n_pixels)
+        pixels = self._target_pixels(wavelengths)
+        for _ in range(self.average):
+            spectrum.add(self._read_spectrum(out=scan))
+            if self._precise_enough(spectrum, pixels):
+                break
+        self.last_spectrum = spectrum
 
-        data = np.array(res_list)
-        mean_values = np.mean(data, axis=0)
+        mean_values = spectrum.mean
 
         # Smoothing
         if self.smoothing > 1:
@@ -93,13 +197,70 @@ class UVvisAdapter(IHardwareAdapter):
 
         return wavelengths, mean_values
 
+    def calibrate(self) -> Calibration:
+        """
+        Dark and reference spectrum for the next sample measurement.
+
+        The spectra of the `CalibrationCache` are reused while they are
+        valid and pass the drift check, otherwise the dark spectrum is taken
+        with the shutter closed and the reference spectrum with the shutter
+        open. The shutter is open afterwards.
+        """
+        cache = self.calibration
+        if cache.current(self.int_time):
+            scan = self._read_spectrum(out=self._scan_buffer(self.n_pixels))
+            if not cache.drifted(scan):
+                return cache.entry
+
+        self._switch_shutter(True)
+        dark_time = cache.clock()
+        wavelengths, dark = self.measure()
+        self._switch_shutter(False)
+        _, reference = self.measure()
+        return cache.store(wavelengths, dark, reference, self.int_time, dark_time)
+
+    def _switch_shutter(self, switch: bool):
+        self._connection.switch_shutter(switch, self.FTHandle_ID)
+        time.sleep(self.shutter_settle)
+
+    def _target_pixels(self, wavelengths: np.ndarray):
+        if self.target_wavelengths is None:
+            return slice(None)
+        targets = np.asarray(self.target_wavelengths, dtype=float)
+        return np.abs(wavelengths[:, None] - targets).argmin(axis=0)
+
+    def _precise_enough(self, spectrum: RunningSpectrum, pixels) -> bool:
+        if self.target_error is None or spectrum.count < MIN_SCANS:
+            return False
+        return bool((spectrum.relative_error(pixels) < self.target_error).all())
+
+    def _scan_buffer(self, n_pixels: int) -> np.ndarray:
+        """Array of one scan, reused by the measurements."""
+        if self._scans is None or self._scans.shape != (n_pixels,):
+            self._scans = np.empty(n_pixels)
+        return self._scans
+
+    def _read_spectrum(self, out: np.ndarray) -> np.ndarray:
+        """
+        Take one spectrum into `out`.
+
+        The pointer of `get_YData` is wrapped as an array without copying,
+        the only copy is the one into `out`. The DLL reuses its buffer on
+        the next call.
+        """
+        pointer = self._connection.get_YData(False, self.FTHandle_ID)
+        out[:] = np.ctypeslib.as_array(pointer, shape=out.shape)
+        return out
+
     def get_Absorbance(self, Sn: list[float], Dn: list[float], Rn: list[float]):
-        An = -np.log10((Sn - Dn) / (Rn - Dn))
-        return An
+        # NaN instead of inf where Rn - Dn or Sn - Dn is not positive, see
+        # `spectra` for whole campaigns
+        An = spectra.absorbance(Sn, Dn, Rn)
+        return An[0] if np.ndim(Sn) == 1 else An
 
     def get_Transmittance(self, Sn: list[float], Dn: list[float], Rn: list[float]):
-        Tn = (Sn - Dn) / (Rn - Dn) * 100
-        return Tn
+        Tn = spectra.transmittance(Sn, Dn, Rn)
+        return Tn[0] if np.ndim(Sn) == 1 else Tn
 
     def plot_result(self, wavelengths, spectrum, save_path):
         plt.subplots()
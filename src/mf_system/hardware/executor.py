@@ -0,0 +1,161 @@
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+
+class DeviceLane:
+    """
+    A single worker thread that runs the commands of one device in order.
+
+    The worker is created on the first command and reused afterwards, so
+    executing a command does not create any thread or pool. Besides running
+    the commands the lane records how many commands are waiting and how long
+    they waited before the device was free.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._worker = None
+        self.current = None  # (command, start time) of the running command
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.queue_depth = 0  # commands submitted but not finished yet
+        self.max_queue_depth = 0
+        self.total_wait = 0.0  # seconds between submit and start
+        self.max_wait = 0.0
+        self.total_busy = 0.0  # seconds the device was executing commands
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        submitted_at = time.perf_counter()
+        with self._lock:
+            self.submitted += 1
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        return self._executor.submit(self._run, submitted_at, fn, *args, **kwargs)
+
+    def run(self, fn: Callable, *args, **kwargs):
+        """Execute on the lane and wait for the result."""
+        if threading.current_thread() is self._worker:
+            # Already on this lane, queueing would wait for ourselves
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    def _run(self, submitted_at: float, fn: Callable, *args, **kwargs):
+        self._worker = threading.current_thread()
+        started_at = time.perf_counter()
+        wait = started_at - submitted_at
+        self.current = (args[0] if args else None, started_at)
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            busy = time.perf_counter() - started_at
+            self.current = None
+            with self._lock:
+                self.queue_depth -= 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                self.total_busy += busy
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    def active(self):
+        """Return (command, seconds running) of the running command or None."""
+        current = self.current
+        if current is None:
+            return None
+        return current[0], time.perf_counter() - current[1]
+
+    def metrics(self) -> dict:
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "mean_wait": self.total_wait / finished if finished else 0.0,
+                "max_wait": self.max_wait,
+                "busy_time": self.total_busy,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+class DeviceExecutor:
+    """
+    One `DeviceLane` per device.
+
+    Commands to the same device are serialized by its lane while different
+    devices run in parallel. Pumps get a lane each, named "Pumps/<pump>".
+    """
+
+    def __init__(self):
+        self.lanes: Dict[str, DeviceLane] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def lane_name(device: str, pump_name=None) -> str:
+        return f"{device}/{pump_name}" if pump_name else device
+
+    def lane(self, device: str, pump_name=None) -> DeviceLane:
+        name = self.lane_name(device, pump_name)
+        lane = self.lanes.get(name)
+        if lane is None:
+            with self._lock:
+                lane = self.lanes.get(name)
+                if lane is None:
+                    lane = self.lanes[name] = DeviceLane(name)
+        return lane
+
+    def metrics(self) -> Dict[str, dict]:
+        return {name: lane.metrics() for name, lane in self.lanes.items()}
+
+    def run_together(self, lanes: List[DeviceLane], fn: Callable, *args, **kwargs):
+        """
+        Run one call that needs several devices once all their lanes are free.
+
+        A placeholder is queued on every lane. When all of them run, the lanes
+        are held while `fn` runs on the calling thread, so no other command
+        reaches these devices in between.
+        """
+        arrived = threading.Barrier(len(lanes) + 1)
+        done = threading.Event()
+
+        def hold(command):
+            arrived.wait()
+            done.wait()
+
+        futures = [lane.submit(hold, fn.__name__) for lane in lanes]
+        try:
+            arrived.wait()
+            return fn(*args, **kwargs)
+        finally:
+            done.set()
+            for future in futures:
+                future.result()
+
+    def active(self) -> Dict[str, tuple]:
+        """The running command of every busy lane, see `DeviceLane.active`."""
+        active = {}
+        for name, lane in list(self.lanes.items()):
+            current = lane.active()
+            if current is not None:
+                active[name] = current
+        return active
+
+    def shutdown(self, wait: bool = True) -> None:
+        for lane in self.lanes.values():
+            lane.shutdown(wait=wait)
+        self.lanes.clear()
@@ -1,13 +1,23 @@
 import yaml
 import json
+import asyncio
+from collections import deque
 from typing import Dict, Any
 
 from mf_system.hardware.devices.interface import IHardwareAdapter
 from mf_system.hardware.devices.arduino import ArduinoAdapter
 from mf_system.hardware.devices.gantry import GantryAdapter
-from mf_system.hardware.devices.pump import SyringePumpAdapter
+from mf_system.hardware.devices.pump import (
+    PROFILE_INTERVAL,
+    GroupDosing,
+    SyringePumpAdapter,
+)
+from mf_system.hardware.devices.contiflow import ContiFlowAdapter
+from mf_system.hardware.devices.flow_profile import FlowProfile
 from mf_system.hardware.devices.dls import DLSAdapter
 from mf_system.hardware.devices.utils import DeviceNotFoundError
+from mf_system.hardware.executor import DeviceExecutor
+from mf_system.hardware.refill import RefillService
 
 
 class HardwareFactory:
@@ -39,7 +49,10 @@ class HardwareFactory:
         if device_type == "Pumps":
             pumps = {}
             for p, p_config in config.items():
-                pumps[p] = SyringePumpAdapter(p_config)
+                if "contiflow" in p_config:
+                    pumps[p] = ContiFlowAdapter(p_config)
+                else:
+                    pumps[p] = SyringePumpAdapter(p_config)
             return pumps
         elif device_type == "Arduino":
             return ArduinoAdapter(config)
@@ -52,9 +65,25 @@ class HardwareFactory:
 
 
 class HardwareManager:
-    def __init__(self, hardware_config_path):
+    """
+    Devices of the cell, each with its own worker lane.
+
+    Args:
+        hardware_config_path (str): Path of the hardware config (yaml).
+        monitor_interval (float, optional): Seconds between two sweeps of
+            the `DosingMonitor`, shared by all pumps of the bus.
+    """
+
+    def __init__(self, hardware_config_path, monitor_interval: float = None):
         # {"Pumps": {"pump1": SyringePumpAdapter(p_config), ...}, "Arduino": ArduinoAdapter(config)}
         self.adapters: Dict[str, IHardwareAdapter] = {}
+        # One worker lane per device, commands to a device are serialized
+        self.executor = DeviceExecutor()
+        self.refill_service = None
+        # Start skews of the group dosings in seconds, see `dispense_group`
+        self.start_skews = deque(maxlen=1000)
+        if monitor_interval is not None:
+            SyringePumpAdapter.monitor.interval = monitor_interval
         self.hw_config = HardwareFactory._load_config(
             file_path=hardware_config_path, loader=yaml.safe_load
         )
@@ -69,30 +98,201 @@ class HardwareManager:
                 print(f"Skipped unsupported device: {e}")
 
     def initialize_all(self) -> Dict[str, bool]:
-        results = {}
+        """
+        Initialize all devices.
+
+        The pumps are initialized concurrently on their lanes, they share
+        one bus session, see `BusSession`. The other devices are initialized
+        meanwhile, one after another.
+        """
+        results = dict.fromkeys(self.adapters)
+        pending = {}
         for name, adapter in self.adapters.items():
+            if isinstance(adapter, dict):
+                pending[name] = {
+                    p_name: self.executor.lane(name, p_name).submit(
+                        pump_adapter.initialize
+                    )
+                    for p_name, pump_adapter in adapter.items()
+                }
+
+        for name, adapter in self.adapters.items():
+            if name in pending:
+                continue
             try:
-                # initialize pumps
-                if isinstance(adapter, dict):
-                    results[name] = {}
-                    for p_name, pump_adapter in adapter.items():
-                        results[name][p_name] = pump_adapter.initialize()
-                else:
-                    results[name] = adapter.initialize()
+                results[name] = adapter.initialize()
             except Exception as e:
                 results[name] = False
                 print(f"Failed to initialize {name}: {e}")
+
+        # initialize pumps
+        for name, futures in pending.items():
+            results[name] = {}
+            for p_name, future in futures.items():
+                try:
+                    results[name][p_name] = future.result()
+                except Exception as e:
+                    results[name][p_name] = False
+                    print(f"Failed to initialize {name}/{p_name}: {e}")
         return results
 
-    def execute_command(self, device: str, command: dict, pump_name=None):
+    def _adapter(self, device: str, pump_name=None) -> IHardwareAdapter:
         if device not in self.adapters:
             raise DeviceNotFoundError(device)
-        else:
-            if pump_name:  # pumps action
-                return self.adapters[device][pump_name].execute(command)
-            return self.adapters[device].execute(command)
+        if pump_name:  # pumps action
+            return self.adapters[device][pump_name]
+        return self.adapters[device]
+
+    def execute_command(self, device: str, command: dict, pump_name=None):
+        """Execute a command on the lane of the device and wait for it."""
+        adapter = self._adapter(device, pump_name)
+        return self.executor.lane(device, pump_name).run(adapter.execute, command)
+
+    def submit_command(self, device: str, command: dict, pump_name=None):
+        """
+        Queue a command on the lane of the device without waiting.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the result of the command.
+        """
+        adapter = self._adapter(device, pump_name)
+        return self.executor.lane(device, pump_name).submit(adapter.execute, command)
+
+    def switch_valves(self, positions: Dict[str, int]) -> None:
+        """
+        Switch the valves of several pumps together.
+
+        Waits until the pumps finished their queued commands, see
+        `SyringePumpAdapter.switch_valves`.
+
+        Args:
+            positions (dict): {pump_name: position}.
+
+        Raises:
+            ValueError: A pump switches its valves by itself, e.g. a
+                ContiFlow pump.
+        """
+        adapters = {self._adapter("Pumps", p): pos for p, pos in positions.items()}
+        fixed = [p for p, a in zip(positions, adapters) if not a.switches_valves]
+        if fixed:
+            raise ValueError(f"The valves of {fixed} switch by themselves")
+        lanes = [self.executor.lane("Pumps", p) for p in positions]
+        self.executor.run_together(lanes, SyringePumpAdapter.switch_valves, adapters)
+
+    def dispense_group(self, commands: Dict[str, dict], finished=None) -> GroupDosing:
+        """
+        Dispense from several pumps with synchronized starts.
+
+        Waits until the pumps finished their queued commands, see
+        `SyringePumpAdapter.dose_group`.
+
+        Args:
+            commands (dict): {pump_name: dispense command}.
+            finished (callable, optional): Called with (pump_name, result)
+                as soon as the dosage of a pump finished.
+
+        Returns:
+            GroupDosing: Results and start times by pump name, and the
+            measured start skew.
+        """
+        adapters = {self._adapter("Pumps", p): p for p in commands}
+        lanes = [self.executor.lane("Pumps", p) for p in commands]
+
+        def pump_finished(adapter, result):
+            if finished is not None:
+                finished(adapters[adapter], result)
+
+        dosing = self.executor.run_together(
+            lanes,
+            SyringePumpAdapter.dose_group,
+            {adapter: commands[p] for adapter, p in adapters.items()},
+            finished=pump_finished,
+        )
+        self.start_skews.append(dosing.start_skew)
+        print(f"Group dosing of {list(commands)}: start skew {dosing.start_skew:.4f} s")
+        return GroupDosing(
+            {adapters[a]: result for a, result in dosing.results.items()},
+            {adapters[a]: start for a, start in dosing.starts.items()},
+            dosing.start_skew,
+        )
+
+    def run_profiles(
+        self, profiles: Dict[str, list], interval: float = PROFILE_INTERVAL
+    ) -> dict:
+        """
+        Play flow profiles on several pumps together.
+
+        Waits until the pumps finished their queued commands, see
+        `SyringePumpAdapter.run_profiles`.
+
+        Args:
+            profiles (dict): {pump_name: FlowProfile or list of segments}.
+            interval (float): Seconds between two setpoint updates.
+
+        Returns:
+            dict: {pump_name: ProfileReport}.
+        """
+        adapters = {self._adapter("Pumps", p): p for p in profiles}
+        lanes = [self.executor.lane("Pumps", p) for p in profiles]
+        reports = self.executor.run_together(
+            lanes,
+            SyringePumpAdapter.run_profiles,
+            {adapter: FlowProfile.of(profiles[p]) for adapter, p in adapters.items()},
+            interval,
+        )
+        return {adapters[adapter]: report for adapter, report in reports.items()}
+
+    def is_idle(self, device: str, pump_name=None) -> bool:
+        """True if the device has no running or queued command."""
+        return self.executor.lane(device, pump_name).queue_depth == 0
+
+    def fill_level(self, pump_name: str) -> float:
+        return self._adapter("Pumps", pump_name).pump.get_fill_level()
+
+    def syringe_volume(self, pump_name: str) -> float:
+        return self._adapter("Pumps", pump_name).pump.get_volume_max()
+
+    def start_refill_service(self, state_machine=None, **kwargs) -> RefillService:
+        """
+        Refill the syringes in the background, see `RefillService`.
+
+        Args:
+            state_machine (optional): Machine providing
+                `time_until_dispense`, refills are only started while the
+                pump is not needed.
+            **kwargs: Settings of the `RefillService`.
+        """
+        if self.refill_service is not None:
+            self.refill_service.stop()
+        self.refill_service = RefillService(self, **kwargs)
+        if state_machine is not None:
+            self.refill_service.attach(state_machine)
+        return self.refill_service.start()
+
+    def lane_metrics(self) -> Dict[str, dict]:
+        """Queue depth and wait time statistics of every device lane."""
+        return self.executor.metrics()
+
+    def active_commands(self) -> Dict[str, tuple]:
+        """{lane: (command, seconds running)} of all devices that are busy."""
+        return self.executor.active()
+
+    async def execute_command_async(self, device: str, command: dict, pump_name=None):
+        """
+        Execute a command on the lane of the device and await it.
+
+        The command is ordered with the other commands of the device and
+        counted by `is_idle`, `lane_metrics` and `active_commands`, the
+        event loop keeps running while the lane executes it.
+        """
+        return await asyncio.wrap_future(
+            self.submit_command(device, command, pump_name)
+        )
 
     def shutdown_all(self) -> None:
+        if self.refill_service is not None:
+            self.refill_service.stop()
+        self.executor.shutdown()
         for adapter in self.adapters.values():
             if isinstance(adapter, dict):
                 for pump_adapter in adapter.values():
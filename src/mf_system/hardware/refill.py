@@ -0,0 +1,161 @@
+import math
+import time
+import threading
+from collections import namedtuple
+from concurrent.futures import Future
+
+# One refill started by the service. `background` is False for refills a
+# dispense had to wait for, see `RefillService.ensure`.
+RefillEvent = namedtuple("RefillEvent", ["pump", "level", "background", "time"])
+
+
+class RefillService:
+    """
+    Refill the syringes of idle pumps in the background.
+
+    A thread checks all pumps every `interval` seconds. A pump is refilled
+    when its fill level is below `threshold` of the syringe volume, it has
+    no command queued and, if a state machine is attached, it is not
+    expected to dispense before the refill is done (see
+    `StateMachine.time_until_dispense`), unless the syringe is too empty for
+    that dispense anyway. Pumps no remaining sample needs are not refilled,
+    neither are ContiFlow pumps, which refill by themselves.
+    The refill runs on the lane of the pump, so a dispense submitted
+    meanwhile waits for it instead of starting on an empty syringe.
+
+    Args:
+        hardware: `HardwareManager`, or any object with its interface.
+        threshold (float): Fill level, as a share of the syringe volume,
+            below which a pump is refilled.
+        interval (float): Seconds between two checks.
+        valve_time (float): Seconds of the valve switches of a refill.
+    """
+
+    def __init__(
+        self,
+        hardware,
+        threshold: float = 0.2,
+        interval: float = 1.0,
+        valve_time: float = 1.0,
+    ):
+        self.hardware = hardware
+        self.threshold = threshold
+        self.interval = interval
+        self.valve_time = valve_time
+        self.state_machine = None
+
+        self.events = []
+        self.deferred = 0  # checks that postponed a refill for a dispense
+        self._pending = {}  # pump -> future of its running refill
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def attach(self, state_machine) -> "RefillService":
+        self.state_machine = state_machine
+        return self
+
+    def start(self) -> "RefillService":
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="RefillService", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def late(self) -> int:
+        """Number of refills a dispense had to wait for."""
+        return sum(not event.background for event in self.events)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Refill service: check failed: {e}")
+
+    def check(self) -> list:
+        """Start the refills that are due, return their pumps."""
+        started = []
+        for pump, config in self.hardware.hw_config.get("Pumps", {}).items():
+            if "contiflow" in config:
+                continue
+            if self._refilling(pump) or not self.hardware.is_idle("Pumps", pump):
+                continue
+
+            capacity = self.hardware.syringe_volume(pump)
+            level = self.hardware.fill_level(pump)
+            if level >= self.threshold * capacity:
+                continue
+
+            until = self._time_until_dispense(pump)
+            if until == math.inf:
+                continue
+            refill_time = (capacity - level) / config["flow"] + self.valve_time
+            if until is not None and until < refill_time:
+                if level >= self._next_volume(pump):
+                    # Would delay the next dispense, refill after it
+                    self.deferred += 1
+                    continue
+                # The next dispense needs a refill anyway, the earlier the
+                # shorter it waits
+
+            self._refill(pump, level, background=True)
+            started.append(pump)
+        return started
+
+    def ensure(self, pump: str, volume: float) -> Future:
+        """
+        Make sure the syringe holds the volume of the next dispense.
+
+        Returns:
+            Future: The refill the dispense has to wait for, None if the
+            syringe holds enough already.
+        """
+        if "contiflow" in self.hardware.hw_config["Pumps"][pump]:
+            return None
+        with self._lock:
+            pending = self._pending.get(pump)
+        if pending is not None and not pending.done():
+            return pending
+
+        level = self.hardware.fill_level(pump)
+        if level + 1e-9 >= volume:
+            return None
+        return self._refill(pump, level, background=False)
+
+    def _refilling(self, pump: str) -> bool:
+        with self._lock:
+            pending = self._pending.get(pump)
+        return pending is not None and not pending.done()
+
+    def _time_until_dispense(self, pump: str):
+        time_until_dispense = getattr(self.state_machine, "time_until_dispense", None)
+        if time_until_dispense is None:
+            return None
+        return time_until_dispense(pump)
+
+    def _next_volume(self, pump: str) -> float:
+        next_dispense_volume = getattr(self.state_machine, "next_dispense_volume", None)
+        return next_dispense_volume(pump) if next_dispense_volume else 0.0
+
+    def _refill(self, pump: str, level: float, background: bool) -> Future:
+        flow = self.hardware.hw_config["Pumps"][pump]["flow"]
+        future = self.hardware.submit_command(
+            "Pumps", {"action": "refill", "flow": flow}, pump
+        )
+        with self._lock:
+            self._pending[pump] = future
+            self.events.append(RefillEvent(pump, level, background, time.time()))
+        print(
+            f"Refill service: refilling {pump} at {level:.3f} ml"
+            + ("" if background else ", dispense waits")
+        )
+        return future
@@ -0,0 +1,362 @@
+import math
+import threading
+import contextvars
+from collections import namedtuple
+from concurrent.futures import Future
+from typing import Dict, List
+
+import yaml
+
+from mf_system.hardware.hardware import HardwareFactory
+from mf_system.hardware.devices.pump import GroupDosing
+from mf_system.hardware.devices.flow_profile import FlowProfile
+from mf_system.hardware.devices.uv_calibration import CALIBRATION_MAX_AGE, Calibration
+from mf_system.hardware.devices.utils import DeviceNotFoundError
+
+# Durations of the timed device models, all times in seconds
+DEFAULT_TIMING = {
+    "valve_switch": 0.5,  # one switch of a pump valve, see `switch_valve_to`
+    "syringe_volume": 25.0,  # ml, used if the pump config has no syringe size
+    "dls_setup": 1.0,
+    "dls_run": 60.0,  # one DLS run, `request_data` does `num_of_runs` runs
+    "uv_integration_time": 1000.0,  # ms per spectrum
+    "uv_average": 5,
+    "uv_shutter": 0.1,
+    "table_step": 3.0,  # one turntable rotation to the next slot
+    "cylinder": 2.0,
+    "gantry_speed": 50.0,  # mm/s
+    "gantry_overhead": 5.0,  # gripping / releasing per move
+}
+
+# Load positions of the gantry if the hardware config does not define them
+DEFAULT_POSITIONS = {
+    "tray": [0, 0],
+    "pump": [300, 0],
+    "measure": [300, 300],
+}
+
+# Device command executed in virtual time
+SimRecord = namedtuple("SimRecord", ["device", "action", "start", "end"])
+
+SimulationReport = namedtuple(
+    "SimulationReport",
+    ["makespan", "bottles", "throughput", "utilisation", "bottleneck", "records"],
+)
+
+
+class SimulatedHardware:
+    """
+    Discrete-event model of the synthesis cell.
+
+    Drop-in replacement for `HardwareManager`: every command is answered
+    immediately with the feedback of the real device, but takes a modelled
+    duration in virtual time. Each device can only execute one command at a
+    time, commands of parallel actions overlap and every state of the state
+    machine starts once all commands of the previous state are finished.
+
+    Args:
+        hardware_config_path (str, optional): Hardware config, only used for
+            syringe sizes, gantry positions and the DLS/UV settings.
+        timing (dict, optional): Overrides for `DEFAULT_TIMING`.
+    """
+
+    def __init__(self, hardware_config_path: str = None, timing: dict = None):
+        self.hw_config = (
+            HardwareFactory._load_config(hardware_config_path, loader=yaml.safe_load)
+            if hardware_config_path
+            else {}
+        )
+        self.hw_config.setdefault("Gantry", {}).setdefault(
+            "positions", DEFAULT_POSITIONS
+        )
+        self.timing = dict(DEFAULT_TIMING, **(timing or {}))
+        self.adapters = {
+            "Pumps": self.hw_config.get("Pumps", {}),
+            "Arduino": None,
+            "DLS": None,
+            "UV_Vis": None,
+            "Gantry": None,
+        }
+
+        self._lock = threading.Lock()
+        # Virtual time the current state started and the latest command end
+        self.epoch = 0
+        self.stage_start = 0.0
+        self.now = 0.0
+        self.free_at: Dict[str, float] = {}
+        self.busy: Dict[str, float] = {}
+        self.records: List[SimRecord] = []
+        self.gantry_position = [0, 0]
+        # Virtual time of the last dark/reference spectra
+        self.uv_calibrated_at = None
+        # Syringe contents in ml, dispenses beyond it are kept as underruns,
+        # aspirations beyond the syringe volume as overflows
+        self.fill_levels: Dict[str, float] = {}
+        self.underruns: List[tuple] = []
+        self.overflows: List[tuple] = []
+        self.refill_service = None
+        # Virtual time of the calling action, every parallel action runs in
+        # its own context (see `parallel_action_handle`)
+        self._cursor = contextvars.ContextVar("sim_cursor", default=(-1, 0.0))
+
+    def attach(self, state_machine) -> "SimulatedHardware":
+        """Start a new stage in virtual time whenever the machine changes state."""
+        state_machine.hardware = self
+        if self.next_stage not in state_machine.machine.after_state_change:
+            state_machine.machine.after_state_change.append(self.next_stage)
+        return self
+
+    def next_stage(self, *args, **kwargs):
+        with self._lock:
+            self.epoch += 1
+            self.stage_start = self.now
+
+    def initialize_all(self) -> Dict[str, bool]:
+        return {name: True for name in self.adapters}
+
+    def shutdown_all(self) -> None:
+        pass
+
+    def execute_command(self, device: str, command: dict, pump_name=None):
+        result, end = self._execute(device, command, pump_name)
+        self._cursor.set((self.epoch, end))
+        return result
+
+    def submit_command(self, device: str, command: dict, pump_name=None):
+        # The caller waits for all submitted commands together, so they all
+        # start at the current time of the caller
+        result, _ = self._execute(device, command, pump_name)
+        future = Future()
+        future.set_result(result)
+        return future
+
+    async def execute_command_async(self, device: str, command: dict, pump_name=None):
+        return self.execute_command(device, command, pump_name)
+
+    def dispense_group(self, commands: Dict[str, dict], finished=None) -> GroupDosing:
+        # The pumps start together once all of them are free
+        lanes = [f"Pumps/{pump}" for pump in commands]
+        with self._lock:
+            epoch, cursor = self._cursor.get()
+            ready = cursor if epoch == self.epoch else self.stage_start
+            start = max([ready] + [self.free_at.get(lane, 0.0) for lane in lanes])
+            for lane in lanes:
+                self.free_at[lane] = start
+        results, starts = {}, {}
+        for pump, command in commands.items():
+            results[pump], _ = self._execute("Pumps", command, pump)
+            starts[pump] = start
+            if finished is not None:
+                finished(pump, results[pump])
+        return GroupDosing(results, starts, 0.0)
+
+    def switch_valves(self, positions: Dict[str, int]) -> None:
+        # The valves switch together once all pumps are free
+        lanes = [f"Pumps/{pump}" for pump in positions]
+        if not lanes:
+            return
+        with self._lock:
+            start = max(self._start_of(lane) for lane in lanes)
+            end = start + self.timing["valve_switch"]
+            for lane in lanes:
+                self.free_at[lane] = end
+                self.busy[lane] = self.busy.get(lane, 0.0) + end - start
+                self.records.append(SimRecord(lane, "switch_valves", start, end))
+            self.now = max(self.now, end)
+        self._cursor.set((self.epoch, end))
+
+    def lane_metrics(self) -> Dict[str, dict]:
+        return {
+            lane: {"busy_time": busy, "free_at": self.free_at[lane]}
+            for lane, busy in self.busy.items()
+        }
+
+    def _execute(self, device: str, command: dict, pump_name=None):
+        if device not in self.adapters:
+            raise DeviceNotFoundError(device)
+
+        lane = f"{device}/{pump_name}" if pump_name else device
+        duration, result = self._model(device, command, pump_name)
+
+        with self._lock:
+            start = self._start_of(lane)
+            end = start + duration
+            self.free_at[lane] = end
+            self.busy[lane] = self.busy.get(lane, 0.0) + duration
+            self.now = max(self.now, end)
+            self.records.append(SimRecord(lane, command["action"], start, end))
+        return result, end
+
+    def _start_of(self, lane: str) -> float:
+        """Virtual start time of a command of the calling action on a lane."""
+        epoch, cursor = self._cursor.get()
+        ready = cursor if epoch == self.epoch else self.stage_start
+        return max(ready, self.free_at.get(lane, 0.0))
+
+    def _model(self, device: str, command: dict, pump_name=None):
+        """Return (duration, feedback) of a command."""
+        action = command["action"]
+        t = self.timing
+
+        match device:
+            case "Pumps":
+                # Without "valve" the caller switched the valves together
+                valves = 2 * t["valve_switch"] if command.get("valve", True) else 0.0
+                level = self.fill_level(pump_name)
+                config = self.hw_config.get("Pumps", {}).get(pump_name) or {}
+                if action == "profile":
+                    # Negative volumes of aspirating profiles fill the syringe
+                    profile = FlowProfile.of(command["segments"])
+                    if "contiflow" in config:
+                        return profile.duration, True
+                    volume = profile.total_volume
+                    if volume > level + 1e-9:
+                        self.underruns.append((pump_name, volume - level))
+                    self.fill_levels[pump_name] = max(0.0, level - volume)
+                    return profile.duration + valves, True
+                if "contiflow" in config:
+                    # Refills itself while dispensing, the valves switch on
+                    # their own
+                    if action == "dispense":
+                        return command["volume"] / command["flow"], True
+                    return 0.0, True
+                match action:
+                    case "aspirate":
+                        volume = command["volume"]
+                        free = self.syringe_volume(pump_name) - level
+                        if volume > free + 1e-9:
+                            self.overflows.append((pump_name, volume - free))
+                        self.fill_levels[pump_name] = level + min(volume, free)
+                    case "dispense":
+                        volume = command["volume"]
+                        if volume > level + 1e-9:
+                            self.underruns.append((pump_name, volume - level))
+                        self.fill_levels[pump_name] = max(0.0, level - volume)
+                    case "refill":
+                        volume = self.syringe_volume(pump_name) - level
+                        self.fill_levels[pump_name] = level + volume
+                    case "empty":
+                        volume = level
+                        self.fill_levels[pump_name] = 0.0
+                    case _:
+                        return 0.0, None
+                return volume / command["flow"] + valves, True
+            case "Arduino":
+                kind, verb = action.split(" ")
+                name = kind.capitalize()
+                if kind.startswith("motor"):
+                    return t["table_step"], f"{name} Rotation Finished"
+                if verb == "extend":
+                    return t["cylinder"], f"{name} Extension Finished"
+                return t["cylinder"], f"{name} Retraction Finished"
+            case "DLS":
+                if action == "request_data":
+                    return command["num_of_runs"] * t["dls_run"], True
+                return t["dls_setup"], True
+            case "UV_Vis":
+                config = self.hw_config.get("UV_Vis", {})
+                int_time = config.get("integration_time", t["uv_integration_time"])
+                average = config.get("average", t["uv_average"])
+                if action == "measure":
+                    return int_time / 1000 * average, []
+                if action == "calibrate":
+                    # A drift check scan while the spectra are valid
+                    calibration = Calibration([], [], [], int_time, 0.0, 0.0)
+                    max_age = config.get("calibration_max_age", CALIBRATION_MAX_AGE)
+                    with self._lock:
+                        start = self._start_of(device)
+                    if (
+                        self.uv_calibrated_at is not None
+                        and start - self.uv_calibrated_at < max_age
+                    ):
+                        return int_time / 1000, calibration
+                    self.uv_calibrated_at = start
+                    return (
+                        2 * (t["uv_shutter"] + int_time / 1000 * average),
+                        calibration,
+                    )
+                return t["uv_shutter"], None
+            case "Gantry":
+                x, y = command["x"], command["y"]
+                distance = math.dist(self.gantry_position, (x, y))
+                self.gantry_position = [x, y]
+                return distance / t["gantry_speed"] + t["gantry_overhead"], None
+
+    def clock(self) -> float:
+        """Current virtual time in seconds."""
+        return self.now
+
+    def is_idle(self, device: str, pump_name=None) -> bool:
+        # Commands finish when they are submitted, in virtual time
+        return True
+
+    def fill_level(self, pump_name) -> float:
+        """Syringe contents of a pump in ml, empty at the start."""
+        return self.fill_levels.get(pump_name, 0.0)
+
+    def syringe_volume(self, pump_name) -> float:
+        config = self.hw_config.get("Pumps", {}).get(pump_name)
+        if not config:
+            return self.timing["syringe_volume"]
+        if "syringe_volume" in config:
+            return config["syringe_volume"]
+        radius = config["inner_diameter_mm"] / 2
+        return math.pi * radius**2 * config["max_piston_stroke_mm"] / 1000
+
+    def report(self, bottles: int) -> SimulationReport:
+        """
+        Summarize the simulated campaign.
+
+        Args:
+            bottles (int): Number of bottles processed by the campaign.
+
+        Returns:
+            SimulationReport: Makespan in seconds, throughput in bottles per
+            hour, utilisation per device and the busiest device.
+        """
+        makespan = self.now
+        utilisation = {
+            lane: (busy / makespan if makespan else 0.0)
+            for lane, busy in sorted(self.busy.items())
+        }
+        bottleneck = max(utilisation, key=utilisation.get) if utilisation else None
+        return SimulationReport(
+            makespan=makespan,
+            bottles=bottles,
+            throughput=bottles / makespan * 3600 if makespan else 0.0,
+            utilisation=utilisation,
+            bottleneck=bottleneck,
+            records=list(self.records),
+        )
+
+
+def simulate(state_machine, hardware: SimulatedHardware = None) -> SimulationReport:
+    """Run a state machine campaign on the simulated cell and report it."""
+    hardware = (hardware or SimulatedHardware()).attach(state_machine)
+    state_machine.auto_run()
+    return hardware.report(state_machine.num_bottles)
+
+
+if __name__ == "__main__":
+    import json
+    from mf_system.logic.state_machine_pipeline import StateMachinePipeline
+
+    # One bottle per sample of the sample config
+    sample_config_path = "src/mf_system/database/sample_config.json"
+    with open(sample_config_path, "r") as file:
+        num_bottles = len(json.load(file)["samples"])
+
+    sm = StateMachinePipeline(
+        name="Simulated Pipeline",
+        num_bottles=num_bottles,
+        test_mode=True,
+        hardware_config_path="src/mf_system/database/hardware_config.yaml",
+        sample_config_path=sample_config_path,
+    )
+    report = simulate(sm)
+
+    print(f"Makespan: {report.makespan / 3600:.2f} h")
+    print(f"Throughput: {report.throughput:.2f} bottles/h")
+    for lane, value in report.utilisation.items():
+        print(f"  {lane}: {value:.0%}")
+    print(f"Bottleneck: {report.bottleneck}")
@@ -0,0 +1,232 @@
+import time
+from functools import partial
+from typing import Callable, List
+
+from transitions import Machine, MachineError
+
+
+class CompiledMachine:
+    """
+    Integer-indexed replacement for `transitions.Machine` in the run loop.
+
+    The `states`/`transitions` lists (see `logic.utils`) are compiled once
+    into a dense table indexed by `trigger * num_states + state`. An entry is
+    either the index of the destination state, or, for guarded transitions
+    like the `is_bottle_on_tray` checks, a tuple of pre-bound conditions and
+    destinations tried in definition order. State actions are bound once as
+    well, so a step is a list lookup and a call.
+
+    Supports the subset of `Machine` the state machines use: `trigger`,
+    `conditions`/`unless`, `finalize_event`, `after_state_change`,
+    `ignore_invalid_triggers` and `set_state`. Trigger arguments are not
+    passed to the conditions.
+    """
+
+    def __init__(
+        self,
+        model,
+        states: List[str],
+        transitions: List[dict],
+        initial: str = "initialize",
+        name: str = "",
+        ignore_invalid_triggers: bool = True,
+        auto_transitions: bool = False,
+        finalize_event: str = None,
+    ):
+        self.model = model
+        self.name = name
+        self.states = list(states)
+        self.ignore_invalid_triggers = ignore_invalid_triggers
+        self.after_state_change: List[Callable] = []
+        self._finalize = getattr(model, finalize_event) if finalize_event else None
+
+        self.state_index = {state: i for i, state in enumerate(self.states)}
+        self.trigger_index = {}
+        self._num_states = len(self.states)
+        self._table = []
+        for transition in transitions:
+            self._add(transition)
+        if auto_transitions:
+            for state in self.states:
+                self._add({"trigger": f"to_{state}", "source": "*", "dest": state})
+
+        self._actions = [None] * self._num_states
+        self._resolve = None
+        self.current = self.state_index[initial]
+        model.state = initial
+        model.trigger = self.trigger
+        for trigger, index in self.trigger_index.items():
+            if not hasattr(model, trigger):
+                setattr(model, trigger, partial(self.fire, index))
+
+    def _add(self, transition: dict):
+        unsupported = set(transition) - {
+            "trigger",
+            "source",
+            "dest",
+            "conditions",
+            "unless",
+        }
+        if unsupported:
+            raise ValueError(f"Cannot compile transition keys {sorted(unsupported)}")
+
+        trigger = transition["trigger"]
+        if trigger not in self.trigger_index:
+            self.trigger_index[trigger] = len(self.trigger_index)
+            self._table.extend([None] * self._num_states)
+        offset = self.trigger_index[trigger] * self._num_states
+
+        sources = transition["source"]
+        if sources == "*":
+            sources = self.states
+        elif isinstance(sources, str):
+            sources = [sources]
+
+        dest = self.state_index[transition["dest"]]
+        conditions = tuple(
+            self._bind(c) for c in self._listify(transition.get("conditions"))
+        )
+        unless = tuple(self._bind(c) for c in self._listify(transition.get("unless")))
+
+        for source in sources:
+            slot = offset + self.state_index[source]
+            entry = self._table[slot]
+            if entry is None and not conditions and not unless:
+                self._table[slot] = dest
+                continue
+            if isinstance(entry, int):
+                # An unguarded transition always wins, like in `Machine`
+                continue
+            self._table[slot] = (entry or ()) + ((conditions, unless, dest),)
+
+    @staticmethod
+    def _listify(value) -> list:
+        if value is None:
+            return []
+        return [value] if isinstance(value, str) or callable(value) else list(value)
+
+    def _bind(self, condition) -> Callable:
+        """Return a callable evaluating a condition name of the model."""
+        if callable(condition):
+            return condition
+        attr = getattr(type(self.model), condition, None)
+        if isinstance(attr, property):
+            return attr.fget.__get__(self.model)
+        return getattr(self.model, condition)
+
+    def bind_actions(self, resolve: Callable[[str], Callable]):
+        """Register the function returning the action of a state name."""
+        self._resolve = resolve
+        self._actions = [None] * self._num_states
+
+    def action(self) -> Callable:
+        """The action of the current state, resolved once per state."""
+        action = self._actions[self.current]
+        if action is None:
+            action = self._actions[self.current] = self._resolve(
+                self.states[self.current]
+            )
+        return action
+
+    def trigger(self, trigger: str, *args, **kwargs) -> bool:
+        index = self.trigger_index.get(trigger)
+        if index is None:
+            if self._finalize:
+                self._finalize(*args, **kwargs)
+            if self.ignore_invalid_triggers:
+                return False
+            raise AttributeError(f"Do not know event named '{trigger}'.")
+        return self.fire(index, *args, **kwargs)
+
+    def fire(self, index: int, *args, **kwargs) -> bool:
+        entry = self._table[index * self._num_states + self.current]
+        try:
+            if entry is None:
+                if self.ignore_invalid_triggers:
+                    return False
+                raise MachineError(
+                    f"Can't trigger event from state {self.states[self.current]}!"
+                )
+            if entry.__class__ is not int:
+                entry = self._guarded(entry)
+                if entry is None:
+                    return False
+
+            self.current = entry
+            self.model.state = self.states[entry]
+            for callback in self.after_state_change:
+                callback(*args, **kwargs)
+            return True
+        finally:
+            if self._finalize:
+                self._finalize(*args, **kwargs)
+
+    @staticmethod
+    def _guarded(alternatives):
+        for conditions, unless, dest in alternatives:
+            if all(c() for c in conditions) and not any(u() for u in unless):
+                return dest
+        return None
+
+    def set_state(self, state: str, model=None):
+        self.current = self.state_index[state]
+        self.model.state = state
+
+
+def benchmark(states: List[str], transitions: List[dict], steps: int = 100_000) -> dict:
+    """
+    Compare the per-step overhead of `Machine` and `CompiledMachine`.
+
+    Every state action only counts the bottles and triggers the next state,
+    so the measured time is the dispatch of the run loop alone.
+
+    Returns:
+        dict: Microseconds per step of both machines.
+    """
+
+    class Model:
+        def __init__(self, machine_cls):
+            self.current_num_bottles = steps
+            self.machine = machine_cls(
+                model=self,
+                states=states,
+                transitions=transitions,
+                initial=states[0],
+                ignore_invalid_triggers=True,
+                auto_transitions=False,
+            )
+
+        @property
+        def is_bottle_on_tray(self) -> bool:
+            return self.current_num_bottles > 0
+
+        def step(self):
+            self.current_num_bottles -= 1
+            self.trigger("command_finished")
+
+    results = {}
+    for machine_cls in (Machine, CompiledMachine):
+        model = Model(machine_cls)
+        model.trigger(transitions[0]["trigger"])
+        if machine_cls is CompiledMachine:
+            model.machine.bind_actions(lambda state: model.step)
+            next_action = model.machine.action
+        else:
+            # The current path of `StateMachine._state_action`
+            next_action = lambda: getattr(model, model.state, model.step)
+
+        started = time.perf_counter()
+        for _ in range(steps):
+            next_action()()
+        elapsed = time.perf_counter() - started
+        results[machine_cls.__name__] = elapsed / steps * 1e6
+    return results
+
+
+if __name__ == "__main__":
+    from mf_system.logic.utils import states, transitions
+
+    result = benchmark(states, transitions)
+    for machine, us in result.items():
+        print(f"{machine}: {us:.2f} us/step")
+    print(f"Speed-up: {result['Machine'] / result['CompiledMachine']:.1f}x")
@@ -2,12 +2,10 @@ import os
 
 from mf_system.logic.state_machine_dispense import StateMachineDispense
 from mf_system.logic.state_machine_measure import StateMachineMeasure
-from mf_system.logic.state_machine_boundary_con import StateMachine
+from mf_system.logic.state_machine_pipeline import StreamingStateMachinePipeline
 from mf_system.logic.utils import (
-    states,
     states_dispense,
     states_measure,
-    transitions,
     transitions_dispense,
     transitions_measure,
 )
@@ -53,11 +51,10 @@ class Controller:
             )
 
         else:
-            self.sm = StateMachine(
-                states=states,
-                transitions=transitions,
+            # One continuous run over all samples, the tray holds 5 bottles
+            self.sm = StreamingStateMachinePipeline(
                 name="State Machine",
-                num_bottles=5,
+                tray_capacity=5,
                 test_mode=True,
                 hardware_config_path=self.hw_config_path,
                 sample_config_path=self.sample_config_path,
@@ -0,0 +1,405 @@
+import os
+import json
+import time
+import threading
+from collections import namedtuple
+from concurrent.futures import Future
+
+import numpy as np
+
+from mf_system.hardware.devices.pump import GroupDosing
+from mf_system.hardware.devices.utils import RequestFailed
+from mf_system.logic.scheduler import DEFAULT_STATION_GRAPH
+from mf_system.logic.state_machine_steps import TABLE_ROTATIONS
+
+# Last durable point of a run, see `RunJournal.replay`
+ResumePoint = namedtuple(
+    "ResumePoint",
+    [
+        "state",
+        "sample_id",
+        "current_num_bottles",
+        "dosed",
+        "positions",
+        "completed",
+        "snapshot",
+    ],
+)
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot journal {type(value).__name__}")
+
+
+class RunJournal:
+    """
+    Append-only journal of a state machine run.
+
+    Every state change and every finished device command is written as one
+    JSON line and flushed to disk with `os.fsync` before the run continues,
+    so after a crash the journal holds everything that really happened.
+
+    Entries:
+        {"type": "run", "machine": ..., "num_bottles": ...}
+        {"type": "state", "state": ..., "sample_id": ..., "current_num_bottles": ...,
+         "snapshot": ...}
+        {"type": "command", "state": ..., "device": ..., "pump": ..., "command": ..., "result": ...}
+
+    Args:
+        path (str): The journal file, appended to if it exists.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def write(self, entry: dict) -> None:
+        line = json.dumps(dict(entry, time=time.time()), default=_to_json)
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def _open(self):
+        new = not os.path.exists(self.path)
+        torn = not new and self._ends_torn()
+        self._file = open(self.path, "a")
+        if torn:
+            # Do not glue the first new entry to a line torn by a crash
+            self._file.write("\n")
+        if new and hasattr(os, "O_DIRECTORY"):
+            # Make the new directory entry durable as well
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _ends_torn(self) -> bool:
+        with open(self.path, "rb") as file:
+            file.seek(0, os.SEEK_END)
+            if file.tell() == 0:
+                return False
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) != b"\n"
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def entries(self) -> list:
+        """Read all complete entries, a torn line of a crash is skipped."""
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, "r") as file:
+            for line in file:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return entries
+
+    def replay(self):
+        """
+        Rebuild the last durable point of the run from the journal.
+
+        Returns:
+            ResumePoint or None: None if no state was journaled yet.
+        """
+        point = None
+        dosed = {}
+        positions = {"tables": {}, "gantry": None}
+        completed = []
+        for entry in self.entries():
+            if entry["type"] == "state":
+                point = entry
+                completed = []
+            elif entry["type"] == "command":
+                completed.append(entry)
+                self._track(entry, dosed, positions)
+
+        if point is None:
+            return None
+        return ResumePoint(
+            state=point["state"],
+            sample_id=point["sample_id"],
+            current_num_bottles=point["current_num_bottles"],
+            dosed=dosed,
+            positions=positions,
+            completed=completed,
+            snapshot=point.get("snapshot"),
+        )
+
+    @staticmethod
+    def _track(entry: dict, dosed: dict, positions: dict):
+        command = entry["command"]
+        action = command["action"]
+        if entry["device"] == "Pumps" and action in ("aspirate", "dispense"):
+            pump = dosed.setdefault(entry["pump"], {"aspirated": 0.0, "dispensed": 0.0})
+            pump[f"{action}d"] += command["volume"]
+        elif entry["device"] == "Arduino" and action.endswith("rotate"):
+            motor = action.split(" ")[0]
+            positions["tables"][motor] = positions["tables"].get(motor, 0) + 1
+        elif entry["device"] == "Gantry" and action == "move":
+            positions["gantry"] = [command["x"], command["y"]]
+
+    def attach(self, state_machine, resume_point: ResumePoint = None):
+        """
+        Journal a state machine.
+
+        The hardware of the machine is wrapped by `JournaledHardware` and
+        every state change is written to the journal.
+        """
+        if not self.entries():
+            self.write(
+                {
+                    "type": "run",
+                    "machine": type(state_machine).__name__,
+                    "num_bottles": state_machine.num_bottles,
+                }
+            )
+
+        if state_machine.hardware is not None:
+            state_machine.hardware = JournaledHardware(
+                state_machine.hardware, self, state_machine, resume_point
+            )
+
+        def on_state_change(*args, **kwargs):
+            entry = {
+                "type": "state",
+                "state": state_machine.state,
+                "sample_id": state_machine.sample_id,
+                "current_num_bottles": state_machine.current_num_bottles,
+            }
+            # Machines that keep more state than their state name, e.g. the
+            # `StreamingStateMachinePipeline`, journal a snapshot of it
+            if hasattr(state_machine, "snapshot"):
+                entry["snapshot"] = state_machine.snapshot()
+            self.write(entry)
+
+        state_machine.machine.after_state_change.append(on_state_change)
+        return state_machine
+
+
+class JournaledHardware:
+    """
+    Write every finished command of a hardware manager to the journal.
+
+    When resuming, the commands the interrupted state already finished are
+    not sent to the devices again, the journaled result is returned instead.
+    This keeps e.g. a pump from dispensing a second time into the same bottle.
+    """
+
+    def __init__(self, hardware, journal: RunJournal, state_machine, resume_point=None):
+        self.hardware = hardware
+        self.journal = journal
+        self.state_machine = state_machine
+        self._lock = threading.Lock()
+        self._counts = {}  # (state, device, pump, action) -> commands sent
+
+        self.dosed = {}
+        self.positions = {"tables": {}, "gantry": None}
+        # (state, device, pump, action, n) -> journaled result
+        self._completed = {}
+        if resume_point:
+            self.dosed = resume_point.dosed
+            self.positions = resume_point.positions
+            counts = {}
+            for entry in resume_point.completed:
+                key = self._key(
+                    entry["state"], entry["device"], entry["pump"], entry["command"]
+                )
+                counts[key] = counts.get(key, 0) + 1
+                self._completed[key + (counts[key],)] = entry["result"]
+
+    def __getattr__(self, name):
+        # Everything else (adapters, hw_config, lane_metrics, ...) is unchanged
+        return getattr(self.hardware, name)
+
+    @staticmethod
+    def _key(state, device, pump_name, command):
+        return (state, device, pump_name, command["action"])
+
+    def _next(self, device, command, pump_name):
+        key = self._key(self.state_machine.state, device, pump_name, command)
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+            key = key + (self._counts[key],)
+            if key in self._completed:
+                return key, True, self._completed.pop(key)
+        return key, False, None
+
+    def _done(self, key, device, command, pump_name, result):
+        self.journal.write(
+            {
+                "type": "command",
+                "state": key[0],
+                "device": device,
+                "pump": pump_name,
+                "command": command,
+                "result": result,
+            }
+        )
+        with self._lock:
+            RunJournal._track(
+                {"device": device, "pump": pump_name, "command": command},
+                self.dosed,
+                self.positions,
+            )
+        return result
+
+    def execute_command(self, device: str, command: dict, pump_name=None):
+        key, done, result = self._next(device, command, pump_name)
+        if done:
+            print(f"Resume: skipped finished {device} {command['action']}")
+            return result
+        result = self.hardware.execute_command(device, command, pump_name)
+        return self._done(key, device, command, pump_name, result)
+
+    def submit_command(self, device: str, command: dict, pump_name=None):
+        key, done, result = self._next(device, command, pump_name)
+        if done:
+            print(f"Resume: skipped finished {device} {command['action']}")
+            future = Future()
+            future.set_result(result)
+            return future
+
+        future = Future()
+        inner = self.hardware.submit_command(device, command, pump_name)
+
+        def finished(inner):
+            try:
+                future.set_result(
+                    self._done(key, device, command, pump_name, inner.result())
+                )
+            except Exception as e:
+                future.set_exception(e)
+
+        inner.add_done_callback(finished)
+        return future
+
+    def dispense_group(self, commands: dict):
+        # Pumps that finished before the interruption are left out
+        keys, results = {}, {}
+        for pump_name, command in commands.items():
+            key, done, result = self._next("Pumps", command, pump_name)
+            if done:
+                print(f"Resume: skipped finished Pumps {command['action']}")
+                results[pump_name] = result
+            else:
+                keys[pump_name] = key
+        if not keys:
+            return GroupDosing(results, {}, 0.0)
+
+        def finished(pump_name, result):
+            # Journaled per pump, a pump that finished stays finished even
+            # if another pump of the group fails
+            self._done(keys[pump_name], "Pumps", commands[pump_name], pump_name, result)
+
+        dosing = self.hardware.dispense_group(
+            {p: commands[p] for p in keys}, finished=finished
+        )
+        return dosing._replace(results=dict(results, **dosing.results))
+
+    async def execute_command_async(self, device: str, command: dict, pump_name=None):
+        key, done, result = self._next(device, command, pump_name)
+        if done:
+            print(f"Resume: skipped finished {device} {command['action']}")
+            return result
+        result = await self.hardware.execute_command_async(device, command, pump_name)
+        return self._done(key, device, command, pump_name, result)
+
+
+def restore_positions(hardware, positions: dict, station_graph: dict = None):
+    """
+    Drive the turntables and the gantry back to their journaled positions.
+
+    The devices home when they are initialized, so every table is rotated
+    by its journaled rotations modulo its slots and the gantry moves to its
+    last target. The commands bypass the journal, they only repeat where the
+    journaled run already went.
+
+    Args:
+        hardware: The hardware manager, not the `JournaledHardware`.
+        positions (dict): `ResumePoint.positions`.
+        station_graph (dict, optional): Slots of the tables,
+            `DEFAULT_STATION_GRAPH` by default.
+    """
+    tables = (station_graph or DEFAULT_STATION_GRAPH)["tables"]
+    for table, (command, expected, message) in TABLE_ROTATIONS.items():
+        rotations = positions["tables"].get(command.split(" ")[0], 0)
+        slots = tables.get(f"{table}_table", {}).get("slots")
+        for _ in range(rotations % slots if slots else rotations):
+            if hardware.execute_command("Arduino", {"action": command}) != expected:
+                raise RequestFailed(message)
+
+    if positions["gantry"] is not None:
+        x, y = positions["gantry"]
+        hardware.execute_command("Gantry", {"action": "move", "x": x, "y": y})
+
+
+def resume(state_machine, journal_path: str):
+    """
+    Continue an interrupted run from its journal.
+
+    The state machine has to be created with the same configuration as the
+    interrupted run. Its state, sample and bottle counters are restored to
+    the last journaled state change, a streaming machine continues from its
+    journaled snapshot, and the turntables and the gantry are driven back to
+    their journaled positions. `auto_run` then repeats that state, skipping
+    the device commands it already finished.
+
+    Returns:
+        ResumePoint or None: The restored point, None if the run never left
+        `initialize` and simply starts from the beginning.
+    """
+    journal = RunJournal(journal_path)
+    entries = journal.entries()
+    header = entries[0] if entries else {}
+    if (
+        header.get("num_bottles", state_machine.num_bottles)
+        != state_machine.num_bottles
+    ):
+        raise ValueError(
+            f"Journal was written for {header['num_bottles']} bottles, "
+            f"not {state_machine.num_bottles}."
+        )
+
+    point = journal.replay()
+    journal.attach(state_machine, point)
+    if point is None:
+        return None
+
+    if point.state not in state_machine.machine.states:
+        raise ValueError(f"Unknown state '{point.state}' in the journal.")
+    if hasattr(state_machine, "restore"):
+        if point.snapshot is None:
+            raise ValueError("The journal holds no snapshot of the stream.")
+        state_machine.restore(point.snapshot)
+
+    # Reconnect the devices without running the initialize state again
+    if state_machine.hardware is not None:
+        state_machine.hardware.initialize_all()
+        restore_positions(
+            state_machine.hardware.hardware,
+            point.positions,
+            getattr(state_machine, "station_graph", None),
+        )
+    state_machine.machine.set_state(point.state, model=state_machine)
+    state_machine.sample_id = point.sample_id
+    state_machine.current_num_bottles = point.current_num_bottles
+    print(
+        f"Resuming at {point.state}, sample {point.sample_id}, "
+        f"{point.current_num_bottles} bottles on the tray"
+    )
+    return point
@@ -0,0 +1,195 @@
+import json
+import statistics
+from typing import Dict, List
+
+from mf_system.logic.scheduler import (
+    Action,
+    PipelineScheduler,
+    PipelineState,
+    Schedule,
+)
+
+# Rough durations in seconds, used for actions without any recorded run
+DEFAULT_DURATIONS = {
+    "tray_to_pump": 20.0,
+    "pump_to_measure": 20.0,
+    "measure_to_tray": 20.0,
+    "rotate_table_p": 3.0,
+    "rotate_table_m": 3.0,
+    "measure_UV": 30.0,
+    "measure_DLS": 120.0,
+    "fill_bottle": 60.0,
+}
+
+
+def load_duration_log(path: str) -> List[dict]:
+    """
+    Read the action records written by the pipeline state machine.
+
+    Every line is a JSON object like
+    `{"action": "fill_bottle", "bottle": 3, "duration": 12.5, "volume": 10, "flow": 0.01}`.
+    """
+    records = []
+    with open(path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+
+class DurationModel:
+    """
+    Predict the duration of scheduled actions from recorded runs.
+
+    Every action takes the median of its recorded durations. The fill time
+    depends on the sample, so it is predicted as `volume / out_flow` of the
+    sample plus the median overhead (valve switching etc.) seen in the records.
+
+    Args:
+        records (list[dict]): Action records, see `load_duration_log`.
+        sample_config (dict, optional): Sample config of the planned run.
+        defaults (dict, optional): Durations of actions without records.
+    """
+
+    def __init__(
+        self,
+        records: List[dict] = None,
+        sample_config: dict = None,
+        defaults: dict = None,
+    ):
+        self.sample_config = sample_config
+        self.defaults = dict(DEFAULT_DURATIONS, **(defaults or {}))
+
+        samples = {}
+        overheads = []
+        for record in records or []:
+            samples.setdefault(record["action"], []).append(record["duration"])
+            if record["action"] == "fill_bottle" and record.get("flow"):
+                overheads.append(record["duration"] - record["volume"] / record["flow"])
+
+        self.durations: Dict[str, float] = {
+            name: statistics.median(values) for name, values in samples.items()
+        }
+        self.fill_overhead = (
+            max(0.0, statistics.median(overheads)) if overheads else 0.0
+        )
+
+    @classmethod
+    def from_log(cls, path: str, sample_config: dict = None, defaults: dict = None):
+        return cls(load_duration_log(path), sample_config, defaults)
+
+    def duration(self, action) -> float:
+        if action.name == "fill_bottle" and self.sample_config:
+            sample = self.sample_config["samples"].get(str(action.bottle))
+            if sample:
+                return (
+                    sample["volume"] / self.sample_config["out_flow"]
+                    + self.fill_overhead
+                )
+        if action.name in self.durations:
+            return self.durations[action.name]
+        return self.defaults.get(action.name, 0.0)
+
+    def stage_duration(self, actions) -> float:
+        """All actions of a stage start together, the stage ends with the slowest."""
+        return max((self.duration(a) for a in actions), default=0.0)
+
+    def makespan(self, schedule) -> float:
+        return sum(self.stage_duration(stage.actions) for stage in schedule)
+
+
+class MakespanOptimizer:
+    """
+    Search the stage sequence with the shortest predicted makespan.
+
+    The greedy `PipelineScheduler` always picks the same kind of stage no
+    matter how long the actions take. This optimizer explores all candidate
+    stages of the scheduler (which gantry transfer to serve, rotating a
+    table early, ...) with a beam search and scores them with a
+    `DurationModel`, so e.g. a long DLS measurement is overlapped with the
+    next fill instead of a short one.
+
+    Args:
+        scheduler (PipelineScheduler): Provides the cell layout and the moves.
+        model (DurationModel): Predicted action durations.
+        beam_width (int): Number of partial schedules kept per stage.
+    """
+
+    def __init__(
+        self, scheduler: PipelineScheduler, model: DurationModel, beam_width: int = 64
+    ):
+        self.scheduler = scheduler
+        self.model = model
+        self.beam_width = beam_width
+
+    def optimize(self) -> Schedule:
+        """Return the best schedule found, never worse than the greedy one."""
+        greedy = self.scheduler.generate()
+        best_time = self.model.makespan(greedy)
+        best = greedy
+
+        # (elapsed, state, stages)
+        beam = [(0.0, self.scheduler.new_state(), [])]
+        while beam:
+            expanded = {}
+            for elapsed, state, stages in beam:
+                for actions in self.scheduler.candidates(state):
+                    child = state.copy()
+                    self.scheduler.apply(child, actions)
+                    child_time = elapsed + self.model.stage_duration(actions)
+                    if child_time >= best_time:
+                        continue
+
+                    if child.is_done():
+                        best_time = child_time
+                        best = self.scheduler.build_schedule(stages + [actions])
+                        continue
+
+                    # Equal cell states only need to be explored once
+                    key = self._signature(child)
+                    if key not in expanded or expanded[key][0] > child_time:
+                        expanded[key] = (child_time, child, stages + [actions])
+
+            beam = sorted(
+                expanded.values(), key=lambda n: n[0] + self._lower_bound(n[1])
+            )[: self.beam_width]
+        return best
+
+    def _lower_bound(self, state: PipelineState) -> float:
+        """Remaining work of the busiest station, a bound for the makespan left."""
+        remaining = {}
+        pending = list(state.progress.items())
+        pending += [(b, 0) for b in state.tray]
+        for bottle, step in pending:
+            for name in self.scheduler.route[step:]:
+                # All transfers share the gantry
+                resource = "gantry" if name in self.scheduler.transfers else name
+                remaining[resource] = remaining.get(
+                    resource, 0.0
+                ) + self.model.duration(Action(name, bottle))
+        return max(remaining.values(), default=0.0)
+
+    @staticmethod
+    def _signature(state: PipelineState) -> tuple:
+        return (
+            tuple(state.tray),
+            tuple(tuple(slots) for slots in state.slots.values()),
+            tuple(sorted(state.progress.items())),
+            state.rotating,
+        )
+
+
+if __name__ == "__main__":
+    from mf_system.hardware.hardware import HardwareFactory
+
+    sample_config = HardwareFactory._load_config(
+        "src/mf_system/database/sample_config.json", loader=json.load
+    )
+    model = DurationModel(sample_config=sample_config)
+    scheduler = PipelineScheduler(num_bottles=10)
+
+    greedy = scheduler.generate()
+    best = MakespanOptimizer(scheduler, model).optimize()
+    print(f"Greedy: {len(greedy)} stages, {model.makespan(greedy):.0f} s")
+    print(f"Optimized: {len(best)} stages, {model.makespan(best):.0f} s")
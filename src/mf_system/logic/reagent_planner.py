@@ -0,0 +1,217 @@
+import math
+import threading
+from collections import namedtuple
+from typing import Dict, List
+
+import numpy as np
+
+from mf_system.logic.optimizer import DurationModel
+
+# Samples one syringe filling covers, ids of the sample config
+Load = namedtuple("Load", ["pump", "first_sample", "last_sample", "volume"])
+
+# Aspiration of a load before `before_sample` is dispensed. `stage` is the
+# index of the pipeline stage it is started with, None if it is taken right
+# before its sample, e.g. without a schedule.
+Refill = namedtuple("Refill", ["pump", "before_sample", "volume", "stage"])
+
+# Seconds of the valve switches around an aspiration
+REFILL_OVERHEAD = 2.0
+
+
+def syringe_capacity(pump_config: dict) -> float:
+    """
+    Usable syringe volume of a pump in ml.
+
+    Uses `syringe_volume` of the pump config if given, else the volume of the
+    piston stroke, the offline equivalent of `Pump.get_volume_max()`.
+    ContiFlow pumps never run empty, their capacity is infinite.
+    """
+    if "contiflow" in pump_config:
+        return math.inf
+    if "syringe_volume" in pump_config:
+        return pump_config["syringe_volume"]
+    radius = pump_config["inner_diameter_mm"] / 2
+    return math.pi * radius**2 * pump_config["max_piston_stroke_mm"] / 1000
+
+
+def demand_table(samples: dict):
+    """
+    Volume every pump dispenses for every sample.
+
+    Returns:
+        tuple: (sample ids, pump ids, volumes), volumes has one row per
+        sample and one column per pump, in ml.
+    """
+    sample_ids = sorted(samples, key=int)
+    pumps = sorted({p for sample in samples.values() for p in sample["pumps"]})
+    column = {pump: i for i, pump in enumerate(pumps)}
+
+    rows, cols, props, totals, volumes = [], [], [], [], []
+    for row, sample_id in enumerate(sample_ids):
+        sample = samples[sample_id]
+        total = sum(sample["proportion"])
+        for prop, pump in zip(sample["proportion"], sample["pumps"]):
+            rows.append(row)
+            cols.append(column[pump])
+            props.append(prop)
+            totals.append(total)
+            volumes.append(sample["volume"])
+
+    table = np.zeros((len(sample_ids), len(pumps)))
+    np.add.at(
+        table,
+        (np.array(rows, dtype=int), np.array(cols, dtype=int)),
+        np.array(props) / np.array(totals) * np.array(volumes),
+    )
+    return [int(s) for s in sample_ids], pumps, table
+
+
+def split_loads(pump: str, sample_ids: list, demand: np.ndarray, capacity: float):
+    """
+    Split the demand of one pump into as few syringe loads as possible.
+
+    A load covers consecutive samples, the syringe is only refilled between
+    two samples. Filling every load up to the capacity gives the minimal
+    number of refills for the fixed sample order.
+
+    Raises:
+        ValueError: A single sample needs more than one syringe.
+    """
+    if demand.max(initial=0.0) > capacity + 1e-9:
+        sample = sample_ids[int(demand.argmax())]
+        raise ValueError(
+            f"Sample {sample} needs {demand.max():.3f} ml of {pump}, "
+            f"the syringe holds {capacity:.3f} ml"
+        )
+
+    cumulative = np.cumsum(demand)
+    used = np.nonzero(demand > 0)[0]
+    loads = []
+    start = used[0] if len(used) else len(demand)
+    while start < len(demand):
+        before = cumulative[start - 1] if start else 0.0
+        end = int(np.searchsorted(cumulative, before + capacity + 1e-9, "right"))
+        last = used[used < end][-1]
+        loads.append(
+            Load(
+                pump,
+                sample_ids[start],
+                sample_ids[last],
+                cumulative[last] - before,
+            )
+        )
+        # Skip samples the pump is not used for
+        rest = used[used >= end]
+        start = rest[0] if len(rest) else len(demand)
+    return loads
+
+
+class ReagentPlan:
+    """
+    Syringe loads of every pump for a campaign.
+
+    `initial` is aspirated before the run (see `StateMachine.prepare_pump`),
+    the `refills` are taken by the state machine while it runs: with a
+    pipeline schedule at the start of their stage, otherwise right before
+    their sample is dispensed.
+    """
+
+    def __init__(self, loads: Dict[str, List[Load]], refills: List[Refill]):
+        self.loads = loads
+        # Pumps no sample uses have no load
+        self.initial = {
+            pump: pump_loads[0].volume
+            for pump, pump_loads in loads.items()
+            if pump_loads
+        }
+        self.refills = refills
+        self._pending = list(refills)
+        self._lock = threading.Lock()
+
+    @property
+    def refill_count(self) -> int:
+        return len(self.refills)
+
+    def take(self, stage: int = None, sample: int = None) -> List[Refill]:
+        """Remove and return the refills due at a stage or before a sample."""
+        with self._lock:
+            due = [
+                r
+                for r in self._pending
+                if (sample is not None and r.before_sample <= sample)
+                or (stage is not None and r.stage is not None and r.stage <= stage)
+            ]
+            self._pending = [r for r in self._pending if r not in due]
+        return due
+
+
+def fill_stages(schedule) -> Dict[int, int]:
+    """{bottle: index of the stage filling it} of a pipeline schedule."""
+    return {
+        action.bottle: stage.index
+        for stage in schedule
+        for action in stage.actions
+        if action.name == "fill_bottle"
+    }
+
+
+def idle_stage(schedule, durations, last_fill: int, next_fill: int, duration: float):
+    """
+    Stage to start a refill with, between two fills of its pump.
+
+    Returns:
+        int or None: The stage after `last_fill` if a refill of `duration`
+        seconds started with it ends before the `next_fill` stage, else None.
+    """
+    if last_fill is None or next_fill is None:
+        return None
+    gap = sum(
+        durations.stage_duration(stage.actions)
+        for stage in schedule.stages[last_fill + 1 : next_fill]
+    )
+    return last_fill + 1 if duration <= gap else None
+
+
+def plan_reagents(
+    samples: dict, pump_config: dict, schedule=None, durations: DurationModel = None
+) -> ReagentPlan:
+    """
+    Plan the syringe loads and refills of all pumps.
+
+    With a pipeline schedule every refill is placed in the stage after the
+    previous load was used up, i.e. while the bottle is in the measurement
+    stations and the pump would idle, so it does not delay the next
+    `fill_bottle`. Bottle n of the schedule gets sample n. A refill that
+    takes longer than the predicted idle stages is taken right before its
+    sample instead.
+
+    Args:
+        samples (dict): "samples" of the sample config.
+        pump_config (dict): "Pumps" of the hardware config, see
+            `syringe_capacity`.
+        schedule (Schedule, optional): Pipeline schedule of the run.
+        durations (DurationModel, optional): Predicts the idle stages, the
+            default durations if None.
+    """
+    sample_ids, pumps, table = demand_table(samples)
+    stages = fill_stages(schedule) if schedule is not None else {}
+    durations = durations or DurationModel()
+
+    loads, refills = {}, []
+    for i, pump in enumerate(pumps):
+        capacity = syringe_capacity(pump_config[pump])
+        loads[pump] = split_loads(pump, sample_ids, table[:, i], capacity)
+        for previous, load in zip(loads[pump], loads[pump][1:]):
+            duration = load.volume / pump_config[pump]["flow"] + REFILL_OVERHEAD
+            stage = idle_stage(
+                schedule,
+                durations,
+                stages.get(previous.last_sample),
+                stages.get(load.first_sample),
+                duration,
+            )
+            refills.append(Refill(pump, load.first_sample, load.volume, stage))
+
+    refills.sort(key=lambda r: (r.before_sample, r.pump))
+    return ReagentPlan(loads, refills)
@@ -0,0 +1,336 @@
+from collections import namedtuple
+
+# One scheduled action, e.g. Action("fill_bottle", 3) fills the third bottle
+Action = namedtuple("Action", ["name", "bottle"])
+
+# One step of the pipeline, all actions inside a stage run in parallel
+Stage = namedtuple("Stage", ["index", "phase", "actions"])
+
+# Station graph of the cell: tray -> pump slot -> turntable -> UV -> DLS -> tray.
+# Slot 0 of every turntable is the slot the gantry loads and unloads, the
+# stations sit on the following slots in the order the table rotates.
+DEFAULT_STATION_GRAPH = {
+    "tables": {
+        "pump_table": {
+            "rotate": "rotate_table_p",
+            "slots": 2,
+            "stations": {1: "fill_bottle"},
+        },
+        "measure_table": {
+            "rotate": "rotate_table_m",
+            "slots": 3,
+            "stations": {1: "measure_UV", 2: "measure_DLS"},
+        },
+    },
+    "transfers": [
+        {"action": "tray_to_pump", "source": "tray", "target": "pump_table"},
+        {"action": "pump_to_measure", "source": "pump_table", "target": "measure_table"},
+        {"action": "measure_to_tray", "source": "measure_table", "target": "tray"},
+    ],
+}
+
+
+class Schedule:
+    """
+    A generated pipeline schedule.
+
+    Besides the ordered stages, the schedule provides the `states` and
+    `transitions` lists in the same format as `logic.utils`, so it can be
+    loaded into a `transitions.Machine` directly.
+    """
+
+    def __init__(self, stages: list, num_bottles: int):
+        self.stages = stages
+        self.num_bottles = num_bottles
+
+    def __len__(self):
+        return len(self.stages)
+
+    def __iter__(self):
+        return iter(self.stages)
+
+    def __getitem__(self, index):
+        return self.stages[index]
+
+    @staticmethod
+    def state_name(index: int) -> str:
+        return f"stage_{index + 1}"
+
+    @property
+    def states(self) -> list[str]:
+        return ["initialize"] + [self.state_name(s.index) for s in self.stages]
+
+    @property
+    def transitions(self) -> list[dict]:
+        transitions = [
+            {
+                "trigger": "initialize_finished",
+                "source": "initialize",
+                "dest": self.state_name(0),
+            }
+        ]
+        for stage in self.stages[1:]:
+            transitions.append(
+                {
+                    "trigger": "command_finished",
+                    "source": self.state_name(stage.index - 1),
+                    "dest": self.state_name(stage.index),
+                }
+            )
+        return transitions
+
+    def phase(self, name: str) -> list:
+        """Return all stages of a phase ("fill_up", "steady" or "drain")."""
+        return [stage for stage in self.stages if stage.phase == name]
+
+    def action_count(self, name: str) -> int:
+        return sum(a.name == name for stage in self.stages for a in stage.actions)
+
+
+class PipelineState:
+    """
+    Snapshot of the cell while the schedule is built: which bottles are still
+    on the tray, which slot holds which bottle and how far each bottle got
+    along its route.
+    """
+
+    def __init__(self, graph: dict, num_bottles: int):
+        self.tray = list(range(1, num_bottles + 1))
+        self.slots = {name: [None] * t["slots"] for name, t in graph["tables"].items()}
+        self.progress = {}  # bottle -> index of its next step on the route
+        self.finished = []
+        self.rotating = False  # True while the turntables are being rotated
+
+    def copy(self):
+        other = PipelineState.__new__(PipelineState)
+        other.tray = list(self.tray)
+        other.slots = {name: list(slots) for name, slots in self.slots.items()}
+        other.progress = dict(self.progress)
+        other.finished = list(self.finished)
+        other.rotating = self.rotating
+        return other
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.progress)
+
+    def is_done(self) -> bool:
+        return not self.tray and not self.progress
+
+
+class PipelineScheduler:
+    """
+    Generate an overlapped schedule for any number of bottles.
+
+    Every bottle follows the route derived from the station graph. The
+    scheduler repeatedly builds stages: a work stage runs every station that
+    has a bottle waiting plus one gantry transfer, and only if nothing can be
+    done the turntables rotate. This yields the fill-up, steady-state and drain
+    phases automatically and keeps every station busy once the pipeline is
+    full, so the throughput is limited only by the bottleneck station.
+
+    Args:
+        num_bottles (int): Number of bottles to process.
+        station_graph (dict, optional): Cell layout, `DEFAULT_STATION_GRAPH` by default.
+        gantry_priority (list[str], optional): Order in which pending gantry
+            transfers are served. Downstream transfers first by default, which
+            empties the cell before new bottles are loaded.
+        merge_rotations (bool): Rotate all ready turntables in one stage.
+            Both tables are driven by the same Arduino, so by default the
+            tables rotate one after another like the hand-written machines.
+    """
+
+    def __init__(
+        self,
+        num_bottles: int,
+        station_graph: dict = None,
+        gantry_priority: list[str] = None,
+        merge_rotations: bool = False,
+    ):
+        if num_bottles < 1:
+            raise ValueError("At least one bottle is required.")
+
+        self.num_bottles = num_bottles
+        self.graph = station_graph or DEFAULT_STATION_GRAPH
+        self.route = self._build_route(self.graph)
+        self.transfers = {t["action"]: t for t in self.graph["transfers"]}
+        self.gantry_priority = gantry_priority or [
+            t["action"] for t in reversed(self.graph["transfers"])
+        ]
+        self.merge_rotations = merge_rotations
+
+    @staticmethod
+    def _build_route(graph: dict) -> list[str]:
+        """Walk the transfers and collect every station a bottle passes."""
+        route = []
+        for transfer in graph["transfers"]:
+            route.append(transfer["action"])
+            table = graph["tables"].get(transfer["target"])
+            if table:
+                for slot in sorted(table["stations"]):
+                    route.append(table["stations"][slot])
+        return route
+
+    def new_state(self) -> PipelineState:
+        return PipelineState(self.graph, self.num_bottles)
+
+    def generate(self) -> Schedule:
+        """Build the full schedule with the greedy policy."""
+        state = self.new_state()
+        stages = []
+        while not state.is_done():
+            actions = self.candidates(state)[0]
+            self.apply(state, actions)
+            stages.append(actions)
+        return self.build_schedule(stages)
+
+    def build_schedule(self, stage_actions: list[list]) -> Schedule:
+        """Label the stages with their phase and wrap them in a `Schedule`."""
+        loads = [i for i, s in enumerate(stage_actions) if self._has(s, self.route[0])]
+        exits = [i for i, s in enumerate(stage_actions) if self._has(s, self.route[-1])]
+        last_load = loads[-1] if loads else -1
+        first_exit = exits[0] if exits else len(stage_actions)
+
+        stages = []
+        for i, actions in enumerate(stage_actions):
+            if i > last_load:
+                phase = "drain"
+            elif i < first_exit:
+                phase = "fill_up"
+            else:
+                phase = "steady"
+            stages.append(Stage(i, phase, list(actions)))
+        return Schedule(stages, self.num_bottles)
+
+    @staticmethod
+    def _has(actions, name) -> bool:
+        return any(a.name == name for a in actions)
+
+    def next_step(self, state: PipelineState, bottle: int) -> str:
+        return self.route[state.progress[bottle]]
+
+    def candidates(self, state: PipelineState) -> list[list]:
+        """
+        Return every sensible next stage for the given state.
+
+        The first entry follows the configured policy, the others are the
+        alternatives explored by the optimizer (another gantry transfer or
+        rotating a turntable early).
+        """
+        stations = self._station_actions(state)
+        transfers = self._transfer_actions(state)
+        rotations = self._rotation_actions(state, relaxed=False)
+
+        work = []
+        if stations or transfers:
+            ordered = sorted(transfers, key=lambda a: self.gantry_priority.index(a.name))
+            for transfer in ordered or [None]:
+                work.append(stations + ([transfer] if transfer else []))
+        if self.merge_rotations:
+            turns = [rotations] if rotations else []
+        else:
+            turns = [[rotation] for rotation in rotations]
+
+        # Finish rotating all ready tables before the stations start working,
+        # otherwise a table that is ready would idle for a whole work stage
+        options = turns + work if state.rotating else work + turns
+        if not options:
+            # Nothing is ready in the strict sense, move any table holding bottles
+            options.extend([r] for r in self._rotation_actions(state, relaxed=True))
+        if not options:
+            raise RuntimeError("Pipeline deadlocked, check the station graph.")
+        return options
+
+    def _station_actions(self, state: PipelineState) -> list:
+        actions = []
+        for name, table in self.graph["tables"].items():
+            for slot, station in table["stations"].items():
+                bottle = state.slots[name][slot]
+                if bottle is not None and self.next_step(state, bottle) == station:
+                    actions.append(Action(station, bottle))
+        return actions
+
+    def _transfer_actions(self, state: PipelineState) -> list:
+        actions = []
+        for transfer in self.graph["transfers"]:
+            source, target = transfer["source"], transfer["target"]
+
+            if source == "tray":
+                bottle = state.tray[0] if state.tray else None
+            else:
+                bottle = state.slots[source][0]
+                if bottle is not None and self.next_step(state, bottle) != transfer["action"]:
+                    bottle = None
+
+            if bottle is None:
+                continue
+            if target != "tray" and state.slots[target][0] is not None:
+                continue
+            actions.append(Action(transfer["action"], bottle))
+        return actions
+
+    def _rotation_actions(self, state: PipelineState, relaxed: bool) -> list:
+        actions = []
+        for name, table in self.graph["tables"].items():
+            slots = state.slots[name]
+            bottles = [(slot, b) for slot, b in enumerate(slots) if b is not None]
+            if not bottles:
+                continue
+
+            if not relaxed:
+                # Do not rotate away a station that still has to work
+                busy = any(
+                    self.next_step(state, b) == table["stations"].get(slot)
+                    for slot, b in bottles
+                )
+                # Do not rotate away a bottle the gantry has to pick up
+                unload = slots[0] is not None and self.next_step(
+                    state, slots[0]
+                ) in self.transfers
+                # Only rotate if a bottle needs another slot of this table
+                needed = any(
+                    self.next_step(state, b) != table["stations"].get(slot)
+                    for slot, b in bottles
+                    if not (slot == 0 and self.next_step(state, b) in self.transfers)
+                )
+                if busy or unload or not needed:
+                    continue
+            actions.append(Action(table["rotate"], None))
+        return actions
+
+    def apply(self, state: PipelineState, actions: list) -> None:
+        """Advance the pipeline state by one stage."""
+        state.rotating = all(action.bottle is None for action in actions)
+        for action in actions:
+            if action.bottle is None:
+                table = next(
+                    n for n, t in self.graph["tables"].items() if t["rotate"] == action.name
+                )
+                slots = state.slots[table]
+                state.slots[table] = [slots[-1]] + slots[:-1]
+                continue
+
+            if action.name in self.transfers:
+                transfer = self.transfers[action.name]
+                if transfer["source"] == "tray":
+                    state.tray.remove(action.bottle)
+                    state.progress[action.bottle] = 0
+                else:
+                    state.slots[transfer["source"]][0] = None
+                if transfer["target"] != "tray":
+                    state.slots[transfer["target"]][0] = action.bottle
+
+            state.progress[action.bottle] += 1
+            if state.progress[action.bottle] == len(self.route):
+                del state.progress[action.bottle]
+                state.finished.append(action.bottle)
+
+
+if __name__ == "__main__":
+    schedule = PipelineScheduler(num_bottles=5).generate()
+
+    for stage in schedule:
+        actions = " + ".join(
+            a.name if a.bottle is None else f"{a.name}({a.bottle})" for a in stage.actions
+        )
+        print(f"{Schedule.state_name(stage.index)} [{stage.phase}]: {actions}")
@@ -1,16 +1,15 @@
-import time
 import logging
-import json
-from typing import List, Optional
-from concurrent.futures import ThreadPoolExecutor
+import threading
+from typing import Dict, List, Optional
 
 from transitions import Machine
 
-from mf_system.hardware.hardware import HardwareManager, HardwareFactory
-from mf_system.hardware.devices.utils import RequestFailed
+from mf_system.hardware.hardware import HardwareManager
+from mf_system.logic.compiled_machine import CompiledMachine
+from mf_system.logic.state_machine_steps import StateMachineSteps
 
 
-class StateMachine:
+class StateMachine(StateMachineSteps):
     def __init__(
         self,
         states: List[str],
@@ -23,8 +22,12 @@ class StateMachine:
         initial: str = "initialize",
         ignore_invalid_triggers: bool = True,
         auto_transitions: bool = False,
+        hardware=None,
+        compiled: bool = False,
     ):
-        self.machine = Machine(
+        # The compiled machine dispatches states and triggers by integer index
+        machine_cls = CompiledMachine if compiled else Machine
+        self.machine = machine_cls(
             model=self,
             states=states,
             transitions=transitions,
@@ -32,25 +35,32 @@ class StateMachine:
             name=name,
             ignore_invalid_triggers=ignore_invalid_triggers,
             auto_transitions=auto_transitions,
+            finalize_event="_on_event_finished",
         )
 
-        self.hardware: Optional[HardwareManager] = (
-            None if test_mode else HardwareManager(hardware_config_path)
-        )
+        # Set whenever a trigger was processed, i.e. the current action is done
+        self.step_finished = threading.Event()
+        # Optional device readiness signals used to pace the run loop
+        self.ready_signals: Dict[str, threading.Event] = {}
+
+        # Any object with the interface of `HardwareManager`, e.g. the
+        # `SimulatedHardware` of the discrete-event simulator
+        if hardware is None and not test_mode:
+            hardware = HardwareManager(hardware_config_path)
+        self.hardware: Optional[HardwareManager] = hardware
         self.sample_config = self._load_sample_config(sample_config_path)
         self.sample_id = 0
         self.feedback = None
+        # Syringe loads of the run, planned by `prepare_pump`
+        self.reagent_plan = None
+        self._refills = {}  # pump -> futures of its running refills
 
         self.num_bottles = num_bottles
         self.current_num_bottles = num_bottles
         self.running = True
 
-    @property
-    def is_bottle_on_tray(self) -> bool:
-        return self.current_num_bottles > 0
-
-    def _load_sample_config(self, sample_config_path):
-        HardwareFactory._load_config(sample_config_path, loader=json.load)
+        if compiled:
+            self.machine.bind_actions(self._resolve_action)
 
     def initialize(self):
         if self.hardware:
@@ -58,97 +68,145 @@ class StateMachine:
 
         self.trigger("initialize_finished")
 
+    def _state_action(self):
+        """Return the callable that executes the current state."""
+        if isinstance(self.machine, CompiledMachine):
+            return self.machine.action()
+        return self._resolve_action(self.state)
+
+    def _resolve_action(self, state: str):
+        """Return the callable that executes a state."""
+        return getattr(self, state, lambda: None)
+
+    def _on_event_finished(self, *args, **kwargs):
+        self.step_finished.set()
+
+    def add_ready_signal(self, name: str, signal: threading.Event):
+        """
+        Pace the run loop by a device readiness signal.
+
+        The next state is only started once all registered signals are set,
+        e.g. an event the UI or a device monitor sets when a device is idle.
+        """
+        self.ready_signals[name] = signal
+
+    def remove_ready_signal(self, name: str):
+        self.ready_signals.pop(name, None)
+
+    def wait_until_ready(self):
+        """Block until all readiness signals are set or the run is stopped."""
+        for signal in list(self.ready_signals.values()):
+            while self.running and not signal.wait(timeout=0.1):
+                pass
+
     def auto_run(self):
+        """
+        Run the machine until it is stopped.
+
+        Each state is started as soon as the previous action fired its
+        completion event, there is no idle time between two states.
+        """
         while self.running:
-            action = getattr(self, self.state, lambda: None)
+            self.wait_until_ready()
+            if not self.running:
+                break
+
+            self.step_finished.clear()
+            action = self._state_action()
             action()
-            time.sleep(1)
+            # Re-check `running` while waiting, a `stop` between `clear` and
+            # the trigger of the action would be lost otherwise
+            while self.running and not self.step_finished.wait(timeout=0.1):
+                pass
 
     def stop(self):
         """Gracefully stop the auto-run loop."""
         self.running = False
+        self.step_finished.set()
 
     def prepare_pump(self):
-        """Prepare the pumps before experiemnt (e.g., charging)."""
-
-        # Refill all the pumps in the config files (Maybe NOT ALL)
-        pump_config = self.hardware.hw_config["Pumps"]
-
-        # Calculate the required volume for each pump
-        samples = self.sample_config["samples"]
-        pump_volume = {}
-        for sample in samples.values():
-            total_proportion = sum(sample["proportion"])
-            for prop, pump_id in zip(sample["proportion"], sample["pumps"]):
-                ratio = prop / total_proportion
-                if pump_id in pump_volume:
-                    pump_volume[pump_id] += ratio * sample["volume"]
-                else:
-                    pump_volume[pump_id] = ratio * sample["volume"]
-
-        with ThreadPoolExecutor() as executor:
-            futures = []
-            for pump_id, config in pump_config.items():
-                flow = config["flow"]
-                volume = pump_volume[pump_id]
-
-                futures.append(
-                    executor.submit(
-                        self.hardware.execute_command,
-                        "Pumps",
-                        {"action": "aspirate", "volume": volume, "flow": flow},
-                        pump_id,
-                    )
-                )
-
-            # Wait for all tasks to complete
+        """
+        Prepare the pumps before experiemnt (e.g., charging).
+
+        Every pump aspirates its first syringe load, the remaining loads are
+        refilled while the run goes on, see `logic.reagent_planner`.
+        """
+
+        commands = self._plan_pumps()
+        if self.refill_service is not None:
+            # The service owns the syringes, it fills them for the first loads
+            futures = self._service_refills(
+                {pump_id: command["volume"] for pump_id, command in commands.items()}
+            )
+            for future in futures:
+                future.result()
+        else:
+            self.aspirate_together(list(commands.items()))
+
+    def aspirate_together(self, commands: list):
+        """
+        Aspirate on several pumps in parallel.
+
+        The valves of all pumps are switched to aspirate in one batch before
+        and closed in one batch after, see `HardwareManager.switch_valves`.
+
+        Args:
+            commands (list): [(pump_id, aspirate command)].
+        """
+
+        pump_ids = [pump_id for pump_id, _ in commands]
+        if not pump_ids:
+            return
+        self.hardware.switch_valves(self._valve_positions(pump_ids, 1))
+        try:
+            # Every pump has its own lane, so all pumps aspirate in parallel
+            futures = [
+                self.hardware.submit_command("Pumps", self._batched(command), pump_id)
+                for pump_id, command in commands
+            ]
             for future in futures:
                 future.result()
+        finally:
+            self.hardware.switch_valves(self._valve_positions(pump_ids, 0))
+
+    def start_refills(self, stage: int = None, sample: int = None):
+        """
+        Queue the planned refills due at a stage or before a sample.
+
+        The refill runs on the lane of its pump, ahead of the next dispense
+        of that pump, without blocking the caller.
+        """
+
+        for pump_id, command in self._due_refills(stage=stage, sample=sample):
+            future = self.hardware.submit_command("Pumps", command, pump_id)
+            self._refills.setdefault(pump_id, []).append(future)
 
     def fill_bottle(self):
         """
         Fill the bottle by dispensing from multiple pumps in parallel.
-        Uses multi-threading for parallel execution.
+        The pumps start together, see `HardwareManager.dispense_group`.
         """
 
-        # Load sample data
-        num_samples = self.sample_config["num_samples"]
-        out_flow = self.sample_config["out_flow"]
-        self.sample_id += 1
-
-        if self.sample_id > num_samples:
-            raise ValueError("Sample ID is out of range!")
-
-        sample_info = self.sample_config["samples"][str(self.sample_id)]
-        volume = sample_info["volume"]
-        proportion = sample_info["proportion"]
-        solution = sample_info["solution"]
-        pumps = sample_info["pumps"]
-
-        # Calculate total proportion for normalization
-        total_proportion = sum(proportion)
-
-        # Parallelly dispensing with multi-threading
-        with ThreadPoolExecutor() as executor:
-            futures = []
-            for i, pump_id in enumerate(pumps):
-                ratio = proportion[i] / total_proportion
-                sub_flow = out_flow * ratio
-                sub_volume = volume * ratio
-
-                futures.append(
-                    executor.submit(
-                        self.hardware.execute_command,
-                        "Pumps",
-                        {"action": "dispense", "volume": sub_volume, "flow": sub_flow},
-                        pump_id,
-                    )
-                )
-
-            # Wait for all tasks to complete
-            for future in futures:
+        commands = self._sample_commands()
+
+        # Refills not started in an idle stage before are taken together now
+        self.aspirate_together(self._due_refills(sample=self.sample_id))
+        for pump_id in commands:
+            for future in self._refills.pop(pump_id, []):
                 future.result()
 
+        # A syringe the refill service did not top up in time is refilled now
+        if self.refill_service is not None:
+            volumes = {
+                pump_id: command["volume"] for pump_id, command in commands.items()
+            }
+            for refill in self._service_refills(volumes):
+                refill.result()
+
+        # Valves are switched before and the pumps started at once, so the
+        # mixing ratio is right from the first drop
+        self.hardware.dispense_group(commands)
+
     def measure_DLS(self, setup_id: int, num_of_measure: int, save_path: str):
         """
         Measures DLS (Dynamic Light Scattering) data using the specified setup.
@@ -162,60 +220,28 @@ class StateMachine:
             str or False: Arduino feedback message if available.
         """
 
-        # Step 1: Dip in the probe tip
-        fb = self.hardware.execute_command("Arduino", {"action": "cylinder2 retract"})
-        if fb != "Cylinder2 Retraction Finished":
-            raise RequestFailed(
-                "Cylinder_dls dip in request failed. Measurement cannot proceed."
-            )
-
-        # Step 2: Select the DLS measurement setup
-        self.hardware.execute_command(
-            "DLS", {"action": "select_measurement_setup", "id": setup_id}
+        return self._run_steps(
+            self._measure_DLS_steps(setup_id, num_of_measure, save_path)
         )
 
-        # Step 3: Run the measurement and request data
-        if self.hardware.execute_command(
-            "DLS",
-            {
-                "action": "request_data",
-                "num_of_runs": num_of_measure,
-                "save_path": save_path,
-            },
-        ):
-            # Retract the rod only if the measurement was successful
-            return self.hardware.execute_command(
-                "Arduino", {"action": "cylinder2 extend"}
-            )
+    def measure_UV(self, mode: str, save_path: str):
+        return self._run_steps(self._measure_UV_steps(mode, save_path))
 
-        return False
+    def rotate_table_p(self):
+        """Rotate the pump turntable to the next slot."""
 
-    def measure_UV(self, mode: str, save_path: str):
-        # Step 1: Dark measurement (shutter closes)
-        self.hardware.execute_command(
-            "UV_Vis", {"action": "switch_shutter", "switch": True}
-        )
-        time.sleep(0.1)
-        self.dark = self.hardware.execute_command("UV_Vis", {"action": "measure"})
+        return self._run_steps(self._rotate_steps("pump"))
 
-        # Step 2: Reference measurement (shutter opens)
-        self.hardware.execute_command(
-            "UV_Vis", {"action": "switch_shutter", "switch": False}
-        )
-        time.sleep(0.1)
-        self.refernce = self.hardware.execute_command("UV_Vis", {"action": "measure"})
-
-        # Step 3: Dip the measure rod in the sample
-        fb = self.hardware.execute_command("Arduino", {"action": "cylinder1 retract"})
-        if fb != "Cylinder1 Retraction Finished":
-            raise RequestFailed(
-                "Cylinder_uvvis dip in request failed. Measurement cannot proceed."
-            )
+    def rotate_table_m(self):
+        """Rotate the measurement turntable to the next slot."""
+
+        return self._run_steps(self._rotate_steps("measure"))
 
-        # Step 4: Sample measurement
-        self.sample = self.hardware.execute_command("UV_Vis", {"action": "measure"})
+    def tray_to_pump(self):
+        self._run_steps(self._move_bottle_steps("tray", "pump"))
 
-        # Step 5: Plot and save data
+    def pump_to_measure(self):
+        self._run_steps(self._move_bottle_steps("pump", "measure"))
 
-        # Step 5: Retract the probe rod
-        return self.hardware.execute_command("Arduino", {"action": "cylinder1 extend"})
+    def measure_to_tray(self):
+        self._run_steps(self._move_bottle_steps("measure", "tray"))
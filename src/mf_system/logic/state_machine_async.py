@@ -0,0 +1,236 @@
+import asyncio
+from typing import Dict, List, Optional
+
+from transitions.extensions.asyncio import AsyncMachine
+
+from mf_system.hardware.hardware import HardwareManager
+from mf_system.logic.state_machine_steps import StateMachineSteps
+
+
+class AsyncStateMachine(StateMachineSteps):
+    """
+    Asyncio variant of `StateMachine`.
+
+    All state actions are coroutines running on one event loop. Parallel
+    device commands (e.g. several pumps dispensing into one bottle) are
+    awaited together with `asyncio.gather` instead of spawning a thread pool
+    per state, and adapters without a native asyncio implementation are run
+    in a worker thread by `IHardwareAdapter.execute_async`.
+    """
+
+    def __init__(
+        self,
+        states: List[str],
+        transitions: List[dict],
+        name: str,
+        num_bottles: int,
+        hardware_config_path: str,
+        sample_config_path: str,
+        test_mode: bool = False,
+        initial: str = "initialize",
+        ignore_invalid_triggers: bool = True,
+        auto_transitions: bool = False,
+        hardware=None,
+    ):
+        self.machine = AsyncMachine(
+            model=self,
+            states=states,
+            transitions=transitions,
+            initial=initial,
+            name=name,
+            ignore_invalid_triggers=ignore_invalid_triggers,
+            auto_transitions=auto_transitions,
+        )
+
+        # Optional device readiness signals used to pace the run loop
+        self.ready_signals: Dict[str, asyncio.Event] = {}
+        self._stopped: Optional[asyncio.Event] = None
+
+        # Any object with the interface of `HardwareManager`, e.g. the
+        # `SimulatedHardware` of the discrete-event simulator
+        if hardware is None and not test_mode:
+            hardware = HardwareManager(hardware_config_path)
+        self.hardware: Optional[HardwareManager] = hardware
+        self.sample_config = self._load_sample_config(sample_config_path)
+        self.sample_id = 0
+        self.feedback = None
+        # Syringe loads of the run, planned by `prepare_pump`
+        self.reagent_plan = None
+        self._refills = {}  # pump -> tasks of its running refills
+
+        self.num_bottles = num_bottles
+        self.current_num_bottles = num_bottles
+        self.running = True
+
+    async def initialize(self):
+        if self.hardware:
+            await asyncio.to_thread(self.hardware.initialize_all)
+
+        await self.trigger("initialize_finished")
+
+    def _state_action(self):
+        """Return the coroutine function that executes the current state."""
+        return self._resolve_action(self.state)
+
+    def _resolve_action(self, state: str):
+        return getattr(self, state, self._idle)
+
+    @staticmethod
+    async def _idle():
+        pass
+
+    def add_ready_signal(self, name: str, signal: asyncio.Event):
+        """
+        Pace the run loop by a device readiness signal.
+
+        The next state is only started once all registered signals are set.
+        """
+        self.ready_signals[name] = signal
+
+    def remove_ready_signal(self, name: str):
+        self.ready_signals.pop(name, None)
+
+    async def wait_until_ready(self):
+        """Wait until all readiness signals are set or the run is stopped."""
+        for signal in list(self.ready_signals.values()):
+            stopped = asyncio.ensure_future(self._stopped.wait())
+            ready = asyncio.ensure_future(signal.wait())
+            await asyncio.wait({stopped, ready}, return_when=asyncio.FIRST_COMPLETED)
+            stopped.cancel()
+            ready.cancel()
+            if not self.running:
+                return
+
+    async def auto_run(self):
+        """
+        Run the machine until it is stopped.
+
+        Every state action is awaited and triggers the next state itself, so
+        the next state starts as soon as the previous one finished.
+        """
+        self._stopped = asyncio.Event()
+        if not self.running:
+            self._stopped.set()
+
+        while self.running:
+            await self.wait_until_ready()
+            if not self.running:
+                break
+
+            await self._state_action()()
+
+    def stop(self):
+        """Gracefully stop the auto-run loop."""
+        self.running = False
+        if self._stopped is not None:
+            self._stopped.set()
+
+    async def prepare_pump(self):
+        """
+        Prepare the pumps before experiemnt (e.g., charging).
+
+        Every pump aspirates its first syringe load, the remaining loads are
+        refilled while the run goes on, see `logic.reagent_planner`.
+        """
+
+        commands = self._plan_pumps()
+        if self.refill_service is not None:
+            # The service owns the syringes, it fills them for the first loads
+            volumes = {
+                pump_id: command["volume"] for pump_id, command in commands.items()
+            }
+            await asyncio.gather(
+                *(asyncio.wrap_future(f) for f in self._service_refills(volumes))
+            )
+            return
+
+        await self.aspirate_together(list(commands.items()))
+
+    async def aspirate_together(self, commands: list):
+        """Asyncio variant of `StateMachine.aspirate_together`."""
+
+        pump_ids = [pump_id for pump_id, _ in commands]
+        if not pump_ids:
+            return
+        # The valves are switched on the pump lanes, off the event loop
+        await asyncio.to_thread(
+            self.hardware.switch_valves, self._valve_positions(pump_ids, 1)
+        )
+        try:
+            await asyncio.gather(
+                *(
+                    self.hardware.execute_command_async(
+                        "Pumps", self._batched(command), pump_id
+                    )
+                    for pump_id, command in commands
+                )
+            )
+        finally:
+            await asyncio.to_thread(
+                self.hardware.switch_valves, self._valve_positions(pump_ids, 0)
+            )
+
+    def start_refills(self, stage: int = None, sample: int = None):
+        """Start the planned refills due at a stage or before a sample as tasks."""
+
+        for pump_id, command in self._due_refills(stage=stage, sample=sample):
+            task = asyncio.ensure_future(
+                self.hardware.execute_command_async("Pumps", command, pump_id)
+            )
+            self._refills.setdefault(pump_id, []).append(task)
+
+    async def fill_bottle(self):
+        """Fill the bottle by dispensing from multiple pumps concurrently."""
+
+        commands = self._sample_commands()
+
+        # Refills not started in an idle stage before are taken together now
+        await self.aspirate_together(self._due_refills(sample=self.sample_id))
+        for pump_id in commands:
+            for task in self._refills.pop(pump_id, []):
+                await task
+
+        # A syringe the refill service did not top up in time is refilled now
+        if self.refill_service is not None:
+            volumes = {
+                pump_id: command["volume"] for pump_id, command in commands.items()
+            }
+            await asyncio.gather(
+                *(asyncio.wrap_future(f) for f in self._service_refills(volumes))
+            )
+
+        await asyncio.gather(
+            *(
+                self.hardware.execute_command_async("Pumps", command, pump_id)
+                for pump_id, command in commands.items()
+            )
+        )
+
+    async def measure_DLS(self, setup_id: int, num_of_measure: int, save_path: str):
+        """Asyncio variant of `StateMachine.measure_DLS`."""
+
+        return await self._run_steps_async(
+            self._measure_DLS_steps(setup_id, num_of_measure, save_path)
+        )
+
+    async def measure_UV(self, mode: str, save_path: str):
+        return await self._run_steps_async(self._measure_UV_steps(mode, save_path))
+
+    async def rotate_table_p(self):
+        """Rotate the pump turntable to the next slot."""
+
+        return await self._run_steps_async(self._rotate_steps("pump"))
+
+    async def rotate_table_m(self):
+        """Rotate the measurement turntable to the next slot."""
+
+        return await self._run_steps_async(self._rotate_steps("measure"))
+
+    async def tray_to_pump(self):
+        await self._run_steps_async(self._move_bottle_steps("tray", "pump"))
+
+    async def pump_to_measure(self):
+        await self._run_steps_async(self._move_bottle_steps("pump", "measure"))
+
+    async def measure_to_tray(self):
+        await self._run_steps_async(self._move_bottle_steps("measure", "tray"))
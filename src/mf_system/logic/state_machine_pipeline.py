@@ -0,0 +1,522 @@
+import os
+import json
+import math
+import time
+import asyncio
+import threading
+from collections import deque
+from functools import partial
+
+from mf_system.logic.state_machine import StateMachine
+from mf_system.logic.state_machine_async import AsyncStateMachine
+from mf_system.logic.scheduler import PipelineScheduler, Schedule, Stage
+from mf_system.logic.optimizer import DurationModel
+from mf_system.logic.reagent_planner import fill_stages
+from mf_system.logic.utils import (
+    next_use,
+    parallel_action_handle,
+    parallel_action_handle_async,
+)
+
+
+class PipelineMixin:
+    """
+    Load a generated pipeline schedule into a state machine.
+
+    Instead of one hand-written method per stage, the states and transitions
+    are produced by `PipelineScheduler` for the requested number of bottles
+    and every state runs the actions of its stage in parallel.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        num_bottles: int,
+        hardware_config_path: str,
+        sample_config_path: str,
+        test_mode: bool = False,
+        station_graph: dict = None,
+        schedule: Schedule = None,
+        dls_setup_id: int = 1,
+        dls_num_of_measure: int = 3,
+        result_dir: str = ".",
+        duration_log: str = None,
+        degradable_stations: tuple = ("measure_UV", "measure_DLS"),
+        **kwargs,
+    ):
+        # Cell layout, also used to restore the turntables of a resumed run
+        self.station_graph = station_graph
+        states, transitions = self._build_machine(num_bottles, station_graph, schedule)
+        self.dls_setup_id = dls_setup_id
+        self.dls_num_of_measure = dls_num_of_measure
+        self.result_dir = result_dir
+        # Measured action durations, input of the makespan optimizer
+        self.duration_log = duration_log
+        self.action_records = []
+        # Running actions, watched by the `StageWatchdog`
+        self.active_actions = {}
+        # {station: stalled bottle} found by the watchdog, the station is
+        # skipped for the first bottle after the stalled one
+        self.degradable_stations = set(degradable_stations)
+        self.degraded_stations = {}
+        self.skipped_actions = []
+        # Last duration per kind of stage, used by `time_until_dispense`
+        self.stage_times = {}
+        self._stage_started = 0.0
+        self._running_stage = None
+        self._duration_model = None
+
+        super().__init__(
+            states=states,
+            transitions=transitions,
+            name=name,
+            num_bottles=num_bottles,
+            hardware_config_path=hardware_config_path,
+            sample_config_path=sample_config_path,
+            test_mode=test_mode,
+            **kwargs,
+        )
+
+    def _build_machine(self, num_bottles, station_graph, schedule):
+        """Return the states and transitions of the machine."""
+        self.schedule = (
+            schedule
+            or PipelineScheduler(
+                num_bottles=num_bottles, station_graph=station_graph
+            ).generate()
+        )
+        return self.schedule.states, self.schedule.transitions
+
+    def _resolve_action(self, state: str):
+        if state == "initialize":
+            return self.initialize
+        index = int(state.rsplit("_", 1)[1]) - 1
+        return partial(self.run_stage, self.schedule[index])
+
+    def _start_stage(self, stage):
+        # Refills planned for this stage run while their pump idles
+        if self.hardware is not None:
+            self.start_refills(stage=stage.index)
+        self._stage_started = self._clock()
+        self._running_stage = stage.index
+        print(
+            f"{Schedule.state_name(stage.index)} [{stage.phase}]: "
+            + " + ".join(self._describe(a) for a in stage.actions)
+            + f" - cur_bottles: {self.current_num_bottles}"
+        )
+
+    def _finish_stage(self, stage):
+        key = frozenset(a.name for a in stage.actions)
+        self.stage_times[key] = self._clock() - self._stage_started
+        self._running_stage = None
+        if self.schedule is not None and stage.index == len(self.schedule) - 1:
+            print("Experiment Finished!")
+            self.stop()
+
+    def _clock(self) -> float:
+        """Seconds of the hardware clock, virtual time in a simulation."""
+        clock = getattr(self.hardware, "clock", None)
+        return clock() if clock is not None else time.perf_counter()
+
+    def time_until_dispense(self, pump: str):
+        """
+        Estimate the seconds until the pump dispenses next.
+
+        Sums the predicted durations of the stages before the bottle of the
+        next sample using the pump is filled. A stage takes as long as the
+        last stage with the same actions did, or the `DurationModel` default.
+        """
+        sample = next_use(self.sample_config, pump, self.sample_id)
+        if sample is None:
+            return math.inf
+        if self.schedule is None or self.state not in self.schedule.states:
+            return None
+
+        fill_stage = fill_stages(self.schedule).get(sample)
+        if fill_stage is None:
+            return None
+        current = max(0, self.schedule.states.index(self.state) - 1)
+        if fill_stage <= current:
+            return 0.0
+
+        if self._duration_model is None:
+            self._duration_model = DurationModel(sample_config=self.sample_config)
+        remaining = 0.0
+        for stage in self.schedule.stages[current:fill_stage]:
+            key = frozenset(a.name for a in stage.actions)
+            remaining += self.stage_times.get(
+                key, self._duration_model.stage_duration(stage.actions)
+            )
+        if self._running_stage == current:
+            remaining -= self._clock() - self._stage_started
+        return max(0.0, remaining)
+
+    def current_actions(self) -> dict:
+        """{action: seconds running} of the actions of the current stage."""
+        now = time.perf_counter()
+        return {a: now - started for a, started in list(self.active_actions.items())}
+
+    def degrade(self, station: str, bottle: int = None) -> bool:
+        """
+        Skip a stalling station for the bottle after the stalled one.
+
+        Args:
+            station (str): Name of the stalling action.
+            bottle (int, optional): Bottle at the station when it stalled.
+                Without it the next bottle that reaches the station is
+                skipped.
+
+        Returns:
+            bool: False if skipping the station would break the bottle, e.g.
+            a transfer or the filling.
+        """
+        if station not in self.degradable_stations:
+            return False
+        self.degraded_stations[station] = bottle
+        return True
+
+    def _degraded(self, action) -> bool:
+        if action.name not in self.degraded_stations:
+            return False
+        stalled = self.degraded_stations[action.name]
+        return stalled is None or action.bottle is None or action.bottle > stalled
+
+    def _action_call(self, action):
+        """Return the method call of one scheduled action, None in test mode."""
+        if action.name == "tray_to_pump":
+            self.current_num_bottles = max(0, self.current_num_bottles - 1)
+
+        if self._degraded(action):
+            del self.degraded_stations[action.name]
+            self.skipped_actions.append(action)
+            print(f"Degraded: skipped {self._describe(action)}")
+            return None
+
+        # Without hardware (test mode) the schedule is only printed
+        if self.hardware is None:
+            return None
+
+        match action.name:
+            case "measure_DLS":
+                return partial(
+                    self.measure_DLS,
+                    self.dls_setup_id,
+                    self.dls_num_of_measure,
+                    os.path.join(self.result_dir, f"DLS_sample_{action.bottle}.csv"),
+                )
+            case "measure_UV":
+                return partial(
+                    self.measure_UV,
+                    "absorbance",
+                    os.path.join(self.result_dir, f"UV_sample_{action.bottle}.csv"),
+                )
+            case _:
+                return getattr(self, action.name)
+
+    def _start_action(self, action) -> float:
+        started = time.perf_counter()
+        self.active_actions[action] = started
+        return started
+
+    def _record(self, action, started: float):
+        self.active_actions.pop(action, None)
+        record = {
+            "action": action.name,
+            "bottle": action.bottle,
+            "duration": time.perf_counter() - started,
+        }
+        sample = self.sample_config.get("samples", {}).get(str(action.bottle))
+        if action.name == "fill_bottle" and sample:
+            record["volume"] = sample["volume"]
+            record["flow"] = self.sample_config["out_flow"]
+        self.action_records.append(record)
+
+        if self.duration_log:
+            with open(self.duration_log, "a") as file:
+                file.write(json.dumps(record) + "\n")
+
+    @staticmethod
+    def _describe(action) -> str:
+        if action.bottle is None:
+            return action.name
+        return f"{action.name}({action.bottle})"
+
+
+class StateMachinePipeline(PipelineMixin, StateMachine):
+    """State machine that executes a generated pipeline schedule."""
+
+    def run_stage(self, stage):
+        self._start_stage(stage)
+        parallel_action_handle(*[partial(self.run_action, a) for a in stage.actions])
+        self._finish_stage(stage)
+
+        # transition
+        self.trigger("command_finished")
+
+    def run_action(self, action):
+        started = self._start_action(action)
+        call = self._action_call(action)
+        result = call() if call else None
+        self._record(action, started)
+        return result
+
+
+class AsyncStateMachinePipeline(PipelineMixin, AsyncStateMachine):
+    """Asyncio state machine that executes a generated pipeline schedule."""
+
+    async def run_stage(self, stage):
+        self._start_stage(stage)
+        await parallel_action_handle_async(
+            *[partial(self.run_action, a) for a in stage.actions]
+        )
+        self._finish_stage(stage)
+
+        # transition
+        await self.trigger("command_finished")
+
+    async def run_action(self, action):
+        started = self._start_action(action)
+        call = self._action_call(action)
+        result = await call() if call else None
+        self._record(action, started)
+        return result
+
+
+# Streaming mode: the stages are generated while the run goes on, the
+# "stream" state runs one stage per step and loops back to itself
+states_stream = ["initialize", "stream", "refill_tray", "finished"]
+
+transitions_stream = [
+    {"trigger": "initialize_finished", "source": "initialize", "dest": "stream"},
+    {"trigger": "command_finished", "source": "stream", "dest": "stream"},
+    {"trigger": "tray_empty", "source": "stream", "dest": "refill_tray"},
+    {"trigger": "tray_refilled", "source": "refill_tray", "dest": "stream"},
+    {"trigger": "drained", "source": "stream", "dest": "finished"},
+]
+
+
+class StreamingStateMachinePipeline(StateMachinePipeline):
+    """
+    Pipeline that runs a whole campaign as one continuous stream.
+
+    The tray is a queue of samples fed from the sample config. With
+    `auto_refill` the next tray is loaded as soon as the tray runs empty, so
+    the pipeline stays in steady state across tray swaps and only drains
+    once after the last sample. While the machine waits for a refill the
+    bottles already in the cell move on, and the machine blocks in the
+    "refill_tray" state only once they all left. New samples can be added
+    while the run goes on with `refill_tray`.
+
+    Without waits for a refill the stream runs the stages of one pipeline
+    over all samples, the refills of the reagent plan are placed on those.
+
+    Args:
+        tray_capacity (int): Bottles per tray.
+        auto_refill (bool): Load the next tray right away, e.g. if the tray
+            holds all bottles or in simulations. Otherwise wait for
+            `refill_tray` from the operator.
+        open_ended (bool): Keep waiting for new samples after the sample
+            config is used up, until `finish_feed` is called.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        hardware_config_path: str,
+        sample_config_path: str,
+        tray_capacity: int = 5,
+        auto_refill: bool = True,
+        open_ended: bool = False,
+        **kwargs,
+    ):
+        self.tray_capacity = tray_capacity
+        self.auto_refill = auto_refill
+        self.feed_closed = not open_ended
+        self.refill_event = threading.Event()
+        self._feed_lock = threading.Lock()
+
+        super().__init__(
+            name=name,
+            num_bottles=0,
+            hardware_config_path=hardware_config_path,
+            sample_config_path=sample_config_path,
+            **kwargs,
+        )
+
+        # Bottles are numbered like the samples they are filled with
+        self.pending = deque(sorted(int(i) for i in self.sample_config["samples"]))
+        self.num_bottles = len(self.pending)
+        # Samples beyond are added by `refill_tray` and journaled
+        self._config_samples = self.num_bottles
+        self.stream = self.scheduler.new_state()
+        self.stream.tray = []
+        self.stage_count = 0
+        self._load_tray()
+
+    def _build_machine(self, num_bottles, station_graph, schedule):
+        self.scheduler = PipelineScheduler(
+            num_bottles=max(num_bottles, 1), station_graph=station_graph
+        )
+        self.schedule = None
+        return states_stream, transitions_stream
+
+    def _resolve_action(self, state: str):
+        return {
+            "initialize": self.initialize,
+            "stream": self.run_stream_stage,
+            "refill_tray": self.wait_for_refill,
+        }.get(state, self.stop)
+
+    def _load_tray(self):
+        with self._feed_lock:
+            while self.pending and len(self.stream.tray) < self.tray_capacity:
+                self.stream.tray.append(self.pending.popleft())
+            self.current_num_bottles = len(self.stream.tray)
+
+    def _feed_open(self) -> bool:
+        return bool(self.pending) or not self.feed_closed
+
+    def _take_refill(self):
+        """Load the next tray if it is there, without waiting for it."""
+        if self.refill_event.is_set():
+            self.refill_event.clear()
+        elif not self.auto_refill:
+            return
+        self._load_tray()
+
+    def _phase(self) -> str:
+        if not self.stream.finished:
+            return "fill_up"
+        if self.stream.tray or self._feed_open():
+            return "steady"
+        return "drain"
+
+    def _plan_pumps(self, schedule=None) -> dict:
+        # An uninterrupted stream runs the stages of one pipeline
+        return super()._plan_pumps(
+            schedule
+            or PipelineScheduler(
+                num_bottles=max(self.num_bottles, 1),
+                station_graph=self.scheduler.graph,
+            ).generate()
+        )
+
+    def run_stream_stage(self):
+        if not self.stream.tray and self._feed_open():
+            self._take_refill()
+            if not self.stream.tray and not self.stream.progress:
+                # The cell is empty, nothing to do until the refill
+                self.trigger("tray_empty")
+                return
+
+        if self.stream.is_done():
+            print("Experiment Finished!")
+            self.stop()
+            self.trigger("drained")
+            return
+
+        actions = self.scheduler.candidates(self.stream)[0]
+        stage = Stage(self.stage_count, self._phase(), actions)
+        self.scheduler.apply(self.stream, actions)
+        self.stage_count += 1
+        self.run_stage(stage)
+
+    def wait_for_refill(self):
+        print("Tray is empty, waiting for refill...")
+        while self.running and not self.refill_event.wait(timeout=0.1):
+            pass
+        if not self.running:
+            return
+        self.refill_event.clear()
+
+        self._load_tray()
+        self.trigger("tray_refilled")
+
+    def snapshot(self) -> dict:
+        """
+        The stream as JSON, journaled with every state change.
+
+        Returns:
+            dict: The `PipelineState` of the stream (tray, slots, progress,
+            finished, rotating), the queued sample ids, the stage count and
+            the samples added by `refill_tray`.
+        """
+        with self._feed_lock:
+            return {
+                "tray": list(self.stream.tray),
+                "slots": {n: list(s) for n, s in self.stream.slots.items()},
+                "progress": sorted(self.stream.progress.items()),
+                "finished": list(self.stream.finished),
+                "rotating": self.stream.rotating,
+                "pending": list(self.pending),
+                "stage_count": self.stage_count,
+                "samples": {
+                    i: sample
+                    for i, sample in self.sample_config["samples"].items()
+                    if int(i) > self._config_samples
+                },
+            }
+
+    def restore(self, snapshot: dict):
+        """Continue the stream from a `snapshot`, e.g. of a run journal."""
+        with self._feed_lock:
+            samples = self.sample_config["samples"]
+            samples.update(snapshot["samples"])
+            self.sample_config["num_samples"] = max(
+                [self.sample_config["num_samples"]] + [int(i) for i in samples]
+            )
+            self.num_bottles = self._config_samples + len(snapshot["samples"])
+            self.pending = deque(snapshot["pending"])
+            self.stream.tray = list(snapshot["tray"])
+            self.stream.slots = {n: list(s) for n, s in snapshot["slots"].items()}
+            self.stream.progress = dict(snapshot["progress"])
+            self.stream.finished = list(snapshot["finished"])
+            self.stream.rotating = snapshot["rotating"]
+            self.stage_count = snapshot["stage_count"]
+            self.current_num_bottles = len(self.stream.tray)
+
+    def refill_tray(self, samples: list = None):
+        """
+        Signal that the tray was swapped.
+
+        Args:
+            samples (list[dict], optional): New samples in the format of the
+                sample config, appended to the queue of the campaign.
+        """
+        with self._feed_lock:
+            for sample in samples or []:
+                sample_id = len(self.sample_config["samples"]) + 1
+                self.sample_config["samples"][str(sample_id)] = sample
+                self.sample_config["num_samples"] = max(
+                    self.sample_config["num_samples"], sample_id
+                )
+                self.pending.append(sample_id)
+                self.num_bottles += 1
+        self.refill_event.set()
+
+    def finish_feed(self):
+        """No more samples will come, drain the pipeline once the queue is empty."""
+        self.feed_closed = True
+        self.refill_event.set()
+
+
+if __name__ == "__main__":
+    sm = StateMachinePipeline(
+        name="State Machine Pipeline",
+        num_bottles=5,
+        test_mode=True,
+        hardware_config_path="src/mf_system/database/hardware_config.yaml",
+        sample_config_path="src/mf_system/database/sample_config.json",
+    )
+
+    sm.auto_run()
+
+    sm_async = AsyncStateMachinePipeline(
+        name="Async State Machine Pipeline",
+        num_bottles=5,
+        test_mode=True,
+        hardware_config_path="src/mf_system/database/hardware_config.yaml",
+        sample_config_path="src/mf_system/database/sample_config.json",
+    )
+
+    asyncio.run(sm_async.auto_run())
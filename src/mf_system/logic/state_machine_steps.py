@@ -0,0 +1,234 @@
+import json
+import math
+
+from mf_system.hardware.hardware import HardwareFactory
+from mf_system.hardware.devices.utils import RequestFailed
+from mf_system.logic.optimizer import DurationModel
+from mf_system.logic.reagent_planner import plan_reagents
+from mf_system.logic.utils import next_use, split_sample
+
+# Turntables: arduino command, expected feedback, error message
+TABLE_ROTATIONS = {
+    "pump": (
+        "motor1 rotate",
+        "Motor1 Rotation Finished",
+        "Pump table rotation failed.",
+    ),
+    "measure": (
+        "motor2 rotate",
+        "Motor2 Rotation Finished",
+        "Measurement table rotation failed.",
+    ),
+}
+
+
+class StateMachineSteps:
+    """
+    Device steps shared by `StateMachine` and `AsyncStateMachine`.
+
+    Sample handling, reagent planning and the command sequences of the
+    stations live here once. A sequence is a generator that yields
+    `(device, command)` and receives the result of the command, it is run
+    by `_run_steps` (threads) or `_run_steps_async` (asyncio), so the two
+    machines only differ in how they wait for the devices.
+    """
+
+    @property
+    def is_bottle_on_tray(self) -> bool:
+        return self.current_num_bottles > 0
+
+    def _load_sample_config(self, sample_config_path):
+        return HardwareFactory._load_config(sample_config_path, loader=json.load)
+
+    def _run_steps(self, steps):
+        """Execute the commands of a step sequence one after another."""
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(self.hardware.execute_command(*request))
+        except StopIteration as stop:
+            return stop.value
+
+    async def _run_steps_async(self, steps):
+        """Asyncio variant of `_run_steps`."""
+        try:
+            request = next(steps)
+            while True:
+                result = await self.hardware.execute_command_async(*request)
+                request = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+    @staticmethod
+    def _expect(feedback, expected: str, message: str):
+        if feedback != expected:
+            raise RequestFailed(message)
+        return feedback
+
+    def _plan_pumps(self, schedule=None) -> dict:
+        """
+        Plan the syringe loads of the run.
+
+        Args:
+            schedule (Schedule, optional): Pipeline schedule the refills are
+                placed in, the `schedule` of the machine by default.
+
+        Returns:
+            dict: {pump_id: aspirate command} of the first syringe loads.
+        """
+        pump_config = self.hardware.hw_config["Pumps"]
+        self.reagent_plan = plan_reagents(
+            self.sample_config["samples"],
+            pump_config,
+            schedule=schedule or getattr(self, "schedule", None),
+            durations=DurationModel(sample_config=self.sample_config),
+        )
+        return {
+            pump_id: self._aspirate(pump_id, volume)
+            for pump_id, volume in self.reagent_plan.initial.items()
+        }
+
+    @property
+    def refill_service(self):
+        """
+        The `RefillService` of the hardware, None without one.
+
+        A syringe has a single owner: with a service it fills the syringes
+        and the refills of the reagent plan are not taken, else the plan's
+        aspirations do.
+        """
+        return getattr(self.hardware, "refill_service", None)
+
+    def _service_refills(self, volumes: dict) -> list:
+        """Futures of the service refills the syringes need for {pump_id: ml}."""
+        refills = (
+            self.refill_service.ensure(pump_id, volume)
+            for pump_id, volume in volumes.items()
+        )
+        return [refill for refill in refills if refill is not None]
+
+    def _due_refills(self, stage: int = None, sample: int = None) -> list:
+        """[(pump_id, aspirate command)] of the refills due now."""
+        if self.reagent_plan is None or self.refill_service is not None:
+            return []
+        return [
+            (refill.pump, self._aspirate(refill.pump, refill.volume))
+            for refill in self.reagent_plan.take(stage=stage, sample=sample)
+        ]
+
+    def _aspirate(self, pump_id, volume) -> dict:
+        flow = self.hardware.hw_config["Pumps"][pump_id]["flow"]
+        return {"action": "aspirate", "volume": volume, "flow": flow}
+
+    def _valve_positions(self, pump_ids, position: int) -> dict:
+        """
+        {pump_id: position} to switch the valves of several pumps together.
+
+        ContiFlow pumps switch their valves by themselves and are left out.
+        """
+        pumps = self.hardware.hw_config["Pumps"]
+        return {p: position for p in pump_ids if "contiflow" not in pumps[p]}
+
+    @staticmethod
+    def _batched(command: dict) -> dict:
+        """The command without its own valve switches."""
+        return dict(command, valve=False)
+
+    def _sample_commands(self) -> dict:
+        """Advance to the next sample and return its dispense commands."""
+        sample_info = self._next_sample()
+        return split_sample(sample_info, self.sample_config["out_flow"])
+
+    def _next_sample(self) -> dict:
+        """Advance to the next sample of the sample config and return it."""
+        num_samples = self.sample_config["num_samples"]
+        self.sample_id += 1
+
+        if self.sample_id > num_samples:
+            raise ValueError("Sample ID is out of range!")
+
+        return self.sample_config["samples"][str(self.sample_id)]
+
+    def time_until_dispense(self, pump: str):
+        """
+        Seconds until the pump dispenses next, used by the `RefillService`.
+
+        Returns:
+            float or None: inf if no remaining sample needs the pump, None if
+            the machine cannot estimate it.
+        """
+        return None if next_use(self.sample_config, pump, self.sample_id) else math.inf
+
+    def next_dispense_volume(self, pump: str) -> float:
+        """Volume of the next dispense of the pump in ml, 0 if there is none."""
+        sample_id = next_use(self.sample_config, pump, self.sample_id)
+        if sample_id is None:
+            return 0.0
+        sample = self.sample_config["samples"][str(sample_id)]
+        return split_sample(sample, self.sample_config["out_flow"])[pump]["volume"]
+
+    def _measure_DLS_steps(self, setup_id: int, num_of_measure: int, save_path: str):
+        # Step 1: Dip in the probe tip
+        fb = yield "Arduino", {"action": "cylinder2 retract"}
+        self._expect(
+            fb,
+            "Cylinder2 Retraction Finished",
+            "Cylinder_dls dip in request failed. Measurement cannot proceed.",
+        )
+
+        # Step 2: Select the DLS measurement setup
+        yield "DLS", {"action": "select_measurement_setup", "id": setup_id}
+
+        # Step 3: Run the measurement and request data
+        if (
+            yield "DLS",
+            {
+                "action": "request_data",
+                "num_of_runs": num_of_measure,
+                "save_path": save_path,
+            },
+        ):
+            # Retract the rod only if the measurement was successful
+            return (yield "Arduino", {"action": "cylinder2 extend"})
+
+        return False
+
+    def _measure_UV_steps(self, mode: str, save_path: str):
+        # Step 1-2: Dark and reference spectra, reused between the bottles
+        # while they are valid (see `UVvisAdapter.calibrate`)
+        calibration = yield "UV_Vis", {"action": "calibrate"}
+        # A `Calibration`, or its list when replayed from a run journal
+        wavelengths, dark, reference = calibration[:3]
+        self.dark = (wavelengths, dark)
+        self.refernce = (wavelengths, reference)
+
+        # Step 3: Dip the measure rod in the sample
+        fb = yield "Arduino", {"action": "cylinder1 retract"}
+        self._expect(
+            fb,
+            "Cylinder1 Retraction Finished",
+            "Cylinder_uvvis dip in request failed. Measurement cannot proceed.",
+        )
+
+        # Step 4: Sample measurement
+        self.sample = yield "UV_Vis", {"action": "measure"}
+
+        # Step 5: Retract the probe rod
+        return (yield "Arduino", {"action": "cylinder1 extend"})
+
+    def _rotate_steps(self, table: str):
+        command, expected, message = TABLE_ROTATIONS[table]
+        fb = yield "Arduino", {"action": command}
+        return self._expect(fb, expected, message)
+
+    def _move_bottle_steps(self, source: str, target: str):
+        """
+        Move a bottle with the gantry between two load positions.
+
+        The coordinates are taken from the `positions` of the gantry in the
+        hardware config, e.g. `{"tray": [0, 0], "pump": [120, 40], ...}`.
+        """
+        positions = self.hardware.hw_config["Gantry"]["positions"]
+        for position in (source, target):
+            x, y = positions[position]
+            yield "Gantry", {"action": "move", "x": x, "y": y}
@@ -1,14 +1,74 @@
+import asyncio
+import contextvars
 from concurrent.futures import ThreadPoolExecutor
 
+from mf_system.logic.reagent_planner import demand_table
+
+# Shared by all state machines, the workers are reused across stages
+_action_executor = None
+
+
+def _get_action_executor() -> ThreadPoolExecutor:
+    global _action_executor
+    if _action_executor is None:
+        _action_executor = ThreadPoolExecutor(thread_name_prefix="action")
+    return _action_executor
+
 
 def parallel_action_handle(*args):
-    futures = []
-    with ThreadPoolExecutor() as executor:
-        for arg in args:
-            futures.append(executor.submit(arg))
+    """
+    Run the given actions in parallel and wait for all of them.
+
+    An action usually commands several devices, the device commands
+    themselves are serialized by the lanes of `HardwareManager`. Every
+    action runs in a copy of the caller's context, like asyncio tasks.
+    """
+    if len(args) == 1:
+        return [args[0]()]
+
+    executor = _get_action_executor()
+    futures = [executor.submit(contextvars.copy_context().run, arg) for arg in args]
+    return [future.result() for future in futures]
+
+
+async def parallel_action_handle_async(*args):
+    """Run coroutine functions concurrently on the running event loop."""
+    return await asyncio.gather(*(arg() for arg in args))
+
+
+def required_pump_volumes(samples: dict) -> dict:
+    """Sum up the volume each pump has to dispense over all samples."""
+    _, pumps, table = demand_table(samples)
+    return dict(zip(pumps, table.sum(axis=0).tolist()))
+
+
+def next_use(sample_config: dict, pump: str, after: int):
+    """Id of the first sample after `after` dispensed by the pump, or None."""
+    samples = sample_config["samples"]
+    for sample_id in range(after + 1, sample_config["num_samples"] + 1):
+        sample = samples.get(str(sample_id))
+        if sample is not None and pump in sample["pumps"]:
+            return sample_id
+    return None
+
+
+def split_sample(sample_info: dict, out_flow: float) -> dict:
+    """
+    Split one sample into the dispense commands of its pumps.
 
-        for future in futures:
-            future.result()
+    Returns:
+        dict: {pump_id: {"action": "dispense", "volume": ..., "flow": ...}}
+    """
+    total_proportion = sum(sample_info["proportion"])
+    commands = {}
+    for prop, pump_id in zip(sample_info["proportion"], sample_info["pumps"]):
+        ratio = prop / total_proportion
+        commands[pump_id] = {
+            "action": "dispense",
+            "volume": sample_info["volume"] * ratio,
+            "flow": out_flow * ratio,
+        }
+    return commands
 
 
 states = [
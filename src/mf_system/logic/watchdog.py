@@ -0,0 +1,174 @@
+import time
+import threading
+from collections import Counter, namedtuple
+from typing import Dict
+
+# A state that ran longer than its budget
+Overrun = namedtuple("Overrun", ["state", "budget", "elapsed", "station", "bottle"])
+
+# Duration of one finished state
+StageTiming = namedtuple("StageTiming", ["state", "budget", "elapsed"])
+
+
+class StageWatchdog:
+    """
+    Watch the latency budget of every state of a state machine.
+
+    A background thread compares the time spent in the current state with
+    its budget. On an overrun it records which station stalls the pipeline:
+    the longest running action of a pipeline machine, or else the device
+    with the longest running command of the hardware manager. With
+    `degrade=True` a stalling measurement station is skipped for the bottle
+    after the stalled one, so one slow station does not stretch every
+    following cycle.
+
+    Budgets are looked up by state name first (e.g. "cycle_stage_3" of the
+    dispense or measure machine), then by the names of the running actions
+    of a pipeline stage (e.g. "measure_DLS"), the largest one wins.
+
+    Args:
+        budgets (dict): Budget in seconds per state or action name.
+        default_budget (float, optional): Budget of states without an entry,
+            unwatched if None.
+        interval (float): Seconds between two checks.
+        degrade (bool): Skip stalling stations for the bottle after the stalled one.
+    """
+
+    def __init__(
+        self,
+        budgets: Dict[str, float],
+        default_budget: float = None,
+        interval: float = 0.5,
+        degrade: bool = False,
+    ):
+        self.budgets = budgets
+        self.default_budget = default_budget
+        self.interval = interval
+        self.degrade = degrade
+
+        self.overruns = []
+        self.timings = []
+        self.stalls = Counter()  # station -> number of overruns it caused
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._sm = None
+        self._state = None
+        self._started = None
+        self._stage_budget = None
+        self._flagged = False
+
+    def attach(self, state_machine) -> "StageWatchdog":
+        """Watch a state machine, the watchdog thread starts right away."""
+        self._sm = state_machine
+        self._enter(state_machine.state)
+        state_machine.machine.after_state_change.append(self._on_state_change)
+
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="StageWatchdog", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._leave()
+
+    @property
+    def bottleneck(self):
+        """The station that stalled the pipeline most often."""
+        return self.stalls.most_common(1)[0][0] if self.stalls else None
+
+    def _on_state_change(self, *args, **kwargs):
+        with self._lock:
+            self._leave()
+            self._enter(self._sm.state)
+        if not self._sm.running:
+            self._stop.set()
+
+    def _enter(self, state):
+        self._state = state
+        self._started = time.perf_counter()
+        self._stage_budget = None
+        self._flagged = False
+
+    def _leave(self):
+        if self._state is None:
+            return
+        elapsed = time.perf_counter() - self._started
+        # The actions of a finished stage are gone, keep the budget seen last
+        budget = self._stage_budget or self._budget()
+        self.timings.append(StageTiming(self._state, budget, elapsed))
+        if budget is not None and elapsed > budget and not self._flagged:
+            # Finished over budget between two checks
+            self._flag(elapsed, budget)
+        self._state = None
+
+    def _budget(self):
+        if self._state in self.budgets:
+            return self.budgets[self._state]
+        current_actions = getattr(self._sm, "current_actions", None)
+        if current_actions:
+            budgets = [
+                self.budgets[a.name]
+                for a in current_actions()
+                if a.name in self.budgets
+            ]
+            if budgets:
+                return max(budgets)
+        return self.default_budget
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                if self._state is None:
+                    continue
+                elapsed = time.perf_counter() - self._started
+                budget = self._stage_budget = self._budget()
+                if budget is not None and elapsed > budget and not self._flagged:
+                    self._flag(elapsed, budget)
+
+    def _flag(self, elapsed: float, budget: float):
+        self._flagged = True
+        station, bottle = self._stalled_station()
+        overrun = Overrun(self._state, budget, elapsed, station, bottle)
+        self.overruns.append(overrun)
+        if station is not None:
+            self.stalls[station] += 1
+        print(
+            f"Watchdog: {self._state} over budget ({elapsed:.1f} s > {budget:.1f} s), "
+            f"stalled by {station}"
+        )
+
+        degrade = getattr(self._sm, "degrade", None)
+        if self.degrade and station is not None and degrade is not None:
+            if degrade(station, bottle):
+                print(f"Watchdog: {station} skipped for the bottle after {bottle}")
+
+    def _stalled_station(self):
+        """Return (station, bottle) of the action or command stalling the stage."""
+        current_actions = getattr(self._sm, "current_actions", None)
+        if current_actions:
+            running = current_actions()
+            if running:
+                # Actions over their own budget first, then the longest running
+                over = {
+                    a: elapsed - self.budgets[a.name]
+                    for a, elapsed in running.items()
+                    if a.name in self.budgets and elapsed > self.budgets[a.name]
+                }
+                action = max(over or running, key=(over or running).get)
+                return action.name, action.bottle
+
+        active_commands = getattr(self._sm.hardware, "active_commands", None)
+        if active_commands:
+            running = active_commands()
+            if running:
+                return max(running, key=lambda lane: running[lane][1]), None
+        return None, None
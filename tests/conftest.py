@@ -0,0 +1,158 @@
+import json
+
+import pytest
+import yaml
+
+from mf_system.hardware.devices.pump import SyringePumpAdapter
+from mf_system.logic.state_machine_pipeline import StateMachinePipeline
+
+SAMPLE = {
+    "volume": 1,
+    "proportion": [1, 1],
+    "solution": ["s1", "s2"],
+    "pumps": ["pump1", "pump2"],
+    "property": "empty",
+}
+
+
+class FakeValve:
+    """Valve that reaches its target after a given number of reads."""
+
+    def __init__(self, calls, reads=2):
+        self.calls = calls
+        self.reads = reads
+        self.position = 0
+        self.target = 0
+        self.left = 0
+
+    def switch_valve_to_position(self, position):
+        self.calls.append(("switch", position))
+        self.target = position
+        self.left = self.reads
+
+    def actual_valve_position(self):
+        self.calls.append(("read", self.target))
+        if self.left:
+            self.left -= 1
+        else:
+            self.position = self.target
+        return self.position
+
+
+@pytest.fixture
+def make_samples():
+    """make_samples(n, **fields): sample entries "1".."n" of a sample config."""
+
+    def make(n, **fields):
+        return {
+            str(i): {"position": [0, i], **SAMPLE, **fields} for i in range(1, n + 1)
+        }
+
+    return make
+
+
+@pytest.fixture
+def sample_options():
+    """Sample config of a test module, override it to change the defaults."""
+    return {}
+
+
+@pytest.fixture
+def sample_config_path(request, tmp_path, make_samples, sample_options):
+    """
+    Sample config with `num_samples` (6) equal samples at `out_flow` (0.01).
+
+    The remaining options are fields of every sample. They are taken from
+    `sample_options` and from the parameter of an indirect parametrization.
+    """
+    options = {**sample_options, **getattr(request, "param", {})}
+    num_samples = options.pop("num_samples", 6)
+    out_flow = options.pop("out_flow", 0.01)
+    path = tmp_path / "sample_config.json"
+    path.write_text(
+        json.dumps(
+            {
+                "num_samples": num_samples,
+                "out_flow": out_flow,
+                "samples": make_samples(num_samples, **options),
+            }
+        )
+    )
+    return str(path)
+
+
+@pytest.fixture
+def pump_config():
+    """Pumps of the hardware config, override it to write one."""
+    return None
+
+
+@pytest.fixture
+def hardware_config_path(tmp_path, pump_config):
+    path = tmp_path / "hardware_config.yaml"
+    if pump_config is not None:
+        path.write_text(yaml.dump({"Pumps": pump_config}))
+    return str(path)
+
+
+@pytest.fixture
+def make_pipeline(tmp_path, sample_config_path, hardware_config_path):
+    """make_pipeline(hardware=None, cls=StateMachinePipeline, **kwargs)"""
+
+    def make(hardware=None, cls=StateMachinePipeline, **kwargs):
+        with open(sample_config_path) as file:
+            num_samples = json.load(file)["num_samples"]
+        if "num_bottles" not in kwargs and "tray_capacity" not in kwargs:
+            kwargs["num_bottles"] = num_samples
+        if hardware is not None:
+            kwargs.update(hardware=hardware, result_dir=str(tmp_path))
+        return cls(
+            name=kwargs.pop("name", "test pipeline"),
+            hardware_config_path=hardware_config_path,
+            sample_config_path=sample_config_path,
+            **kwargs,
+        )
+
+    return make
+
+
+@pytest.fixture
+def make_pump():
+    """make_pump(name, calls, reads=2, **config): pump with a `FakeValve`."""
+
+    def make(name, calls, reads=2, **config):
+        pump = SyringePumpAdapter(
+            {
+                "name": name,
+                "pressure_limit": 10,
+                "inner_diameter_mm": 14.7,
+                "max_piston_stroke_mm": 60,
+                **config,
+            }
+        )
+        pump.valve = FakeValve(calls, reads)
+        return pump
+
+    return make
+
+
+@pytest.fixture
+def fast_monitor():
+    """Sweep the shared `DosingMonitor` every 5 ms, stopped after the test."""
+    monitor = SyringePumpAdapter.monitor
+    interval, monitor.interval = monitor.interval, 0.005
+    yield monitor
+    monitor.stop()
+    monitor.interval = interval
+
+
+@pytest.fixture
+def route_of():
+    """route_of(schedule, bottle): actions of one bottle in execution order."""
+
+    def route(schedule, bottle):
+        return [
+            a.name for stage in schedule for a in stage.actions if a.bottle == bottle
+        ]
+
+    return route
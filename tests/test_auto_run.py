@@ -0,0 +1,56 @@
+import json
+import threading
+
+import pytest
+
+from mf_system.logic.state_machine_dispense import StateMachineDispense
+from mf_system.logic.utils import states_dispense, transitions_dispense
+
+
+@pytest.fixture
+def machine(tmp_path):
+    sample_config = tmp_path / "sample_config.json"
+    sample_config.write_text(json.dumps({"num_samples": 3, "samples": {}}))
+    return StateMachineDispense(
+        states=states_dispense,
+        transitions=transitions_dispense,
+        name="auto run",
+        num_bottles=3,
+        hardware_config_path=None,
+        sample_config_path=str(sample_config),
+        test_mode=True,
+    )
+
+
+def run_in_thread(machine):
+    thread = threading.Thread(target=machine.auto_run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_auto_run_completes_a_full_cycle(machine):
+    visited = []
+    machine.machine.after_state_change.append(lambda: visited.append(machine.state))
+
+    thread = run_in_thread(machine)
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert not machine.running
+    assert machine.current_num_bottles == 0
+    assert visited.count("before_cycle_stage_1") == 1
+    assert visited[-1] == "after_cycle_stage_2"
+
+
+def test_stop_ends_a_step_without_trigger(machine):
+    started = threading.Event()
+    # The action never fires a trigger, e.g. it was ignored as invalid
+    machine.before_cycle_stage_1 = started.set
+
+    thread = run_in_thread(machine)
+    assert started.wait(timeout=5)
+    # A stop lost between the steps is noticed as well
+    machine.running = False
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
@@ -0,0 +1,78 @@
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+from mf_system.hardware.devices import pump as pump_module
+from mf_system.hardware.devices.pump import BusSession, SyringePumpAdapter
+from mf_system.hardware.hardware import HardwareManager
+
+
+def test_bus_is_opened_once_and_closed_by_the_last_release():
+    session = BusSession("PumpConfig")
+    barrier = threading.Barrier(8)
+
+    def acquire():
+        barrier.wait()
+        session.acquire()
+
+    with patch.object(pump_module.qmixbus, "Bus") as Bus:
+        threads = [threading.Thread(target=acquire) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        bus = Bus.return_value
+        assert Bus.call_count == 1
+        bus.open.assert_called_once_with("PumpConfig", "")
+        assert session.refs == 8
+
+        for _ in range(7):
+            session.release()
+        bus.close.assert_not_called()
+        session.release()
+        session.release()  # more releases than acquires are ignored
+
+    bus.stop.assert_called_once()
+    bus.close.assert_called_once()
+    assert not session.opened
+
+
+def test_pump_releases_its_session_once():
+    session = MagicMock()
+    with patch.object(SyringePumpAdapter, "bus_session", session):
+        pump = SyringePumpAdapter(
+            {
+                "name": "Nemesys_M_2_Pump",
+                "pressure_limit": 10,
+                "inner_diameter_mm": 14.7,
+                "max_piston_stroke_mm": 60,
+            }
+        )
+        pump.connect()
+        pump.connect()
+        pump.capi_close()
+        pump.capi_close()
+
+    session.acquire.assert_called_once()
+    session.release.assert_called_once()
+
+
+def test_pumps_are_initialized_concurrently(tmp_path):
+    hwm = HardwareManager(str(tmp_path / "hardware_config.yaml"))
+    hwm.adapters["Pumps"] = {f"pump{i}": MagicMock() for i in range(8)}
+    for pump in hwm.adapters["Pumps"].values():
+        pump.initialize.side_effect = lambda: time.sleep(0.2) or True
+    hwm.adapters["Pumps"]["pump3"].initialize.side_effect = ConnectionError
+    hwm.adapters["Arduino"] = MagicMock()
+    hwm.adapters["Arduino"].initialize.return_value = True
+
+    started = time.perf_counter()
+    results = hwm.initialize_all()
+    hwm.executor.shutdown()
+
+    assert time.perf_counter() - started < 0.2 * 4
+    assert list(results) == ["Pumps", "Arduino"]
+    assert results["Arduino"] is True
+    assert results["Pumps"].pop("pump3") is False
+    assert all(results["Pumps"].values())
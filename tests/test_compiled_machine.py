@@ -0,0 +1,107 @@
+import pytest
+from transitions import Machine, MachineError
+
+from mf_system.logic.compiled_machine import CompiledMachine, benchmark
+from mf_system.logic.state_machine_pipeline import StateMachinePipeline
+from mf_system.logic.utils import (
+    states,
+    states_dispense,
+    states_measure,
+    transitions,
+    transitions_dispense,
+    transitions_measure,
+)
+
+
+class Model:
+    def __init__(self, machine_cls, states, transitions, num_bottles):
+        self.current_num_bottles = num_bottles
+        self.finalized = 0
+        self.machine = machine_cls(
+            model=self,
+            states=states,
+            transitions=transitions,
+            initial="initialize",
+            ignore_invalid_triggers=True,
+            auto_transitions=False,
+            finalize_event="on_finished",
+        )
+
+    @property
+    def is_bottle_on_tray(self) -> bool:
+        return self.current_num_bottles > 0
+
+    def on_finished(self, *args, **kwargs):
+        self.finalized += 1
+
+
+def walk(machine_cls, states, transitions, num_bottles):
+    model = Model(machine_cls, states, transitions, num_bottles)
+    model.trigger("initialize_finished")
+    visited = [model.state]
+    for _ in range(60):
+        if model.state == "cycle_stage_1":
+            model.current_num_bottles -= 1
+        model.trigger("command_finished")
+        visited.append(model.state)
+    return visited, model.finalized
+
+
+@pytest.mark.parametrize(
+    "states, transitions",
+    [
+        (states, transitions),
+        (states_dispense, transitions_dispense),
+        (states_measure, transitions_measure),
+    ],
+)
+@pytest.mark.parametrize("num_bottles", [1, 3, 5])
+def test_same_states_as_machine(states, transitions, num_bottles):
+    """Test the compiled table follows the guarded transitions like `Machine`."""
+    assert walk(CompiledMachine, states, transitions, num_bottles) == walk(
+        Machine, states, transitions, num_bottles
+    )
+
+
+def test_invalid_trigger():
+    model = Model(CompiledMachine, states, transitions, 1)
+
+    assert model.trigger("command_finished") is False
+    assert model.trigger("unknown") is False
+    assert model.state == "initialize"
+
+    model.machine.ignore_invalid_triggers = False
+    with pytest.raises(MachineError):
+        model.trigger("command_finished")
+
+
+def test_unsupported_transition_keys():
+    with pytest.raises(ValueError):
+        Model(
+            CompiledMachine,
+            ["initialize", "a"],
+            [{"trigger": "go", "source": "initialize", "dest": "a", "after": "x"}],
+            1,
+        )
+
+
+def test_compiled_pipeline_runs():
+    sm = StateMachinePipeline(
+        name="compiled pipeline",
+        num_bottles=3,
+        test_mode=True,
+        compiled=True,
+        hardware_config_path="src/mf_system/database/hardware_config.yaml",
+        sample_config_path="src/mf_system/database/sample_config.json",
+    )
+    sm.auto_run()
+
+    assert isinstance(sm.machine, CompiledMachine)
+    assert sm.state == sm.schedule.states[-1]
+
+
+def test_benchmark_reports_both_machines():
+    result = benchmark(states, transitions, steps=100)
+
+    assert set(result) == {"Machine", "CompiledMachine"}
+    assert all(us > 0 for us in result.values())
@@ -0,0 +1,160 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from mf_system.hardware.devices import contiflow
+from mf_system.hardware.devices.contiflow import ContiFlowAdapter
+from mf_system.hardware.devices.pump import SyringePumpAdapter
+from mf_system.hardware.devices.pump_lib.qmixsdk.qmixpump import PumpStatus
+from mf_system.hardware.hardware import HardwareFactory, HardwareManager
+from mf_system.hardware.refill import RefillService
+from mf_system.hardware.simulator import SimulatedHardware
+from mf_system.logic.reagent_planner import plan_reagents
+
+SOLVENT = {
+    "name": "Nemesys_M_1_Pump",
+    "contiflow": ["Nemesys_M_1_Pump", "Nemesys_M_2_Pump"],
+    "pressure_limit": 10,
+    "inner_diameter_mm": 8.0,
+    "max_piston_stroke_mm": 60,
+    "flow": 0.05,
+}
+
+PUMPS = {
+    "solvent": SOLVENT,
+    "reagent": {"flow": 0.05, "inner_diameter_mm": 8.0, "max_piston_stroke_mm": 60},
+}
+
+
+@pytest.fixture
+def sdk():
+    """qmixpump with mocked devices and the real property ids."""
+    sdk = MagicMock()
+    sdk.ContiFlowProperty = contiflow.qmixpump.ContiFlowProperty
+    sdk.ContiFlowSwitchingMode = contiflow.qmixpump.ContiFlowSwitchingMode
+    sdk.Pump.side_effect = lambda: MagicMock(is_in_fault_state=lambda: False)
+    pump = sdk.ContiFlowPump.return_value
+    pump.get_device_property.return_value = 1.0
+    pump.is_initializing.side_effect = [True, True, False]
+    pump.is_initialized.return_value = True
+    with (
+        patch.object(contiflow, "qmixpump", sdk),
+        patch.object(SyringePumpAdapter, "bus_session"),
+        patch.object(SyringePumpAdapter, "_open_pressure_channel"),
+    ):
+        yield sdk
+
+
+def test_factory_pairs_the_syringes():
+    reagent = dict(SOLVENT, name="Nemesys_M_3_Pump")
+    del reagent["contiflow"]
+    pumps = HardwareFactory.create_adapter(
+        "Pumps", {"solvent": SOLVENT, "reagent": reagent}
+    )
+
+    assert type(pumps["solvent"]) is ContiFlowAdapter
+    assert type(pumps["reagent"]) is SyringePumpAdapter
+    with pytest.raises(ValueError):
+        ContiFlowAdapter(dict(SOLVENT, contiflow=["Nemesys_M_1_Pump"]))
+
+
+def test_initialize_configures_the_contiflow_pump(sdk):
+    adapter = ContiFlowAdapter(SOLVENT)
+    adapter.initialize()
+
+    pump = sdk.ContiFlowPump.return_value
+    pump.create.assert_called_once_with(*adapter.syringes)
+    assert pump.configure_contiflow_valve.call_count == 2
+    properties = dict(call.args for call in pump.set_device_property.call_args_list)
+    assert properties == {
+        sdk.ContiFlowProperty.SWITCHING_MODE: sdk.ContiFlowSwitchingMode.CROSS_FLOW,
+        sdk.ContiFlowProperty.CROSSFLOW_DURATION_S: 2.0,
+        sdk.ContiFlowProperty.OVERLAP_DURATION_S: 0.0,
+        sdk.ContiFlowProperty.REFILL_FLOW: 0.5,
+    }
+    assert pump.is_initializing.call_count == 3
+
+
+def test_refill_flow_over_the_max(sdk):
+    adapter = ContiFlowAdapter(dict(SOLVENT, refill_flow=2.0))
+
+    with pytest.raises(ValueError):
+        adapter.initialize()
+
+
+def test_dispense_without_valve_cycles(fast_monitor):
+    adapter = ContiFlowAdapter(SOLVENT)
+    adapter.pump = MagicMock()
+    adapter.pump.read_status_snapshot.side_effect = [
+        PumpStatus(pumping, 0.1, 0.0, 1.0) for pumping in [True] * 3 + [False]
+    ]
+    adapter.pressure_channels = [MagicMock(), MagicMock()]
+    for channel, pressure in zip(adapter.pressure_channels, (1.0, 3.0)):
+        channel.read_input.return_value = pressure
+    adapter.telemetry = MagicMock()
+
+    assert adapter.execute({"action": "aspirate", "volume": 1, "flow": 1})
+    assert adapter.execute({"action": "dispense", "volume": 50, "flow": 0.1})
+
+    adapter.pump.dispense.assert_called_once_with(50, 0.1)
+    adapter.pump.aspirate.assert_not_called()
+    # The timeout follows the nominal 500 s of the dosage
+    assert 500 < adapter.dosage_timeout(50, 0.1) < 1000
+    assert adapter.current_pressure == 3.0
+    with pytest.raises(ValueError):
+        adapter.execute({"action": "empty", "flow": 0.1})
+    with pytest.raises(RuntimeError):
+        adapter.switch_valve_to(1)
+
+
+def test_manager_does_not_switch_contiflow_valves(tmp_path, make_pump):
+    hwm = HardwareManager(str(tmp_path / "hardware_config.yaml"))
+    calls = []
+    hwm.adapters["Pumps"] = {
+        "solvent": ContiFlowAdapter(SOLVENT),
+        "reagent": make_pump("Nemesys_M_3_Pump", calls),
+    }
+
+    with pytest.raises(ValueError, match="solvent"):
+        hwm.switch_valves({"solvent": 1, "reagent": 1})
+    hwm.executor.shutdown()
+    assert calls == []
+
+
+@pytest.mark.parametrize("pump_config", [PUMPS])
+@pytest.mark.parametrize(
+    "sample_config_path",
+    [{"volume": 4, "pumps": ["solvent", "reagent"], "out_flow": 0.05}],
+    indirect=True,
+)
+def test_pipeline_never_waits_for_contiflow_refills(
+    hardware_config_path, make_pipeline
+):
+    hardware = SimulatedHardware(hardware_config_path)
+    sm = make_pipeline(hardware)
+
+    plan = plan_reagents(sm.sample_config["samples"], PUMPS)
+    assert len(plan.loads["solvent"]) == 1
+    assert all(refill.pump == "reagent" for refill in plan.refills)
+
+    hardware.attach(sm)
+    hardware.refill_service = service = RefillService(hardware).attach(sm)
+    sm.machine.after_state_change.append(lambda *args, **kwargs: service.check())
+    sm.auto_run()
+
+    assert hardware.underruns == []
+    assert {event.pump for event in service.events} <= {"reagent"}
+    durations = {
+        pump: [
+            r.end - r.start
+            for r in hardware.records
+            if r.device == f"Pumps/{pump}" and r.action == "dispense"
+        ]
+        for pump in PUMPS
+    }
+    # Same volume and flow, but no valve switches
+    valves = 2 * hardware.timing["valve_switch"]
+    assert len(durations["solvent"]) == 6
+    assert durations["solvent"] == pytest.approx(
+        [d - valves for d in durations["reagent"]]
+    )
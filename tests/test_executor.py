@@ -0,0 +1,97 @@
+import time
+import asyncio
+import threading
+from unittest.mock import MagicMock
+
+from mf_system.hardware.executor import DeviceExecutor
+from mf_system.hardware.hardware import HardwareManager
+
+
+def test_same_device_is_serialized():
+    """Test commands of one device never overlap and keep their order."""
+    executor = DeviceExecutor()
+    running = []
+    order = []
+
+    def command(i):
+        running.append(i)
+        assert len(running) == 1
+        time.sleep(0.01)
+        order.append(i)
+        running.remove(i)
+
+    lane = executor.lane("Arduino")
+    futures = [lane.submit(command, i) for i in range(5)]
+    for future in futures:
+        future.result()
+
+    assert order == list(range(5))
+    metrics = executor.metrics()["Arduino"]
+    assert metrics["completed"] == 5
+    assert metrics["max_queue_depth"] == 5
+    assert metrics["queue_depth"] == 0
+    assert metrics["max_wait"] > 0
+    executor.shutdown()
+
+
+def test_different_devices_run_in_parallel():
+    """Test two pumps dispense at the same time."""
+    executor = DeviceExecutor()
+    barrier = threading.Barrier(2, timeout=1)
+
+    futures = [
+        executor.lane("Pumps", name).submit(barrier.wait) for name in ("pump1", "pump2")
+    ]
+    for future in futures:
+        future.result()
+
+    assert set(executor.lanes) == {"Pumps/pump1", "Pumps/pump2"}
+    executor.shutdown()
+
+
+def test_lane_reuses_its_worker():
+    """Test the hot path does not create new threads."""
+    executor = DeviceExecutor()
+    lane = executor.lane("DLS")
+    workers = {lane.run(threading.current_thread) for _ in range(10)}
+
+    assert len(workers) == 1
+    assert lane is executor.lane("DLS")
+    executor.shutdown()
+
+
+def test_failed_command_is_counted():
+    executor = DeviceExecutor()
+    lane = executor.lane("Gantry")
+
+    future = lane.submit(lambda: 1 / 0)
+
+    assert isinstance(future.exception(), ZeroDivisionError)
+    assert lane.metrics()["failed"] == 1
+    executor.shutdown()
+
+
+def test_async_commands_run_on_the_lanes(tmp_path):
+    """Test an awaited command is queued on its lane like a blocking one."""
+    hwm = HardwareManager(str(tmp_path / "hardware_config.yaml"))
+    started, release = threading.Event(), threading.Event()
+    adapter = MagicMock()
+    adapter.execute.side_effect = lambda command: started.set() or release.wait(1)
+    hwm.adapters["DLS"] = adapter
+
+    async def main():
+        task = asyncio.ensure_future(
+            hwm.execute_command_async("DLS", {"action": "request_data"})
+        )
+        await asyncio.to_thread(started.wait, 1)
+        idle = hwm.is_idle("DLS")
+        release.set()
+        return idle, await task
+
+    idle, result = asyncio.run(main())
+
+    assert idle is False
+    assert result is True
+    assert hwm.is_idle("DLS")
+    assert hwm.lane_metrics()["DLS"]["completed"] == 1
+    hwm.shutdown_all()
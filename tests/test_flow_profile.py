@@ -0,0 +1,116 @@
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from mf_system.hardware.devices.flow_profile import FlowProfile, ProfileStreamer
+from mf_system.hardware.devices.pump import SyringePumpAdapter
+from mf_system.hardware.devices.pump_lib.qmixsdk.qmixpump import PumpStatus
+from mf_system.hardware.simulator import SimulatedHardware
+
+
+class FlowPump:
+    """SDK pump whose measured flow follows the last setpoint."""
+
+    def __init__(self):
+        self.flow = 0.0
+        self.setpoints = []
+
+    def generate_flow(self, flow):
+        self.flow = flow
+        self.setpoints.append(flow)
+
+    def stop_pumping(self):
+        self.flow = 0.0
+
+    def read_status_snapshot(self):
+        return PumpStatus(self.flow != 0.0, self.flow, 1.0, 0.0)
+
+
+@pytest.fixture
+def make_profile_pump(make_pump):
+    """make_profile_pump(name, calls, pressure=1.0): pump with a `FlowPump`."""
+
+    def make(name, calls, pressure=1.0):
+        pump = make_pump(name, calls)
+        pump.pump = FlowPump()
+        pump.pressure_channel = MagicMock()
+        pump.pressure_channel.read_input.return_value = pressure
+        pump.telemetry = MagicMock()
+        return pump
+
+    return make
+
+
+def test_profile_volumes():
+    profile = FlowProfile([(2.0, 0.0, 1.0), (1.0, 1.0, 1.0)])
+
+    assert profile.duration == 3.0
+    assert profile.total_volume == pytest.approx(2.0)
+    assert profile.volume(1.0, 2.5) == pytest.approx(0.75 + 0.5)
+    assert profile.flow_at([-1.0, 1.0, 2.5, 4.0]) == pytest.approx([0, 0.5, 1, 0])
+    assert FlowProfile.steps([0.1, 0.2], 5).total_volume == pytest.approx(1.5)
+    assert FlowProfile.ramp(0.0, -0.2, 10).dispenses is False
+    with pytest.raises(ValueError):
+        FlowProfile([(1.0, 0.1, -0.1)])
+    with pytest.raises(ValueError):
+        FlowProfile([(0.0, 0.1, 0.1)])
+
+
+def test_composition_sweep_at_constant_total_flow(make_profile_pump):
+    calls = []
+    solvent = make_profile_pump("Nemesys_M_1_Pump", calls)
+    reagent = make_profile_pump("Nemesys_M_2_Pump", calls)
+    profiles = {
+        solvent: FlowProfile.ramp(0.02, 0.0, 0.3),
+        reagent: FlowProfile.ramp(0.0, 0.02, 0.3),
+    }
+
+    reports = SyringePumpAdapter.run_profiles(profiles, interval=0.01)
+
+    switches = [position for call, position in calls if call == "switch"]
+    assert switches == [2, 2, 0, 0]
+    for pump, report in reports.items():
+        assert not report.aborted
+        assert report.updates > 10
+        assert report.delivered_volume == pytest.approx(report.planned_volume, rel=0.1)
+        assert pump.pump.flow == 0.0
+    # The setpoints of the two pumps add up to the total flow
+    total = np.add(solvent.pump.setpoints[:10], reagent.pump.setpoints[:10])
+    assert total == pytest.approx(0.02)
+
+
+def test_pressure_limit_stops_one_pump(make_profile_pump):
+    calls = []
+    solvent = make_profile_pump("Nemesys_M_1_Pump", calls)
+    reagent = make_profile_pump("Nemesys_M_2_Pump", calls, pressure=11.0)
+    streamer = ProfileStreamer(
+        {
+            solvent: FlowProfile.steps([0.01], 0.1),
+            reagent: FlowProfile.steps([0.01], 0.1),
+        },
+        interval=0.01,
+    )
+
+    streamer.start().join()
+
+    assert streamer.report(reagent).aborted
+    assert reagent.pump.setpoints == []
+    assert not streamer.report(solvent).aborted
+    assert solvent.pump.setpoints[0] == 0.01
+
+
+def test_simulated_profile():
+    hardware = SimulatedHardware()
+    hardware.fill_levels["solvent"] = 1.0
+    segments = [(10.0, 0.0, 0.1), (5.0, 0.1, 0.1)]
+
+    hardware.execute_command(
+        "Pumps", {"action": "profile", "segments": segments}, "solvent"
+    )
+
+    record = hardware.records[-1]
+    valves = 2 * hardware.timing["valve_switch"]
+    assert record.end - record.start == pytest.approx(15.0 + valves)
+    assert hardware.fill_level("solvent") == pytest.approx(0.0)
+    assert hardware.underruns == []
@@ -0,0 +1,108 @@
+from concurrent.futures import Future
+from unittest.mock import MagicMock
+
+import pytest
+
+from mf_system.hardware.devices.pump import SyringePumpAdapter
+from mf_system.hardware.hardware import HardwareManager
+from mf_system.hardware.simulator import SimulatedHardware
+
+PUMPS = {
+    name: {"flow": 0.05, "inner_diameter_mm": 14.7, "max_piston_stroke_mm": 60}
+    for name in ("pump1", "pump2")
+}
+
+
+def done(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+@pytest.fixture
+def make_group(make_pump):
+    """make_group(calls, n=3): started pumps that finish at once."""
+
+    def make(calls, n=3):
+        pumps = [make_pump(f"Nemesys_M_{i}_Pump", calls) for i in range(n)]
+        for pump in pumps:
+            pump.pump = MagicMock()
+            pump.pump.dispense.side_effect = lambda volume, flow, name=pump.pump_name: (
+                calls.append(("dispense", name))
+            )
+            pump.monitor = MagicMock()
+            pump.monitor.watch.side_effect = lambda adapter, timeout: done(True)
+            pump.telemetry = MagicMock()
+        return pumps
+
+    return make
+
+
+def test_valves_are_armed_before_the_pumps_start(make_group):
+    calls = []
+    pumps = make_group(calls)
+    command = {"action": "dispense", "volume": 0.1, "flow": 0.01}
+
+    dosing = SyringePumpAdapter.dose_group({pump: command for pump in pumps})
+
+    dispenses = [i for i, call in enumerate(calls) if call[0] == "dispense"]
+    # The starts follow each other directly, after every valve reached 2
+    assert dispenses == list(range(dispenses[0], dispenses[0] + 3))
+    assert all(pump.valve.position == 0 for pump in pumps)
+    assert calls[: dispenses[0]].count(("switch", 2)) == 3
+    assert dosing.results == {pump: True for pump in pumps}
+    assert 0 <= dosing.start_skew < 0.05
+    assert dosing.start_skew == max(dosing.starts.values()) - min(
+        dosing.starts.values()
+    )
+
+
+def test_failed_start_stops_the_started_pumps(make_group):
+    calls = []
+    pumps = make_group(calls)
+    pumps[2].pump.dispense.side_effect = RuntimeError("bus error")
+    command = {"action": "dispense", "volume": 0.1, "flow": 0.01}
+
+    with pytest.raises(RuntimeError):
+        SyringePumpAdapter.dose_group({pump: command for pump in pumps})
+
+    pumps[0].pump.stop_pumping.assert_called_once()
+    pumps[1].pump.stop_pumping.assert_called_once()
+    assert all(pump.valve.position == 0 for pump in pumps)
+    assert all(pump.telemetry.end.called for pump in pumps)
+
+
+def test_manager_reports_by_pump_name(make_group, tmp_path):
+    hwm = HardwareManager(str(tmp_path / "hardware_config.yaml"))
+    pumps = make_group([], n=2)
+    hwm.adapters["Pumps"] = {"pump1": pumps[0], "pump2": pumps[1]}
+    command = {"action": "dispense", "volume": 0.1, "flow": 0.01}
+
+    dosing = hwm.dispense_group({"pump1": command, "pump2": command})
+    hwm.executor.shutdown()
+
+    assert dosing.results == {"pump1": True, "pump2": True}
+    assert set(dosing.starts) == {"pump1", "pump2"}
+    assert list(hwm.start_skews) == [dosing.start_skew]
+
+
+@pytest.mark.parametrize("pump_config", [PUMPS])
+@pytest.mark.parametrize(
+    "sample_config_path",
+    [{"num_samples": 3, "volume": 2, "proportion": [1, 3], "out_flow": 0.05}],
+    indirect=True,
+)
+def test_simulated_pipeline_starts_the_pumps_together(
+    hardware_config_path, make_pipeline
+):
+    hardware = SimulatedHardware(hardware_config_path)
+    sm = make_pipeline(hardware)
+    hardware.attach(sm)
+    sm.auto_run()
+
+    starts = {}
+    for record in hardware.records:
+        if record.action == "dispense":
+            starts.setdefault(record.device, []).append(record.start)
+    assert starts["Pumps/pump1"] == starts["Pumps/pump2"]
+    assert len(starts["Pumps/pump1"]) == 3
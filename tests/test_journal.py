@@ -0,0 +1,121 @@
+import pytest
+
+from mf_system.hardware.simulator import SimulatedHardware
+from mf_system.logic.journal import RunJournal, resume
+from mf_system.logic.state_machine_pipeline import StreamingStateMachinePipeline
+
+
+class CrashingHardware(SimulatedHardware):
+    """Simulated cell that dies after a given number of dispense commands."""
+
+    def __init__(self, crash_after=None):
+        super().__init__()
+        self.crash_after = crash_after
+        self.dispensed = []
+
+    def _execute(self, device, command, pump_name=None):
+        if command["action"] == "dispense":
+            if len(self.dispensed) == self.crash_after:
+                raise RuntimeError("power cut")
+            self.dispensed.append((pump_name, command["volume"]))
+        return super()._execute(device, command, pump_name)
+
+
+@pytest.fixture
+def sample_options():
+    return {"num_samples": 4, "proportion": [1, 3]}
+
+
+def test_journal_is_append_only_and_tolerates_torn_lines(tmp_path):
+    journal = RunJournal(str(tmp_path / "run.journal"))
+    journal.write(
+        {"type": "state", "state": "stage_1", "sample_id": 0, "current_num_bottles": 4}
+    )
+    journal.close()
+    with open(journal.path, "a") as file:
+        file.write('{"type": "state", "sta')
+
+    point = journal.replay()
+    assert point.state == "stage_1"
+    assert point.current_num_bottles == 4
+
+    # Entries written after the crash are read again
+    journal.write(
+        {"type": "state", "state": "stage_2", "sample_id": 1, "current_num_bottles": 3}
+    )
+    assert journal.replay().state == "stage_2"
+
+
+def test_resume_does_not_dispense_twice(make_pipeline, tmp_path):
+    """Test a run killed in the middle of a fill continues without re-dosing."""
+    path = str(tmp_path / "run.journal")
+
+    # The first pump of the third sample finishes, then the process dies
+    crashing = CrashingHardware(crash_after=5)
+    sm = make_pipeline(crashing)
+    RunJournal(path).attach(sm)
+    with pytest.raises(RuntimeError):
+        sm.auto_run()
+
+    hardware = CrashingHardware()
+    sm = make_pipeline(hardware)
+    point = resume(sm, path)
+
+    assert point.state == sm.state != "initialize"
+    assert point.dosed["pump1"]["dispensed"] == pytest.approx(3 * 0.25)
+    sm.auto_run()
+
+    # Every pump dispensed once per sample over both processes
+    assert len(crashing.dispensed) + len(hardware.dispensed) == 8
+    assert sm.hardware.dosed["pump1"]["dispensed"] == pytest.approx(4 * 0.25)
+    assert sm.hardware.dosed["pump2"]["dispensed"] == pytest.approx(4 * 0.75)
+    assert sm.state == sm.schedule.states[-1]
+
+
+def test_resume_drives_the_cell_back(make_pipeline, tmp_path):
+    """Test the homed turntables and the gantry return to the journaled positions."""
+    path = str(tmp_path / "run.journal")
+    sm = make_pipeline(CrashingHardware(crash_after=5))
+    RunJournal(path).attach(sm)
+    with pytest.raises(RuntimeError):
+        sm.auto_run()
+
+    hardware = CrashingHardware()
+    positions = resume(make_pipeline(hardware), path).positions
+    assert positions["tables"] and positions["gantry"]
+
+    rotations = {"motor1": 2, "motor2": 3}
+    assert [r.action for r in hardware.records] == [
+        f"{motor} rotate"
+        for motor, slots in rotations.items()
+        for _ in range(positions["tables"].get(motor, 0) % slots)
+    ] + ["move"]
+    assert hardware.gantry_position == positions["gantry"]
+
+
+def test_streaming_run_resumes_from_its_snapshot(make_pipeline, tmp_path):
+    path = str(tmp_path / "run.journal")
+    crashing = CrashingHardware(crash_after=5)
+    sm = make_pipeline(crashing, cls=StreamingStateMachinePipeline, tray_capacity=2)
+    RunJournal(path).attach(sm)
+    with pytest.raises(RuntimeError):
+        sm.auto_run()
+
+    hardware = CrashingHardware()
+    sm = make_pipeline(hardware, cls=StreamingStateMachinePipeline, tray_capacity=2)
+    point = resume(sm, path)
+    assert point.state == sm.state == "stream"
+    assert sm.stage_count == point.snapshot["stage_count"] > 0
+    sm.auto_run()
+
+    assert sm.state == "finished"
+    assert sm.sample_id == 4
+    assert len(crashing.dispensed) + len(hardware.dispensed) == 8
+    assert sm.hardware.dosed["pump2"]["dispensed"] == pytest.approx(4 * 0.75)
+
+
+def test_resume_without_journal_starts_fresh(make_pipeline, tmp_path):
+    sm = make_pipeline(SimulatedHardware())
+
+    assert resume(sm, str(tmp_path / "missing.journal")) is None
+    assert sm.state == "initialize"
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from mf_system.logic.optimizer import (
+    DurationModel,
+    MakespanOptimizer,
+    load_duration_log,
+)
+from mf_system.logic.scheduler import Action, PipelineScheduler
+
+SAMPLE_CONFIG = {
+    "num_samples": 2,
+    "out_flow": 0.5,
+    "samples": {
+        "1": {"volume": 10, "proportion": [1], "pumps": ["pump1"]},
+        "2": {"volume": 20, "proportion": [1], "pumps": ["pump1"]},
+    },
+}
+
+
+def test_duration_model_uses_median_of_records():
+    records = [
+        {"action": "measure_DLS", "bottle": 1, "duration": 100.0},
+        {"action": "measure_DLS", "bottle": 2, "duration": 300.0},
+        {"action": "measure_DLS", "bottle": 3, "duration": 110.0},
+    ]
+    model = DurationModel(records)
+
+    assert model.duration(Action("measure_DLS", 4)) == 110.0
+    # Unrecorded actions fall back to the defaults
+    assert model.duration(Action("rotate_table_p", None)) == 3.0
+
+
+def test_fill_time_follows_sample_volume():
+    """Test the fill time is volume / flow plus the recorded overhead."""
+    records = [
+        {
+            "action": "fill_bottle",
+            "bottle": 1,
+            "duration": 12.0,
+            "volume": 5,
+            "flow": 0.5,
+        }
+    ]
+    model = DurationModel(records, sample_config=SAMPLE_CONFIG)
+
+    assert model.duration(Action("fill_bottle", 1)) == pytest.approx(22.0)
+    assert model.duration(Action("fill_bottle", 2)) == pytest.approx(42.0)
+
+
+def test_load_duration_log(tmp_path):
+    path = tmp_path / "durations.jsonl"
+    path.write_text(
+        json.dumps({"action": "measure_UV", "bottle": 1, "duration": 5}) + "\n\n"
+    )
+
+    assert load_duration_log(str(path)) == [
+        {"action": "measure_UV", "bottle": 1, "duration": 5}
+    ]
+
+
+@pytest.mark.parametrize(
+    "defaults",
+    [{}, {"fill_bottle": 200.0}, {"measure_DLS": 300.0, "fill_bottle": 10.0}],
+)
+def test_optimized_schedule_is_valid_and_not_slower(defaults, route_of):
+    scheduler = PipelineScheduler(num_bottles=6)
+    model = DurationModel(defaults=defaults)
+
+    greedy = scheduler.generate()
+    best = MakespanOptimizer(scheduler, model).optimize()
+
+    assert model.makespan(best) <= model.makespan(greedy)
+    for bottle in range(1, 7):
+        assert route_of(best, bottle) == scheduler.route
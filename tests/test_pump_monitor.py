@@ -0,0 +1,107 @@
+import asyncio
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from mf_system.hardware.devices.pump import DosingMonitor, SyringePumpAdapter
+from mf_system.hardware.devices.pump_lib.qmixsdk.qmixpump import PumpStatus
+from mf_system.hardware.hardware import HardwareManager
+
+CONFIG = {
+    "name": "Nemesys_M_2_Pump",
+    "pressure_limit": 10,
+    "inner_diameter_mm": 14.7,
+    "max_piston_stroke_mm": 60,
+}
+
+
+def mock_adapter(sweeps_pumping, pressure_ok=True):
+    """Adapter whose pump stops after the given number of sweeps."""
+    adapter = MagicMock()
+    adapter._pressure_ok.return_value = pressure_ok
+    # No status snapshot, the monitor polls is_pumping
+    adapter._record_telemetry.return_value = None
+    adapter.pump.is_pumping.side_effect = [True] * sweeps_pumping + [False]
+    return adapter
+
+
+@pytest.fixture
+def monitor():
+    monitor = DosingMonitor(interval=0.005)
+    yield monitor
+    monitor.stop()
+
+
+def test_one_thread_resolves_all_pumps(monitor):
+    futures = [monitor.watch(mock_adapter(n), 10) for n in range(8)]
+
+    assert [f.result(timeout=5) for f in futures] == [True] * 8
+    names = [t.name for t in threading.enumerate()]
+    assert names.count("DosingMonitor") == 1
+    assert monitor.active() == 0
+    assert 8 <= monitor.sweeps < 8 * 8
+
+
+def test_pressure_limit_and_timeout(monitor):
+    over_pressure = monitor.watch(mock_adapter(100, pressure_ok=False), 10)
+    stuck = monitor.watch(mock_adapter(10_000), 0.05)
+
+    assert over_pressure.result(timeout=5) is False
+    with pytest.raises(TimeoutError):
+        stuck.result(timeout=5)
+
+
+def test_stop_fails_running_dosages():
+    monitor = DosingMonitor(interval=0.005)
+    future = monitor.watch(mock_adapter(10_000), 10)
+    monitor.stop()
+
+    with pytest.raises(RuntimeError):
+        future.result(timeout=5)
+
+
+def test_pump_waits_on_shared_monitor(fast_monitor):
+    pump = SyringePumpAdapter(CONFIG)
+    pump.pump = MagicMock()
+    pump.pump.read_status_snapshot.return_value = PumpStatus(True, 0.0, 0.0, 0.0)
+    pump.pump.is_pumping.side_effect = [True, True, False, True, False]
+    pump.pressure_channel = MagicMock()
+    pump.pressure_channel.read_input.return_value = 1.0
+
+    assert pump.monitor is fast_monitor
+    assert pump.wait_dosage_finished(10) is True
+    assert asyncio.run(pump.wait_dosage_finished_async(10)) is True
+
+
+def test_shutdown_keeps_the_monitor_of_the_other_pumps(monitor):
+    pumps = [
+        SyringePumpAdapter(dict(CONFIG, name=f"Nemesys_M_{i}_Pump")) for i in (1, 2)
+    ]
+    with (
+        patch.object(SyringePumpAdapter, "bus_session"),
+        patch.object(SyringePumpAdapter, "stop_all_pumps"),
+        patch.object(SyringePumpAdapter, "monitor", monitor),
+    ):
+        for pump in pumps:
+            pump.connect()
+        running = monitor.watch(mock_adapter(20), 10)
+
+        pumps[0].shutdown()
+        assert running.result(timeout=5) is True
+        assert monitor.refs == 1
+
+        stuck = monitor.watch(mock_adapter(10_000), 10)
+        pumps[1].shutdown()
+    with pytest.raises(RuntimeError):
+        stuck.result(timeout=5)
+    assert monitor.refs == 0
+
+
+def test_monitor_interval_is_set_for_the_bus(tmp_path, fast_monitor):
+    with pytest.raises(ValueError):
+        SyringePumpAdapter(dict(CONFIG, monitor_interval=0.01))
+
+    hwm = HardwareManager(str(tmp_path / "hardware_config.yaml"), monitor_interval=0.02)
+    hwm.executor.shutdown()
+    assert fast_monitor.interval == 0.02
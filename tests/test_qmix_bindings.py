@@ -0,0 +1,63 @@
+import ctypes
+from unittest.mock import MagicMock, patch
+
+from mf_system.hardware.devices.pump_lib.qmixsdk import qmixanalogio, qmixpump
+
+
+class FakePumpApi:
+    """Pump API writing fixed values into the output buffers."""
+
+    def __init__(self):
+        self.buffers = []
+
+    def _read(self, value):
+        def read(handle, buffer):
+            self.buffers.append(buffer)
+            buffer.value = value
+            return 0
+
+        return read
+
+    def __getattr__(self, name):
+        values = {
+            "LCP_GetFlowIs": 0.25,
+            "LCP_GetDosedVolume": 1.5,
+            "LCP_GetFillLevel": 3.0,
+        }
+        if name == "LCP_IsPumping":
+            return lambda handle: 1
+        return self._read(values[name])
+
+
+def test_prototypes_are_declared_at_load_time():
+    read = qmixpump.pump_api.LCP_GetFillLevel
+    assert read.argtypes == [ctypes.c_longlong, ctypes.POINTER(ctypes.c_double)]
+    assert qmixpump.pump_api.LCP_IsPumping.argtypes == [ctypes.c_longlong]
+    read_input = qmixanalogio.analogio_api.LCAIO_ReadInput
+    assert read_input.argtypes == [ctypes.c_longlong, ctypes.POINTER(ctypes.c_double)]
+
+
+def test_status_reads_own_their_buffers():
+    """Test concurrent reads (lane and dosing monitor) never share a buffer."""
+    api = FakePumpApi()
+    with patch.object(qmixpump, "pump_api", api):
+        pump = qmixpump.Pump(ctypes.c_longlong(1))
+        first = pump.read_status_snapshot()
+        second = pump.read_status_snapshot()
+
+    assert first == second == qmixpump.PumpStatus(True, 0.25, 1.5, 3.0)
+    assert len(api.buffers) == 6
+    assert len({id(buffer) for buffer in api.buffers}) == 6
+
+
+def test_read_input_owns_its_buffer():
+    api = MagicMock()
+    api.LCAIO_ReadInput.return_value = 0
+    with patch.object(qmixanalogio, "analogio_api", api):
+        channel = qmixanalogio.AnalogInChannel(ctypes.c_longlong(1))
+        channel.read_input()
+        channel.read_input()
+
+    (_, first), (_, second) = [call.args for call in api.LCAIO_ReadInput.call_args_list]
+    assert first is not second
+    assert isinstance(first, ctypes.c_double)
@@ -0,0 +1,145 @@
+import numpy as np
+import pytest
+
+from mf_system.hardware.simulator import SimulatedHardware
+from mf_system.logic.reagent_planner import (
+    demand_table,
+    fill_stages,
+    plan_reagents,
+    split_loads,
+    syringe_capacity,
+)
+from mf_system.logic.optimizer import DurationModel
+from mf_system.logic.scheduler import PipelineScheduler
+from mf_system.logic.utils import required_pump_volumes
+
+PUMPS = {
+    "pump1": {"flow": 0.05, "syringe_volume": 2.5},
+    "pump2": {"flow": 0.05, "syringe_volume": 10.0},
+}
+
+
+@pytest.fixture
+def pump_config():
+    return PUMPS
+
+
+@pytest.fixture
+def sample_options():
+    return {"volume": 2, "out_flow": 0.05}
+
+
+def test_demand_table(make_samples):
+    samples = make_samples(3, volume=2)
+    samples["2"] = dict(samples["2"], proportion=[1, 3], volume=4)
+    sample_ids, pumps, table = demand_table(samples)
+
+    assert sample_ids == [1, 2, 3]
+    assert pumps == ["pump1", "pump2"]
+    np.testing.assert_allclose(table, [[1, 1], [1, 3], [1, 1]])
+    assert required_pump_volumes(samples) == {"pump1": 3.0, "pump2": 5.0}
+
+
+def test_loads_fill_the_syringe():
+    loads = split_loads("pump1", [1, 2, 3, 4, 5], np.array([1.0, 1, 0, 1, 1]), 2.5)
+
+    assert [(l.first_sample, l.last_sample, l.volume) for l in loads] == [
+        (1, 2, 2.0),
+        (4, 5, 2.0),
+    ]
+
+
+def test_sample_larger_than_syringe():
+    with pytest.raises(ValueError):
+        split_loads("pump1", [1], np.array([3.0]), 2.5)
+
+
+def test_capacity_from_syringe_geometry():
+    config = {"inner_diameter_mm": 14.70520755382068, "max_piston_stroke_mm": 60}
+    assert syringe_capacity(config) == pytest.approx(10.19, abs=0.01)
+
+
+def test_refills_are_placed_in_idle_stages(make_samples):
+    schedule = PipelineScheduler(num_bottles=6).generate()
+    # 2 ml at 0.5 ml/s fit into the stages between two fills
+    pumps = dict(PUMPS, pump1=dict(PUMPS["pump1"], flow=0.5))
+    plan = plan_reagents(make_samples(6, volume=2), pumps, schedule)
+
+    assert plan.initial == {"pump1": 2.0, "pump2": 6.0}
+    assert [(r.pump, r.before_sample, r.volume) for r in plan.refills] == [
+        ("pump1", 3, 2.0),
+        ("pump1", 5, 2.0),
+    ]
+    fills = fill_stages(schedule)
+    for refill in plan.refills:
+        assert (
+            fills[refill.before_sample - 1] < refill.stage < fills[refill.before_sample]
+        )
+    assert plan.take(stage=0) == []
+    assert plan.take(sample=3) == plan.refills[:1]
+    assert plan.take(sample=3) == []
+
+
+def test_slow_refills_are_taken_before_their_sample(make_samples):
+    schedule = PipelineScheduler(num_bottles=6).generate()
+    # 2 ml at 0.05 ml/s take 42 s, the pump idles 26 s between two fills
+    plan = plan_reagents(make_samples(6, volume=2), PUMPS, schedule)
+    assert [r.stage for r in plan.refills] == [None, None]
+    assert plan.take(stage=len(schedule)) == []
+
+    # Unless the stages in between are predicted to take longer
+    durations = DurationModel(defaults={"rotate_table_m": 20.0})
+    plan = plan_reagents(make_samples(6, volume=2), PUMPS, schedule, durations)
+    assert None not in [r.stage for r in plan.refills]
+
+
+def test_unused_pump_has_no_load():
+    samples = {"1": {"volume": 5, "proportion": [0, 1], "pumps": ["a", "b"]}}
+    pumps = {"a": {"flow": 0.05, "syringe_volume": 10}, "b": PUMPS["pump2"]}
+    plan = plan_reagents(samples, pumps)
+
+    assert plan.loads["a"] == []
+    assert plan.initial == {"b": 5.0}
+
+
+@pytest.mark.parametrize("idle_stages", [True, False])
+def test_pipeline_never_dispenses_more_than_loaded(
+    hardware_config_path, make_pipeline, idle_stages
+):
+    hardware = SimulatedHardware(hardware_config_path)
+    sm = make_pipeline(hardware)
+    hardware.attach(sm)
+    if not idle_stages:
+        sm.schedule, schedule = None, sm.schedule
+    sm.prepare_pump()
+    if not idle_stages:
+        sm.schedule = schedule
+    sm.auto_run()
+
+    level = {}
+    for record in hardware.records:
+        pump = record.device.split("/")[-1]
+        if record.action == "aspirate":
+            level[pump] = level.get(pump, 0) + (2.0 if pump == "pump1" else 6.0)
+        elif record.action == "dispense":
+            level[pump] -= 1.0
+            assert level[pump] >= -1e-9
+    aspirations = [r for r in hardware.records if r.action == "aspirate"]
+    assert len(aspirations) == 2 + 2
+
+
+def test_initial_loads_switch_the_valves_together(hardware_config_path, make_pipeline):
+    hardware = SimulatedHardware(hardware_config_path)
+    sm = make_pipeline(hardware)
+    hardware.attach(sm)
+    sm.prepare_pump()
+
+    switches = [r for r in hardware.records if r.action == "switch_valves"]
+    aspirations = [r for r in hardware.records if r.action == "aspirate"]
+    assert [r.device for r in switches] == ["Pumps/pump1", "Pumps/pump2"] * 2
+    opened, closed = switches[:2], switches[2:]
+    assert opened[0].start == opened[1].start
+    assert closed[0].start == closed[1].start
+    assert all(
+        opened[0].end <= r.start and r.end <= closed[0].start for r in aspirations
+    )
@@ -0,0 +1,107 @@
+import asyncio
+import math
+
+import pytest
+
+from mf_system.hardware.refill import RefillService
+from mf_system.hardware.simulator import SimulatedHardware
+from mf_system.logic.state_machine_pipeline import (
+    AsyncStateMachinePipeline,
+    StateMachinePipeline,
+)
+
+# About 3 ml syringes, a full refill takes 60 s
+PUMPS = {
+    name: {"flow": 0.05, "inner_diameter_mm": 8.0, "max_piston_stroke_mm": 60}
+    for name in ("pump1", "pump2")
+}
+
+
+class FakeMachine:
+    def __init__(self, until):
+        self.until = until
+
+    def time_until_dispense(self, pump):
+        return self.until[pump]
+
+
+@pytest.fixture
+def pump_config():
+    return PUMPS
+
+
+@pytest.fixture
+def sample_options():
+    return {"volume": 2, "out_flow": 0.05}
+
+
+def test_refills_idle_pumps_below_threshold(hardware_config_path):
+    hardware = SimulatedHardware(hardware_config_path)
+    service = RefillService(hardware, threshold=0.5)
+
+    assert service.check() == ["pump1", "pump2"]
+    assert hardware.fill_level("pump1") == pytest.approx(
+        hardware.syringe_volume("pump1")
+    )
+    assert service.check() == []
+
+    hardware.execute_command(
+        "Pumps", {"action": "dispense", "volume": 2.5, "flow": 1}, "pump1"
+    )
+    hardware.execute_command(
+        "Pumps", {"action": "dispense", "volume": 2.5, "flow": 1}, "pump2"
+    )
+    service.attach(FakeMachine({"pump1": 10.0, "pump2": math.inf}))
+
+    # pump1 dispenses before a refill could finish, pump2 is not needed anymore
+    assert service.check() == []
+    assert service.deferred == 1
+    assert service.late == 0
+
+    assert service.ensure("pump1", 0.1) is None
+    assert service.ensure("pump1", 1.0).result() is True
+    assert service.late == 1
+
+
+def test_pipeline_never_dispenses_from_an_empty_syringe(
+    hardware_config_path, make_pipeline
+):
+    hardware = SimulatedHardware(hardware_config_path)
+    sm = make_pipeline(hardware)
+    hardware.attach(sm)
+    hardware.refill_service = service = RefillService(hardware).attach(sm)
+    # Check on every stage instead of the service thread, in virtual time
+    sm.machine.after_state_change.append(lambda *args, **kwargs: service.check())
+    sm.auto_run()
+
+    assert hardware.underruns == []
+    assert len(service.events) >= 4
+    assert service.late == 0
+
+
+@pytest.mark.parametrize("cls", [StateMachinePipeline, AsyncStateMachinePipeline])
+def test_service_is_the_only_owner_of_the_syringes(
+    hardware_config_path, make_pipeline, cls
+):
+    """Test planned loads and service refills never fill a syringe twice."""
+    hardware = SimulatedHardware(hardware_config_path)
+    sm = make_pipeline(hardware, cls)
+    hardware.attach(sm)
+    hardware.refill_service = service = RefillService(hardware).attach(sm)
+    sm.machine.after_state_change.append(lambda *args, **kwargs: service.check())
+
+    async def run():
+        await sm.prepare_pump()
+        await sm.auto_run()
+
+    if cls is AsyncStateMachinePipeline:
+        asyncio.run(run())
+    else:
+        sm.prepare_pump()
+        sm.auto_run()
+
+    assert sm.reagent_plan.refill_count > 0
+    assert hardware.overflows == []
+    assert hardware.underruns == []
+    assert [r for r in hardware.records if r.action == "aspirate"] == []
+    assert {event.pump for event in service.events} == {"pump1", "pump2"}
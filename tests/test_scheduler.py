@@ -0,0 +1,85 @@
+import pytest
+
+from mf_system.logic.scheduler import PipelineScheduler, Schedule
+
+
+@pytest.mark.parametrize("num_bottles", [1, 2, 3, 4, 5, 7, 50])
+def test_every_bottle_follows_the_route(num_bottles, route_of):
+    """Test each bottle passes all stations exactly once and in order."""
+    scheduler = PipelineScheduler(num_bottles=num_bottles)
+    schedule = scheduler.generate()
+
+    for bottle in range(1, num_bottles + 1):
+        assert route_of(schedule, bottle) == scheduler.route
+
+
+def test_route_from_station_graph():
+    """Test the default graph yields tray -> pump -> UV -> DLS -> tray."""
+    assert PipelineScheduler(num_bottles=1).route == [
+        "tray_to_pump",
+        "fill_bottle",
+        "pump_to_measure",
+        "measure_UV",
+        "measure_DLS",
+        "measure_to_tray",
+    ]
+
+
+@pytest.mark.parametrize("num_bottles", [2, 5, 50])
+def test_single_gantry_move_per_stage(num_bottles):
+    """Test the gantry never has to do two transfers at once."""
+    scheduler = PipelineScheduler(num_bottles=num_bottles)
+    for stage in scheduler.generate():
+        transfers = [a for a in stage.actions if a.name in scheduler.transfers]
+        assert len(transfers) <= 1
+
+
+def test_phases():
+    """Test the schedule is split into fill-up, steady state and drain."""
+    schedule = PipelineScheduler(num_bottles=50).generate()
+    phases = [stage.phase for stage in schedule]
+
+    assert phases[0] == "fill_up"
+    assert phases[-1] == "drain"
+    # Phases never interleave
+    assert phases == sorted(phases, key=["fill_up", "steady", "drain"].index)
+
+
+def test_steady_state_runs_at_bottleneck_rate():
+    """Test one bottle leaves the cell every five stages once the pipeline is full."""
+    schedule = PipelineScheduler(num_bottles=50).generate()
+    steady = schedule.phase("steady")
+    exits = [
+        s.index for s in steady if any(a.name == "measure_to_tray" for a in s.actions)
+    ]
+
+    assert {b - a for a, b in zip(exits, exits[1:])} == {5}
+
+    # All stations work in the same stage
+    assert any(
+        {"fill_bottle", "measure_UV", "measure_DLS"} <= {a.name for a in s.actions}
+        for s in steady
+    )
+
+
+def test_merge_rotations_shortens_schedule():
+    """Test rotating both tables together saves one stage per bottle."""
+    separate = PipelineScheduler(num_bottles=50).generate()
+    merged = PipelineScheduler(num_bottles=50, merge_rotations=True).generate()
+
+    assert len(merged) < len(separate)
+
+
+def test_states_and_transitions():
+    """Test the schedule can be loaded into a transitions machine."""
+    schedule = PipelineScheduler(num_bottles=3).generate()
+
+    assert schedule.states[0] == "initialize"
+    assert schedule.states[1:] == [Schedule.state_name(i) for i in range(len(schedule))]
+    assert len(schedule.transitions) == len(schedule)
+    assert schedule.transitions[0]["trigger"] == "initialize_finished"
+
+
+def test_invalid_bottle_count():
+    with pytest.raises(ValueError):
+        PipelineScheduler(num_bottles=0)
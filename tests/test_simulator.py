@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from mf_system.hardware.simulator import SimulatedHardware, simulate
+from mf_system.logic.state_machine_pipeline import (
+    AsyncStateMachinePipeline,
+    StateMachinePipeline,
+)
+
+
+@pytest.fixture
+def make_simulation(make_pipeline):
+    def make(cls):
+        return make_pipeline(SimulatedHardware(timing={"dls_run": 10}), cls)
+
+    return make
+
+
+def test_campaign_in_virtual_time(make_simulation):
+    """Test a full campaign is simulated and the slowest station is found."""
+    sm = make_simulation(StateMachinePipeline)
+    report = simulate(sm, sm.hardware)
+
+    # 1 ml at 0.01 ml/s is the longest action of the cell
+    assert report.bottleneck in ("Pumps/pump1", "Pumps/pump2")
+    assert report.bottles == 6
+    assert report.throughput == pytest.approx(6 / report.makespan * 3600)
+
+    busy = sum(r.end - r.start for r in report.records)
+    # Stations work in parallel, so the campaign is shorter than all work
+    assert report.makespan < busy
+    # But never shorter than the work of the busiest device
+    assert report.makespan >= max(
+        sum(r.end - r.start for r in report.records if r.device == d)
+        for d in report.utilisation
+    )
+
+
+def test_device_never_runs_two_commands(make_simulation):
+    sm = make_simulation(StateMachinePipeline)
+    report = simulate(sm, sm.hardware)
+
+    for device in report.utilisation:
+        records = sorted(
+            (r for r in report.records if r.device == device), key=lambda r: r.start
+        )
+        assert all(a.end <= b.start for a, b in zip(records, records[1:]))
+
+
+def test_async_machine_matches_threaded(make_simulation):
+    sm = make_simulation(StateMachinePipeline)
+    threaded = simulate(sm, sm.hardware)
+
+    sm_async = make_simulation(AsyncStateMachinePipeline)
+    sm_async.hardware.attach(sm_async)
+    asyncio.run(sm_async.auto_run())
+
+    assert sm_async.hardware.report(6).makespan == pytest.approx(threaded.makespan)
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from mf_system.hardware.devices import spectra
+
+WAVELENGTHS = np.linspace(400.0, 500.0, 101)
+
+
+def make_campaign(n=4):
+    """Gaussian absorption bands of growing height on a flat lamp."""
+    dark = np.full(len(WAVELENGTHS), 100.0)
+    reference = np.full(len(WAVELENGTHS), 1100.0)
+    heights = np.arange(1, n + 1) * 0.2
+    band = np.exp(-(((WAVELENGTHS - 450.0) / 5.0) ** 2))
+    absorbance = heights[:, None] * band
+    samples = dark + (reference - dark) * 10**-absorbance
+    return samples, dark, reference, absorbance
+
+
+def test_batch_matches_the_adapter_formulas():
+    samples, dark, reference, expected = make_campaign()
+
+    assert spectra.absorbance(samples, dark, reference) == pytest.approx(expected)
+    transmittance = spectra.transmittance(samples, dark, reference)
+    assert transmittance == pytest.approx(100 * 10**-expected)
+
+
+def test_zero_reference_signal_is_masked():
+    samples, dark, reference, _ = make_campaign()
+    reference[:5] = dark[:5]
+    samples[0, 10] = dark[10]  # no light through the sample
+
+    with np.errstate(all="raise"):
+        absorbance = spectra.absorbance(samples, dark, reference)
+        transmittance = spectra.transmittance(samples, dark, reference)
+
+    assert np.isnan(absorbance[:, :5]).all()
+    assert np.isnan(transmittance[:, :5]).all()
+    assert np.isnan(absorbance[0, 10])
+    assert transmittance[0, 10] == 0.0
+    assert np.isfinite(absorbance[:, 5:10]).all()
+
+
+def test_baseline_correction():
+    _, _, _, absorbance = make_campaign()
+    tilted = absorbance + 0.1 + 0.002 * (WAVELENGTHS - 400.0)
+
+    flat = spectra.baseline_correct(absorbance + 0.1, WAVELENGTHS, [(400, 410)])
+    line = spectra.baseline_correct(tilted, WAVELENGTHS, [(400, 410), (490, 500)])
+
+    assert flat == pytest.approx(absorbance, abs=1e-9)
+    assert line == pytest.approx(absorbance, abs=1e-9)
+    with pytest.raises(ValueError):
+        spectra.baseline_correct(absorbance, WAVELENGTHS, [(600, 700)])
+
+
+def test_feature_table():
+    samples, dark, reference, _ = make_campaign()
+
+    table = spectra.feature_table(
+        samples,
+        dark,
+        reference,
+        WAVELENGTHS,
+        bands={"main": (430, 470)},
+        baseline=[(400, 410)],
+        sample_ids=[11, 12, 13, 14],
+    )
+
+    assert list(table["sample_id"]) == [11, 12, 13, 14]
+    # Area of a Gaussian: height * sigma * sqrt(pi)
+    heights = np.arange(1, 5) * 0.2
+    assert table["main_area"] == pytest.approx(heights * 5 * np.sqrt(np.pi), rel=1e-3)
+    assert table["main_peak"] == pytest.approx(heights)
+    assert table["main_peak_nm"] == pytest.approx([450.0] * 4)
+    assert table["masked"] == pytest.approx([0.0] * 4)
@@ -0,0 +1,60 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from mf_system.hardware.hardware import HardwareManager
+from mf_system.logic.state_machine_pipeline import AsyncStateMachinePipeline
+
+HW_CONFIG = "src/mf_system/database/hardware_config.yaml"
+SAMPLE_CONFIG = "src/mf_system/database/sample_config.json"
+
+
+@pytest.fixture
+def pipeline():
+    return AsyncStateMachinePipeline(
+        name="test async pipeline",
+        num_bottles=4,
+        test_mode=True,
+        hardware_config_path=HW_CONFIG,
+        sample_config_path=SAMPLE_CONFIG,
+    )
+
+
+def test_auto_run_walks_all_stages(pipeline):
+    """Test the async pipeline runs the whole schedule and stops itself."""
+    asyncio.run(pipeline.auto_run())
+
+    assert pipeline.state == pipeline.schedule.states[-1]
+    assert pipeline.current_num_bottles == 0
+    assert not pipeline.running
+
+
+def test_ready_signal_paces_run(pipeline):
+    """Test the run loop waits for a readiness signal."""
+
+    async def run():
+        ready = asyncio.Event()
+        pipeline.add_ready_signal("gantry", ready)
+        task = asyncio.create_task(pipeline.auto_run())
+        await asyncio.sleep(0.05)
+        assert pipeline.state == "initialize"
+
+        ready.set()
+        await asyncio.wait_for(task, timeout=5)
+
+    asyncio.run(run())
+    assert not pipeline.running
+
+
+def test_fill_bottle_dispenses_concurrently(pipeline):
+    """Test all pumps of a sample are commanded in the same gather call."""
+    pipeline.hardware = mock.MagicMock(spec=HardwareManager)
+    pipeline.hardware.execute_command_async = mock.AsyncMock(return_value=True)
+
+    asyncio.run(pipeline.fill_bottle())
+
+    sample = pipeline.sample_config["samples"]["1"]
+    calls = pipeline.hardware.execute_command_async.await_args_list
+    assert [c.args[2] for c in calls] == sample["pumps"]
+    assert sum(c.args[1]["volume"] for c in calls) == pytest.approx(sample["volume"])
@@ -0,0 +1,162 @@
+import threading
+import time
+
+import pytest
+
+from mf_system.hardware.simulator import SimulatedHardware
+from mf_system.logic.journal import RunJournal
+from mf_system.logic.scheduler import PipelineScheduler
+from mf_system.logic.state_machine_pipeline import StreamingStateMachinePipeline
+
+
+@pytest.fixture
+def sample_options():
+    return {"num_samples": 12}
+
+
+@pytest.fixture
+def pump_config():
+    # pump1 holds two samples and refills in an idle stage
+    return {
+        "pump1": {"flow": 0.5, "syringe_volume": 1.0},
+        "pump2": {"flow": 0.5, "syringe_volume": 10.0},
+    }
+
+
+@pytest.fixture
+def make_stream(make_pipeline):
+    def make(**kwargs):
+        return make_pipeline(
+            cls=StreamingStateMachinePipeline,
+            test_mode=True,
+            tray_capacity=5,
+            **kwargs,
+        )
+
+    return make
+
+
+def routes(sm):
+    bottles = {}
+    for record in sm.action_records:
+        if record["bottle"] is not None:
+            bottles.setdefault(record["bottle"], []).append(record["action"])
+    return bottles
+
+
+def test_stream_runs_all_samples_in_one_pipeline(make_stream):
+    """Test tray swaps cost no extra fill-up and drain."""
+    sm = make_stream()
+    sm.auto_run()
+
+    route = PipelineScheduler(num_bottles=1).route
+    assert routes(sm) == {bottle: route for bottle in range(1, 13)}
+    assert sm.state == "finished"
+
+    one_pipeline = len(PipelineScheduler(num_bottles=12).generate())
+    batches = sum(len(PipelineScheduler(num_bottles=n).generate()) for n in (5, 5, 2))
+    assert sm.stage_count == one_pipeline < batches
+
+
+def test_waits_for_operator_refill(make_stream):
+    """Test the bottles in the cell move on while the tray is swapped."""
+    sm = make_stream(auto_refill=False)
+    in_flight = []
+
+    def operator(*args, **kwargs):
+        if sm.state == "refill_tray":
+            in_flight.append(dict(sm.stream.progress))
+            threading.Timer(0.05, sm.refill_tray).start()
+
+    sm.machine.after_state_change.append(operator)
+    sm.auto_run()
+
+    # The operator is slower than the cell, it is empty at both swaps
+    assert in_flight == [{}, {}]
+    batches = sum(len(PipelineScheduler(num_bottles=n).generate()) for n in (5, 5, 2))
+    assert sm.stage_count == batches
+    assert sorted(routes(sm)) == list(range(1, 13))
+
+
+def test_open_feed_blocks_until_refill(make_stream, make_samples):
+    """Test an empty queue of an open feed does not spin between the states."""
+    sm = make_stream(open_ended=True)
+    changes = []
+    sm.machine.after_state_change.append(lambda *args, **kwargs: changes.append(1))
+    runner = threading.Thread(target=sm.auto_run)
+    runner.start()
+    try:
+        while sm.state != "refill_tray":
+            time.sleep(0.01)
+        waiting = len(changes)
+        time.sleep(0.3)
+        assert len(changes) == waiting
+        assert sorted(routes(sm)) == list(range(1, 13))
+
+        sm.refill_tray(list(make_samples(2).values()))
+        while len(routes(sm)) < 14:
+            time.sleep(0.01)
+    finally:
+        sm.finish_feed()
+        runner.join(timeout=5)
+
+    assert sm.state == "finished"
+    assert sorted(routes(sm)) == list(range(1, 15))
+
+
+def test_open_ended_feed(make_stream, make_samples):
+    """Test samples added with a refill are processed before the drain."""
+    sm = make_stream(auto_refill=False, open_ended=True)
+    added = list(make_samples(3).values())
+
+    def operator(*args, **kwargs):
+        if sm.state != "refill_tray":
+            return
+        if sm.num_bottles == 12 and not sm.pending:
+            threading.Timer(0.05, sm.refill_tray, args=(added,)).start()
+        elif sm.num_bottles == 15 and not sm.pending:
+            threading.Timer(0.05, sm.finish_feed).start()
+        else:
+            threading.Timer(0.05, sm.refill_tray).start()
+
+    sm.machine.after_state_change.append(operator)
+    sm.auto_run()
+
+    assert sorted(routes(sm)) == list(range(1, 16))
+    assert sm.sample_config["samples"]["15"] == added[2]
+    assert sm.state == "finished"
+
+
+def test_stream_takes_the_planned_refills(make_stream, hardware_config_path):
+    """Test the stages of the stream start their refills and are timed."""
+    hardware = SimulatedHardware(hardware_config_path)
+    sm = make_stream(hardware=hardware)
+    hardware.attach(sm)
+    sm.prepare_pump()
+    assert sm.reagent_plan.refill_count
+    assert None not in [r.stage for r in sm.reagent_plan.refills]
+    sm.auto_run()
+
+    assert sm.state == "finished"
+    assert sm.stage_times
+    assert hardware.underruns == []
+    # Only the initial loads switch the valves of both pumps together, no
+    # refill was left for its sample
+    assert [r.action for r in hardware.records].count("switch_valves") == 2 * 2
+    aspirations = [r for r in hardware.records if r.action == "aspirate"]
+    assert len(aspirations) == 2 + sm.reagent_plan.refill_count
+
+
+def test_stream_is_journaled(make_stream, tmp_path):
+    sm = make_stream(hardware=SimulatedHardware())
+    journal = RunJournal(str(tmp_path / "run.journal"))
+    journal.attach(sm)
+    sm.auto_run()
+
+    states = [e for e in journal.entries() if e["type"] == "state"]
+    snapshots = [e["snapshot"] for e in states if e["state"] == "stream"]
+    assert [s["stage_count"] for s in snapshots] == list(range(sm.stage_count + 1))
+    assert snapshots[0]["tray"] == [1, 2, 3, 4, 5]
+    assert snapshots[0]["pending"] == list(range(6, 13))
+    assert snapshots[-1]["finished"] == list(range(1, 13))
+    assert snapshots[-1]["progress"] == []
@@ -0,0 +1,84 @@
+import os
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from mf_system.hardware.devices.pump import SyringePumpAdapter
+from mf_system.hardware.devices.pump_lib.qmixsdk.qmixpump import PumpStatus
+from mf_system.hardware.devices.telemetry import (
+    COLUMNS,
+    PumpTelemetry,
+    load_telemetry,
+)
+
+
+def record(telemetry, start, stop):
+    for i in range(start, stop):
+        telemetry.record(i, 0.1 * i, 0.01, 1.0 - 0.001 * i, 0.001 * i)
+
+
+def test_ring_keeps_the_latest_rows():
+    telemetry = PumpTelemetry("pump1", capacity=8, chunk_size=4)
+    record(telemetry, 0, 11)
+
+    assert telemetry.latest()[:, 0].tolist() == list(range(3, 11))
+    assert telemetry.latest(2)[:, 0].tolist() == [9, 10]
+    assert telemetry.last[0] == 10
+
+
+def test_command_saved_in_chunks(tmp_path):
+    telemetry = PumpTelemetry("pump1", str(tmp_path), capacity=8, chunk_size=4)
+    record(telemetry, 0, 3)  # before the command, not saved
+
+    path = telemetry.begin("dispense")
+    record(telemetry, 3, 20)  # wraps the ring twice
+    assert telemetry.end().result(timeout=5) == path
+
+    columns = load_telemetry(path)
+    assert set(columns) == set(COLUMNS)
+    assert columns["timestamp"].tolist() == list(range(3, 20))
+    np.testing.assert_allclose(columns["pressure"], 0.1 * np.arange(3, 20))
+    assert path.endswith("_0001_dispense.npz")
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_without_directory_nothing_is_saved(tmp_path):
+    telemetry = PumpTelemetry("pump1")
+
+    assert telemetry.begin() is None
+    record(telemetry, 0, 300)
+    assert telemetry.end() is None
+
+
+def test_capacity_must_hold_whole_chunks():
+    with pytest.raises(ValueError):
+        PumpTelemetry("pump1", capacity=10, chunk_size=4)
+
+
+def test_dosage_is_recorded(tmp_path, fast_monitor):
+    pump = SyringePumpAdapter(
+        {
+            "name": "Nemesys_M_2_Pump",
+            "pressure_limit": 10,
+            "inner_diameter_mm": 14.7,
+            "max_piston_stroke_mm": 60,
+            "telemetry_dir": str(tmp_path),
+        }
+    )
+    pump.pump = MagicMock()
+    pump.pump.read_status_snapshot.side_effect = [
+        PumpStatus(pumping, 0.01, 0.05, 0.5) for pumping in [True] * 5 + [False]
+    ]
+    pump.pressure_channel = MagicMock()
+    pump.pressure_channel.read_input.return_value = 2.5
+    pump.switch_valve_to = MagicMock()
+
+    assert pump.execute({"action": "dispense", "volume": 0.1, "flow": 0.01})
+
+    path = pump.telemetry.saved.result(timeout=5)
+    assert list(tmp_path.glob("*_dispense.npz")) == [tmp_path / os.path.basename(path)]
+    columns = load_telemetry(path)
+    assert len(columns["timestamp"]) == 6
+    assert set(columns["pressure"]) == {2.5}
+    assert set(columns["flow"]) == {0.01}
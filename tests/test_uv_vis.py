@@ -0,0 +1,139 @@
+import ctypes
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from mf_system.hardware.devices.uv_vis import RunningSpectrum, UVvisAdapter
+
+PIXELS = 8
+
+
+def pointer(values):
+    """POINTER(c_double) to a DLL-like buffer, as returned by SpecDLL."""
+    buffer = (ctypes.c_double * len(values))(*values)
+    return ctypes.cast(buffer, ctypes.POINTER(ctypes.c_double))
+
+
+def make_uvvis(spectra=None, **config):
+    adapter = UVvisAdapter(
+        {"integration_time": 100, "average": 3, "smoothing": 1, **config}
+    )
+    adapter._connection = connection = MagicMock()
+    adapter.FTHandle_ID = 1
+    connection.change_integration_time.return_value = True
+    connection.read_EEPROMCoeff.return_value = [200.0, 1.0, 0.0, 0.0]
+    connection.get_XData.return_value = [200.0 + i for i in range(PIXELS)]
+    # Keep the buffers alive, the adapter only holds pointers
+    adapter.buffers = spectra or [np.full(PIXELS + 2, 100.0)]
+    adapter.dark = np.full(PIXELS + 2, 10.0)
+    shutter = {"closed": False}
+    connection.switch_shutter.side_effect = lambda switch, handle: shutter.update(
+        closed=switch
+    )
+    scans = (adapter.buffers[i % len(adapter.buffers)] for i in range(10**6))
+    connection.get_YData.side_effect = lambda trigger, handle: pointer(
+        adapter.dark if shutter["closed"] else next(scans)
+    )
+    return adapter
+
+
+def test_wavelength_axis_is_read_once_per_connection():
+    uvvis = make_uvvis()
+
+    for _ in range(3):
+        wavelengths, spectrum = uvvis.measure()
+
+    connection = uvvis._connection
+    assert isinstance(wavelengths, np.ndarray)
+    assert wavelengths == pytest.approx(200.0 + np.arange(PIXELS))
+    assert spectrum == pytest.approx(np.full(PIXELS, 100.0))
+    connection.change_integration_time.assert_called_once_with(100, 1)
+    connection.read_EEPROMCoeff.assert_called_once()
+    connection.get_XData.assert_called_once()
+
+
+def test_integration_time_change_invalidates_the_axis():
+    uvvis = make_uvvis()
+    uvvis.measure()
+
+    uvvis.execute({"action": "change_integration_time", "int_time": 100})
+    uvvis.measure()
+    assert uvvis._connection.get_XData.call_count == 1
+
+    uvvis.execute({"action": "change_integration_time", "int_time": 200})
+    uvvis.measure()
+    assert uvvis._connection.get_XData.call_count == 2
+
+    uvvis.shutdown()
+    uvvis.measure()
+    assert uvvis._connection.get_XData.call_count == 3
+    assert uvvis._connection.change_integration_time.call_count == 3
+
+
+def test_spectra_are_copied_from_the_dll_buffer():
+    spectra = [np.arange(PIXELS + 2, dtype=float) * k for k in (1, 2, 3)]
+    uvvis = make_uvvis(spectra)
+
+    _, spectrum = uvvis.measure()
+    scans = uvvis._scans
+    uvvis.measure()
+
+    assert spectrum == pytest.approx(np.arange(PIXELS) * 2.0)
+    assert uvvis._scans is scans
+    assert scans.shape == (PIXELS,)
+    assert uvvis._connection.get_YData.call_count == 6
+
+
+def test_running_spectrum_matches_numpy():
+    scans = np.random.default_rng(0).normal(100.0, 2.0, (50, PIXELS))
+    spectrum = RunningSpectrum(PIXELS)
+    for scan in scans:
+        spectrum.add(scan)
+
+    assert spectrum.mean == pytest.approx(scans.mean(axis=0))
+    assert spectrum.variance == pytest.approx(scans.var(axis=0, ddof=1))
+    error = scans.std(axis=0, ddof=1) / np.sqrt(50) / scans.mean(axis=0)
+    assert spectrum.relative_error([0, 3]) == pytest.approx(error[[0, 3]])
+
+
+def test_averaging_stops_early_on_low_noise():
+    rng = np.random.default_rng(1)
+    spectra = [rng.normal(100.0, 0.1, PIXELS + 2) for _ in range(5)]
+    uvvis = make_uvvis(
+        spectra, average=1000, target_error=1e-3, target_wavelengths=[201, 205]
+    )
+
+    uvvis.measure()
+    assert uvvis.last_spectrum.count == 3
+
+    uvvis.target_error = 1e-9
+    uvvis.measure()
+    assert uvvis.last_spectrum.count == 1000
+
+
+def test_calibration_is_reused_until_it_expires_or_drifts():
+    now = [0.0]
+    uvvis = make_uvvis(shutter_settle=0, calibration_max_age=60)
+    uvvis.calibration.clock = lambda: now[0]
+    connection = uvvis._connection
+
+    first = uvvis.calibrate()
+    assert uvvis.calibrate() is first
+    assert connection.switch_shutter.call_count == 2
+    assert uvvis.calibration.acquisitions == 1
+
+    # Lamp drift of 10 %
+    uvvis.buffers[0] *= 1.1
+    assert uvvis.calibrate() is not first
+    assert uvvis.calibration.drifts == 1
+    assert uvvis.calibration.acquisitions == 2
+
+    now[0] = 61.0
+    uvvis.calibrate()
+    assert uvvis.calibration.acquisitions == 3
+
+    uvvis.execute({"action": "change_integration_time", "int_time": 200})
+    uvvis.calibrate()
+    assert uvvis.calibration.acquisitions == 4
+    assert connection.switch_shutter.call_args.args == (False, 1)
@@ -0,0 +1,73 @@
+import asyncio
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from mf_system.hardware.devices.pump import SyringePumpAdapter
+from mf_system.hardware.hardware import HardwareManager
+
+
+def test_switch_settles_without_fixed_sleep(make_pump):
+    pump = make_pump("Nemesys_M_2_Pump", [])
+
+    started = time.perf_counter()
+    pump.switch_valve_to(2)
+    asyncio.run(pump.switch_valve_to_async(0))
+
+    assert time.perf_counter() - started < 0.5
+    assert pump.valve.position == 0
+    stats = pump.valve_settle_stats()
+    assert stats["count"] == 2
+    assert 0 < stats["p50"] <= stats["p95"] <= stats["max"] < 0.25
+
+
+def test_switch_timeout(make_pump):
+    pump = make_pump("Nemesys_M_2_Pump", [], reads=10_000, valve_timeout=0.05)
+
+    with pytest.raises(RuntimeError):
+        pump.switch_valve_to(1)
+    assert pump.valve_settle_stats() == {"count": 0}
+
+
+def test_grouped_switch_sends_all_commands_first(make_pump):
+    calls = []
+    pumps = [make_pump(f"Nemesys_M_{i}_Pump", calls) for i in range(3)]
+
+    SyringePumpAdapter.switch_valves({pump: 1 for pump in pumps})
+
+    assert calls[:3] == [("switch", 1)] * 3
+    assert all(pump.valve.position == 1 for pump in pumps)
+    assert all(pump.valve_settle_stats()["count"] == 1 for pump in pumps)
+
+
+def test_manager_waits_for_the_pump_lanes(make_pump, tmp_path):
+    hwm = HardwareManager(str(tmp_path / "hardware_config.yaml"))
+    calls = []
+    pumps = {"pump1": make_pump("p1", calls), "pump2": make_pump("p2", calls)}
+    hwm.adapters["Pumps"] = pumps
+    for pump in pumps.values():
+        pump.execute = MagicMock(
+            side_effect=lambda command: calls.append(("dose",)) or time.sleep(0.05)
+        )
+
+    hwm.submit_command("Pumps", {"action": "dispense"}, "pump1")
+    hwm.switch_valves({"pump1": 2, "pump2": 2})
+    hwm.executor.shutdown()
+
+    assert calls[0] == ("dose",)
+    assert calls[1:3] == [("switch", 2)] * 2
+
+
+def test_batched_aspirate_leaves_the_valve(make_pump):
+    calls = []
+    pump = make_pump("Nemesys_M_2_Pump", calls)
+    pump.pump = MagicMock()
+    pump.wait_dosage_finished = MagicMock(return_value=True)
+
+    assert pump.execute(
+        {"action": "aspirate", "volume": 1, "flow": 0.1, "valve": False}
+    )
+    assert calls == []
+    assert pump.execute({"action": "aspirate", "volume": 1, "flow": 0.1})
+    assert ("switch", 1) in calls and calls[-1] == ("read", 0)
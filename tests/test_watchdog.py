@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+from mf_system.hardware.simulator import SimulatedHardware
+from mf_system.logic.watchdog import StageWatchdog
+
+
+class SlowDLSHardware(SimulatedHardware):
+    """Simulated cell whose DLS takes real time to deliver its data."""
+
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+        self.dls_runs = 0
+
+    def _execute(self, device, command, pump_name=None):
+        if device == "DLS" and command["action"] == "request_data":
+            self.dls_runs += 1
+            time.sleep(self.delay)
+        return super()._execute(device, command, pump_name)
+
+
+@pytest.fixture
+def sample_options():
+    return {"num_samples": 3}
+
+
+def test_overrun_names_the_stalling_station(make_pipeline):
+    sm = make_pipeline(SlowDLSHardware(delay=0.2))
+    watchdog = StageWatchdog({"measure_DLS": 0.05}, interval=0.01).attach(sm)
+    sm.auto_run()
+    watchdog.stop()
+
+    assert len(watchdog.overruns) == 3
+    assert {o.station for o in watchdog.overruns} == {"measure_DLS"}
+    assert sorted(o.bottle for o in watchdog.overruns) == [1, 2, 3]
+    assert all(o.elapsed > o.budget == 0.05 for o in watchdog.overruns)
+    assert watchdog.bottleneck == "measure_DLS"
+    assert [t.state for t in watchdog.timings][-1] == sm.schedule.states[-1]
+    assert sm.skipped_actions == []
+
+
+def test_degrade_skips_the_next_bottle(make_pipeline):
+    """Test the running measurement finishes, the following one is skipped."""
+    hardware = SlowDLSHardware(delay=0.2)
+    sm = make_pipeline(hardware)
+    watchdog = StageWatchdog({"measure_DLS": 0.05}, interval=0.01, degrade=True)
+    watchdog.attach(sm)
+    sm.auto_run()
+    watchdog.stop()
+
+    assert watchdog.overruns[0].bottle == 1
+    assert [(a.name, a.bottle) for a in sm.skipped_actions] == [("measure_DLS", 2)]
+    assert hardware.dls_runs == 2
+    assert sm.state == sm.schedule.states[-1]
+
+
+def test_transfers_are_never_degraded(make_pipeline):
+    sm = make_pipeline(SimulatedHardware())
+
+    for station in ("pump_to_measure", "fill_bottle", "rotate_table_m"):
+        assert sm.degrade(station, 1) is False
+    assert sm.degrade("measure_UV", 1) is True
+    assert sm.degraded_stations == {"measure_UV": 1}
+
+
+def test_degrade_is_keyed_on_the_stalled_bottle(make_pipeline):
+    """Test bottles at or before the stalled one keep their measurement."""
+    sm = make_pipeline(SimulatedHardware())
+    sm.degrade("measure_DLS", 2)
+    sm.auto_run()
+
+    assert [(a.name, a.bottle) for a in sm.skipped_actions] == [("measure_DLS", 3)]
+    assert sm.degraded_stations == {}
+
+
+def test_state_budget_without_overrun(make_pipeline):
+    sm = make_pipeline(SimulatedHardware())
+    watchdog = StageWatchdog({}, default_budget=10.0, interval=0.01).attach(sm)
+    sm.auto_run()
+    watchdog.stop()
+
+    assert watchdog.overruns == []
+    assert watchdog.bottleneck is None
+    assert all(t.budget == 10.0 for t in watchdog.timings)